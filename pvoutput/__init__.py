@@ -1,3 +1,11 @@
+from .asyncpvoutput import AsyncPVOutput
+from .cache import ResponseCache
+from .keypool import PVOutputKeyPool
+from .load import iter_timeseries, load_timeseries
 from .pvoutput import *
+from .quotaledger import QuotaLedger
+from .ratelimit import RateLimiter
+from .simulator import PVOutputSimulator
+from .transport import RecordingTransport, ReplayTransport, RequestsTransport, Transport
 
 __version__ = 0.1
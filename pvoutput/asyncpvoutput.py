@@ -0,0 +1,332 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Dict, Optional, Union
+
+import pandas as pd
+
+from pvoutput.exceptions import NoStatusFound, RateLimitExceeded
+from pvoutput.pvoutput import (
+    PVOutput,
+    _fill_statistic_dates,
+    _get_batch_status_api_params,
+    _get_insolation_api_params,
+    _get_metadata_api_params,
+    _get_search_api_params,
+    _get_statistic_api_params,
+    _get_status_api_params,
+    _process_batch_status,
+    _process_insolation,
+    _process_search_results,
+    _process_statistic,
+    _process_status,
+    _process_system_metadata,
+)
+from pvoutput.ratelimit import API, DATA_SERVICE
+from pvoutput.utils import _print_and_log
+
+_LOG = logging.getLogger("pvoutput")
+
+
+class _RequestScheduler:
+    """Limits the number of in-flight requests.
+
+    At most `max_concurrent_requests` requests are in flight at once, and
+    never more than `client.rate_limit_remaining`, so a burst of requests
+    can't overshoot the quota.  Until the first response tells us the quota,
+    only one request is allowed in flight.
+    """
+
+    def __init__(self, client: PVOutput, max_concurrent_requests: int):
+        self.client = client
+        self.max_concurrent_requests = max_concurrent_requests
+        self.num_in_flight = 0
+        self._condition = asyncio.Condition()
+
+    def budget(self) -> int:
+        """The maximum number of requests which may be in flight right now."""
+        remaining = self.client.rate_limit_remaining
+        reset_time = self.client.rate_limit_reset_time
+        if remaining is None:
+            return 1
+        if remaining <= 0 and reset_time is not None and pd.Timestamp.utcnow() >= reset_time:
+            # The quota has been reset, but we don't know the new quota yet.
+            return 1
+        return max(min(self.max_concurrent_requests, remaining), 0)
+
+    def _secs_until_reset(self) -> Optional[float]:
+        reset_time = self.client.rate_limit_reset_time
+        if reset_time is None:
+            return None
+        return max((reset_time - pd.Timestamp.utcnow()).total_seconds(), 0) + 1
+
+    async def __aenter__(self):
+        async with self._condition:
+            while self.num_in_flight >= self.budget():
+                timeout = None
+                if self.num_in_flight == 0:
+                    # No responses are on their way to update the quota,
+                    # so wake up when the quota is reset.
+                    timeout = self._secs_until_reset()
+                    _LOG.info("Rate limit budget exhausted.  Waiting %s seconds.", timeout)
+                try:
+                    await asyncio.wait_for(self._condition.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            self.num_in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._condition:
+            self.num_in_flight -= 1
+            self._condition.notify_all()
+
+
+class AsyncPVOutput:
+    """asyncio version of PVOutput.
+
+    The API methods are coroutines which return exactly what the equivalent
+    PVOutput methods return.  Requests are sent by a wrapped `PVOutput`
+    (`self.client`) from a thread pool, so many requests can be in flight
+    at once, e.g.:
+
+        pv = AsyncPVOutput(max_concurrent_requests=10)
+        statuses = await asyncio.gather(
+            *[pv.get_status(pv_system_id, date) for date in dates])
+
+    Anything which may block (sending requests, and reading and writing the
+    response cache and the quota ledger) runs in the thread pool, never on
+    the event loop.  For the methods which don't have a coroutine version
+    (e.g. `download_multiple_systems_to_disk`), use `self.client`.
+
+    Attributes:
+        client: The wrapped PVOutput.
+        max_concurrent_requests
+    """
+
+    def __init__(self, *args, max_concurrent_requests: int = 10, **kwargs):
+        """
+        Args:
+            max_concurrent_requests: The maximum number of requests in flight.
+                The number of requests in flight is also limited by
+                `rate_limit_remaining`.
+            *args, **kwargs: Passed to PVOutput.
+        """
+        kwargs.setdefault("pool_maxsize", max_concurrent_requests)
+        self.client = PVOutput(*args, **kwargs)
+        self.max_concurrent_requests = max_concurrent_requests
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_requests)
+        self._scheduler = None
+        self._scheduler_loop = None
+
+    @property
+    def rate_limit_remaining(self) -> Optional[int]:
+        return self.client.rate_limit_remaining
+
+    @property
+    def rate_limit_total(self) -> Optional[int]:
+        return self.client.rate_limit_total
+
+    @property
+    def rate_limit_reset_time(self) -> Optional[pd.Timestamp]:
+        return self.client.rate_limit_reset_time
+
+    def rate_limit_info(self) -> Dict:
+        return self.client.rate_limit_info()
+
+    def _get_scheduler(self) -> _RequestScheduler:
+        # asyncio.Condition is bound to one event loop, so each event loop
+        # (e.g. each call to asyncio.run) gets its own scheduler.
+        loop = asyncio.get_running_loop()
+        if self._scheduler_loop is not loop:
+            self._scheduler = _RequestScheduler(self.client, self.max_concurrent_requests)
+            self._scheduler_loop = loop
+        return self._scheduler
+
+    async def _run_in_executor(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def search(
+        self,
+        query: str,
+        lat: Optional[float] = None,
+        lon: Optional[float] = None,
+        include_country: bool = True,
+        **kwargs
+    ) -> pd.DataFrame:
+        """Search for PV systems.  See `PVOutput.search`."""
+        api_params = _get_search_api_params(query, lat, lon, include_country)
+        pv_systems_text = await self._api_query(service="search", api_params=api_params, **kwargs)
+        return _process_search_results(pv_systems_text)
+
+    async def get_status(
+        self, pv_system_id: int, date: Union[str, datetime], historic: bool = True, **kwargs
+    ) -> pd.DataFrame:
+        """Get PV system status for one day.  See `PVOutput.get_status`."""
+        _LOG.info("system_id %d: Requesting system status for %s", pv_system_id, date)
+        api_params = _get_status_api_params(pv_system_id, date, historic)
+
+        try:
+            pv_system_status_text = await self._api_query(
+                service="getstatus", api_params=api_params, **kwargs
+            )
+        except NoStatusFound:
+            _LOG.info("system_id %d: No status found for date %s", pv_system_id, api_params["d"])
+            pv_system_status_text = ""
+
+        return _process_status(pv_system_status_text, historic)
+
+    async def get_batch_status(
+        self,
+        pv_system_id: int,
+        date_to: Optional[Union[str, datetime]] = None,
+        max_retries: Optional[int] = 1000,
+        **kwargs
+    ) -> Union[None, pd.DataFrame]:
+        """Get batch PV system status.  See `PVOutput.get_batch_status`.
+
+        Waiting for the data service to prepare the data doesn't block other
+        requests.
+        """
+        api_params = _get_batch_status_api_params(pv_system_id, date_to)
+
+        for retry in range(max_retries):
+            try:
+                pv_system_status_text = await self._api_query(
+                    service="getbatchstatus", api_params=api_params, use_data_service=True, **kwargs
+                )
+            except NoStatusFound:
+                _LOG.info("system_id %d: No status found for date_to %s", pv_system_id, date_to)
+                pv_system_status_text = ""
+                break
+
+            if "Accepted 202" in pv_system_status_text:
+                if retry == 0:
+                    _print_and_log("Request accepted.")
+                if retry < max_retries - 1:
+                    _print_and_log("Sleeping for 1 minute.")
+                    await asyncio.sleep(60)
+                else:
+                    _print_and_log(
+                        "Call get_batch_status again in a minute to see if" " results are ready."
+                    )
+            else:
+                break
+        else:
+            return
+
+        return _process_batch_status(pv_system_status_text)
+
+    async def get_metadata(self, pv_system_id: int, **kwargs) -> pd.Series:
+        """Get metadata for a single PV system.  See `PVOutput.get_metadata`."""
+        pv_metadata_text = await self._api_query(
+            service="getsystem", api_params=_get_metadata_api_params(pv_system_id), **kwargs
+        )
+        return _process_system_metadata(pv_metadata_text, pv_system_id)
+
+    async def get_statistic(
+        self,
+        pv_system_id: int,
+        date_from: Optional[Union[str, date]] = None,
+        date_to: Optional[Union[str, date]] = None,
+        **kwargs
+    ) -> pd.DataFrame:
+        """Get summary stats for a single PV system.  See `PVOutput.get_statistic`."""
+        date_from, date_to = _fill_statistic_dates(date_from, date_to)
+        api_params = _get_statistic_api_params(pv_system_id, date_from, date_to)
+
+        try:
+            pv_metadata_text = await self._api_query(
+                service="getstatistic", api_params=api_params, **kwargs
+            )
+        except NoStatusFound:
+            pv_metadata_text = ""
+
+        return _process_statistic(pv_metadata_text, pv_system_id, date_from, date_to)
+
+    async def get_insolation_forecast(
+        self,
+        date: Union[str, datetime],
+        pv_system_id: Optional[int] = None,
+        timezone: Optional[str] = None,
+        lat: Optional[float] = None,
+        lon: Optional[float] = None,
+        **kwargs
+    ) -> pd.DataFrame:
+        """Get insolation data.  See `PVOutput.get_insolation_forecast`."""
+        api_params = _get_insolation_api_params(date, pv_system_id, timezone, lat, lon)
+        try:
+            pv_insolation_text = await self._api_query(
+                service="getinsolation", api_params=api_params, **kwargs
+            )
+        except NoStatusFound:
+            _LOG.info("system_id %d: No status found for date %s", pv_system_id, api_params["d"])
+            pv_insolation_text = ""
+
+        return _process_insolation(pv_insolation_text, api_params["d"])
+
+    async def _api_query(
+        self,
+        service: str,
+        api_params: Dict,
+        wait_if_rate_limit_exceeded: bool = False,
+        use_data_service: bool = False,
+    ) -> str:
+        """Send API request to PVOutput.org and return content text.
+
+        See `PVOutput._api_query`.
+        """
+        client = self.client
+        response_cache = client.response_cache
+        if response_cache is not None:
+            content = await self._run_in_executor(
+                response_cache.get, service, api_params, use_data_service
+            )
+            if content is not None:
+                return content
+
+        get_response_func = (
+            client._get_data_service_response if use_data_service else client._get_api_response
+        )
+        bucket_name = DATA_SERVICE if use_data_service else API
+        while True:
+            secs_to_wait = await self._run_in_executor(client._reserve_request, bucket_name)
+            if secs_to_wait <= 0:
+                break
+            await asyncio.sleep(secs_to_wait)
+
+        async with self._get_scheduler():
+            try:
+                response = await self._run_in_executor(get_response_func, service, api_params)
+            except Exception as e:
+                _LOG.exception(e)
+                raise
+
+            await self._run_in_executor(client._update_quotas, bucket_name, response.headers)
+
+            try:
+                content = client._process_api_response(response)
+            except RateLimitExceeded:
+                msg = (
+                    "PVOutput.org API rate limit exceeded!"
+                    "  Rate limit will be reset at {}".format(client.rate_limit_reset_time)
+                )
+                _print_and_log(msg)
+                if not wait_if_rate_limit_exceeded:
+                    raise RateLimitExceeded(response, msg)
+            else:
+                if response_cache is not None:
+                    await self._run_in_executor(
+                        response_cache.put, service, api_params, content, use_data_service
+                    )
+                return content
+
+        # The scheduler holds back new requests until the rate limit is reset.
+        return await self._api_query(
+            service,
+            api_params,
+            wait_if_rate_limit_exceeded=False,
+            use_data_service=use_data_service,
+        )
@@ -0,0 +1,534 @@
+"""Storage backends: where the tables described in docs/dataset.md live.
+
+`StoreWriter` and the helpers in `utils` only talk to a `StorageBackend`, so
+the same download pipeline can write to either:
+
+- `HDFBackend`: A single HDF5 file, with one `/timeseries/<pv_system_id>`
+  table per PV system.  The original format.
+- `ParquetBackend`: A directory of Parquet files, with the timeseries
+  partitioned by PV system and year.  Reading one day across thousands of
+  PV systems is one multi-threaded scan, instead of opening thousands of
+  PyTables nodes.  Needs `pyarrow`, which is only imported when a
+  `ParquetBackend` is created.
+
+Use `open_backend` to pick the backend from the filename.
+"""
+
+import glob
+import logging
+import os
+import shutil
+from abc import ABC, abstractmethod
+from typing import Iterable, List, Optional, Tuple, Union
+
+import pandas as pd
+
+from pvoutput.catalog import SYSTEMS_KEY
+from pvoutput.coverage import COVERAGE_KEY, DOWNLOADED
+from pvoutput.hdf import (
+    HDF_BACKUP_SUFFIX,
+    MISSING_DATES_KEY,
+    append_and_merge_pv_system,
+    recover_replaced_hdf_table,
+    replace_hdf_table,
+    system_id_to_hdf_key,
+)
+from pvoutput.statistics import STATISTICS_KEY
+
+_LOG = logging.getLogger("pvoutput")
+
+PARQUET_SUFFIX = ".parquet"
+
+# Options for appending to each table of an HDF5 store.
+_HDF_APPEND_KWARGS = {
+    # Only index the PV system ID (see `hdf.compact_missing_dates`).
+    MISSING_DATES_KEY: dict(data_columns=True, index=["index"]),
+    COVERAGE_KEY: dict(data_columns=True, min_itemsize={"kind": len(DOWNLOADED)}),
+    SYSTEMS_KEY: dict(data_columns=True, index=["index"]),
+}
+# The tables which `replace_table` re-writes.
+_REPLACEABLE_KEYS = [MISSING_DATES_KEY, STATISTICS_KEY, COVERAGE_KEY, SYSTEMS_KEY]
+
+
+class StorageBackend(ABC):
+    """The tables of a PV dataset.
+
+    Keys are the names used in docs/dataset.md: `missing_dates`,
+    `statistics`, `coverage`, `systems`, and `/timeseries/<pv_system_id>`.  The small
+    tables are indexed by PV system ID.  Timeseries are indexed by datetime.
+
+    Backends are not thread-safe: only one thread should use each backend.
+    """
+
+    @abstractmethod
+    def __contains__(self, key: str) -> bool:
+        pass
+
+    def system_ids(self) -> List[int]:
+        """The sorted IDs of the PV systems with timeseries in the store.
+
+        Read from the system catalog (see `pvoutput.catalog`) if the store
+        has one, else found by `scan_system_ids`.
+        """
+        if SYSTEMS_KEY in self:
+            index = self.read_table(SYSTEMS_KEY, columns=[]).index
+            return sorted(index.unique().astype(int).tolist())
+        return self.scan_system_ids()
+
+    @abstractmethod
+    def scan_system_ids(self) -> List[int]:
+        """Like `system_ids`, but list the timeseries tables instead of
+        reading the catalog.  Slow for large HDF5 stores."""
+
+    @abstractmethod
+    def timeseries_size(self, pv_system_id: int) -> Tuple[int, int]:
+        """The number of rows, and the bytes on disk, of one PV system's timeseries."""
+
+    @abstractmethod
+    def read_timeseries(
+        self,
+        pv_system_id: int,
+        start: Optional[pd.Timestamp] = None,
+        end: Optional[pd.Timestamp] = None,
+        columns: Optional[List[str]] = None,
+    ) -> pd.DataFrame:
+        """Read the timeseries of one PV system, from start to end inclusive.
+
+        Args:
+            start, end: Naive bounds are local time to the PV system: they're
+                compared in the timezone of the stored timeseries, if it has one.
+            columns: The columns to read.  Columns which aren't in the table
+                are left out.  If None, then read all columns.
+
+        Raises:
+            KeyError: If the PV system isn't in the store.
+        """
+
+    def read_timeseries_many(
+        self,
+        pv_system_ids: Iterable[int],
+        start: Optional[pd.Timestamp] = None,
+        end: Optional[pd.Timestamp] = None,
+        columns: Optional[List[str]] = None,
+    ) -> pd.DataFrame:
+        """Read the timeseries of many PV systems.
+
+        PV systems which aren't in the store are skipped.
+
+        Returns:
+            pd.DataFrame indexed by pv_system_id and datetime.
+        """
+        timeseries = {}
+        for pv_system_id in pv_system_ids:
+            try:
+                timeseries[pv_system_id] = self.read_timeseries(pv_system_id, start, end, columns)
+            except KeyError:
+                continue
+        if not timeseries:
+            return pd.DataFrame()
+        return pd.concat(timeseries, names=["pv_system_id"])
+
+    @abstractmethod
+    def append_timeseries(self, pv_system_id: int, timeseries: pd.DataFrame) -> int:
+        """Append rows, keeping the timeseries sorted and de-duplicated.
+
+        Where the existing and new rows have the same index, the existing row
+        is kept.  See `hdf.append_and_merge_pv_system`.
+
+        Returns:
+            The number of existing rows which were re-written.
+        """
+
+    @abstractmethod
+    def read_table(
+        self, key: str, pv_system_id: Optional[int] = None, columns: Optional[List[str]] = None
+    ) -> pd.DataFrame:
+        """Read a table (or just the rows for one PV system).
+
+        Raises:
+            KeyError: If the table isn't in the store.
+        """
+
+    @abstractmethod
+    def append_table(self, key: str, df: pd.DataFrame):
+        pass
+
+    @abstractmethod
+    def replace_table(self, key: str, df: pd.DataFrame):
+        """Replace a table, without ever leaving the store without it.
+
+        If `df` is empty then the table is removed.
+        """
+
+    def flush(self):
+        """Make sure everything written so far is on disk."""
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class HDFBackend(StorageBackend):
+    def __init__(
+        self, filename_or_store: Union[str, pd.HDFStore], mode: str = "a", complevel: int = 9
+    ):
+        """
+        Args:
+            filename_or_store: HDF5 filename, or an open `pd.HDFStore` (which
+                `close` leaves open).
+            mode: 'a' or 'r'.  In 'a' mode, any `replace_table` which was
+                interrupted is undone (see `hdf.recover_replaced_hdf_table`).
+                In 'r' mode, such tables are read from their backups.
+            complevel: Compression level of the HDF5 file.
+        """
+        if isinstance(filename_or_store, pd.HDFStore):
+            self.store = filename_or_store
+            self._owns_store = False
+        else:
+            self.store = pd.HDFStore(filename_or_store, mode=mode, complevel=complevel)
+            self._owns_store = True
+        # Maps the key of each table which is only left as a backup to the backup.
+        self._backup_keys = {}
+        for key in _REPLACEABLE_KEYS:
+            if mode == "r":
+                if key not in self.store and key + HDF_BACKUP_SUFFIX in self.store:
+                    self._backup_keys[key] = key + HDF_BACKUP_SUFFIX
+            else:
+                recover_replaced_hdf_table(self.store, key)
+
+    def __contains__(self, key: str) -> bool:
+        return self._backup_keys.get(key, key) in self.store
+
+    def scan_system_ids(self) -> List[int]:
+        if "/timeseries" not in self.store:
+            return []
+        return sorted(pd.to_numeric(list(self.store.walk("/timeseries"))[0][2]).tolist())
+
+    def timeseries_size(self, pv_system_id):
+        table = self.store.get_storer(system_id_to_hdf_key(pv_system_id)).table
+        return int(table.nrows), int(table.size_on_disk)
+
+    def read_timeseries(self, pv_system_id, start=None, end=None, columns=None):
+        key = system_id_to_hdf_key(pv_system_id)
+        if start is None and end is None and columns is not None:
+            # Reading a few whole columns is much faster than `select`.
+            index = pd.DatetimeIndex(self.store.select_column(key, "index"), name="datetime")
+            timeseries = pd.DataFrame(index=index)
+            for column in columns:
+                try:
+                    timeseries[column] = self.store.select_column(key, column).values
+                except KeyError:
+                    # Stores written by early versions have no query_date column.
+                    pass
+            return timeseries
+
+        storer = self.store.get_storer(key)
+        # Compare the bounds in the timezone of the index (if any), like
+        # `ParquetBackend._scan_timeseries`.
+        tz = storer.info.get("index", {}).get("tz")
+        where = []
+        if start is not None:
+            start = _to_timezone_of(pd.Timestamp(start), tz)
+            where.append("index >= start")
+        if end is not None:
+            end = _to_timezone_of(pd.Timestamp(end), tz)
+            where.append("index <= end")
+        if columns is not None:
+            table_columns = storer.non_index_axes[0][1]
+            columns = [column for column in columns if column in table_columns]
+        return self.store.select(key, where=" & ".join(where) or None, columns=columns)
+
+    def append_timeseries(self, pv_system_id, timeseries):
+        return append_and_merge_pv_system(self.store, pv_system_id, timeseries)
+
+    def read_table(self, key, pv_system_id=None, columns=None):
+        key = self._backup_keys.get(key, key)
+        if pv_system_id is None:
+            return self.store.select(key, columns=columns)
+        return self.store.select(key, where="index=pv_system_id", columns=columns)
+
+    def append_table(self, key, df):
+        if not df.empty:
+            self.store.append(key, df, **_HDF_APPEND_KWARGS.get(key, {}))
+
+    def replace_table(self, key, df):
+        kwargs = _HDF_APPEND_KWARGS.get(key, {})
+        if key == MISSING_DATES_KEY:
+            replace_hdf_table(
+                self.store, key, df, full_index_columns=kwargs["index"], data_columns=True
+            )
+        else:
+            replace_hdf_table(self.store, key, df, **kwargs)
+
+    def flush(self):
+        self.store.flush(fsync=True)
+
+    def close(self):
+        if self._owns_store:
+            self.store.close()
+
+
+class ParquetBackend(StorageBackend):
+    """A directory of Parquet files.
+
+    Layout:
+
+        <path>/timeseries/pv_system_id=<id>/year=<yyyy>/part-<n>.parquet
+        <path>/<key>/part-<n>.parquet  (missing_dates, statistics, coverage, systems)
+
+    The partition directories use Hive naming, so the whole directory can
+    also be read with `pyarrow.dataset` (or Spark, DuckDB, etc.).
+    Timeseries are partitioned by the local year of each row.  Appending
+    rows after the end of a year's data writes a new part; appending rows
+    which overlap the existing data re-writes that year as one part.  Each
+    file is written under a temporary name and then renamed, so a killed
+    process never leaves a half-written part.  Reads are multi-threaded,
+    only read the requested columns, and skip partitions (and row groups)
+    which are outside the requested PV systems and dates.
+    """
+
+    def __init__(self, path: str, mode: str = "a", compression: str = "zstd"):
+        """
+        Args:
+            path: Directory.  Created if it doesn't exist (unless mode is 'r').
+            mode: 'a' or 'r'.
+            compression: Parquet compression codec.
+        """
+        self.pa, self.pq, self.ds = _import_pyarrow()
+        self.path = path
+        self.mode = mode
+        self.compression = compression
+        if mode == "r":
+            if not os.path.isdir(path):
+                raise FileNotFoundError(path)
+        else:
+            os.makedirs(path, exist_ok=True)
+            self._recover_replaced_tables()
+
+    def __contains__(self, key: str) -> bool:
+        key = key.strip("/")
+        if key.startswith("timeseries/"):
+            return os.path.isdir(self._system_dir(int(key.split("/")[1])))
+        return bool(_list_parts(self._table_dir(key)))
+
+    def scan_system_ids(self) -> List[int]:
+        timeseries_dir = os.path.join(self.path, "timeseries")
+        if not os.path.isdir(timeseries_dir):
+            return []
+        return sorted(
+            int(name.split("=")[1])
+            for name in os.listdir(timeseries_dir)
+            if name.startswith("pv_system_id=")
+        )
+
+    def timeseries_size(self, pv_system_id):
+        # Counts rows twice if a re-write of a year was interrupted.
+        parts = glob.glob(os.path.join(self._system_dir(pv_system_id), "year=*", "part-*.parquet"))
+        num_rows = sum(self.pq.read_metadata(part).num_rows for part in parts)
+        return num_rows, sum(os.path.getsize(part) for part in parts)
+
+    def read_timeseries(self, pv_system_id, start=None, end=None, columns=None):
+        system_dir = self._system_dir(pv_system_id)
+        if not os.path.isdir(system_dir):
+            raise KeyError(system_id_to_hdf_key(pv_system_id))
+        partitioning = self.ds.partitioning(
+            self.pa.schema([("year", self.pa.int32())]), flavor="hive"
+        )
+        dataset = self.ds.dataset(system_dir, format="parquet", partitioning=partitioning)
+        df = self._scan_timeseries(dataset, start, end, columns)
+        return _sort_and_de_dupe(df.set_index("datetime"))
+
+    def read_timeseries_many(self, pv_system_ids, start=None, end=None, columns=None):
+        """Read many PV systems in one multi-threaded scan."""
+        timeseries_dir = os.path.join(self.path, "timeseries")
+        if not os.path.isdir(timeseries_dir):
+            return pd.DataFrame()
+        partitioning = self.ds.partitioning(
+            self.pa.schema([("pv_system_id", self.pa.int64()), ("year", self.pa.int32())]),
+            flavor="hive",
+        )
+        dataset = self.ds.dataset(timeseries_dir, format="parquet", partitioning=partitioning)
+        df = self._scan_timeseries(
+            dataset,
+            start,
+            end,
+            columns,
+            filter=self.ds.field("pv_system_id").isin(list(pv_system_ids)),
+        )
+        return _sort_and_de_dupe(df.set_index(["pv_system_id", "datetime"]))
+
+    def _scan_timeseries(self, dataset, start, end, columns, filter=None) -> pd.DataFrame:
+        datetime_type = dataset.schema.field("datetime").type
+        for bound, op in [(start, "__ge__"), (end, "__le__")]:
+            if bound is None:
+                continue
+            bound = _to_timezone_of(pd.Timestamp(bound), getattr(datetime_type, "tz", None))
+            condition = getattr(self.ds.field("year"), op)(bound.year) & getattr(
+                self.ds.field("datetime"), op
+            )(self.pa.scalar(bound, type=datetime_type))
+            filter = condition if filter is None else filter & condition
+
+        partition_names = ["pv_system_id", "year"]
+        names = [name for name in dataset.schema.names if name not in partition_names]
+        if columns is not None:
+            names = ["datetime"] + [name for name in columns if name in names]
+        if "pv_system_id" in dataset.schema.names:
+            names = ["pv_system_id"] + names
+        table = dataset.to_table(columns=names, filter=filter, use_threads=True)
+        return table.to_pandas()
+
+    def append_timeseries(self, pv_system_id, timeseries):
+        self._check_writable()
+        if timeseries.empty:
+            return 0
+        timeseries = _sort_and_de_dupe(timeseries.rename_axis("datetime"))
+        num_rows_rewritten = 0
+        for year, rows in timeseries.groupby(timeseries.index.year):
+            year_dir = os.path.join(self._system_dir(pv_system_id), "year={:d}".format(year))
+            num_rows_rewritten += self._append_year(year_dir, rows)
+        return num_rows_rewritten
+
+    def _append_year(self, year_dir: str, timeseries: pd.DataFrame) -> int:
+        parts = _list_parts(year_dir)
+        if not parts:
+            os.makedirs(year_dir, exist_ok=True)
+            self._write_part(timeseries.reset_index(), _part_filename(year_dir, 0))
+            return 0
+
+        dataset = self.ds.dataset(parts, format="parquet")
+        existing_datetimes = dataset.to_table(columns=["datetime"]).to_pandas()["datetime"]
+        if timeseries.index[0] > existing_datetimes.max():
+            # The new rows come after the existing rows, so just add a part.
+            self._write_part(
+                timeseries.reset_index(),
+                _part_filename(year_dir, _part_number(parts[-1]) + 1),
+                schema=self.pq.read_schema(parts[-1]),
+            )
+            return 0
+
+        existing = dataset.to_table().to_pandas().set_index("datetime")
+        merged = _sort_and_de_dupe(pd.concat([existing, timeseries]))
+        # Replace the first part, and only then remove the others.  If the
+        # process is killed in between, then rows are duplicated (and
+        # de-duplicated when read), never lost.
+        self._write_part(merged.reset_index(), parts[0])
+        for part in parts[1:]:
+            os.remove(part)
+        return len(existing)
+
+    def read_table(self, key, pv_system_id=None, columns=None):
+        parts = _list_parts(self._table_dir(key))
+        if not parts:
+            raise KeyError(key)
+        dataset = self.ds.dataset(parts, format="parquet")
+        filter = None if pv_system_id is None else self.ds.field("pv_system_id") == pv_system_id
+        names = None if columns is None else ["pv_system_id"] + list(columns)
+        table = dataset.to_table(columns=names, filter=filter, use_threads=True)
+        return table.to_pandas().set_index("pv_system_id")
+
+    def append_table(self, key, df):
+        self._check_writable()
+        if df.empty:
+            return
+        table_dir = self._table_dir(key)
+        parts = _list_parts(table_dir)
+        os.makedirs(table_dir, exist_ok=True)
+        self._write_part(
+            df.rename_axis("pv_system_id").reset_index(),
+            _part_filename(table_dir, _part_number(parts[-1]) + 1 if parts else 0),
+            schema=self.pq.read_schema(parts[-1]) if parts else None,
+        )
+
+    def replace_table(self, key, df):
+        self._check_writable()
+        table_dir = self._table_dir(key)
+        tmp_dir = table_dir + ".tmp"
+        old_dir = table_dir + ".old"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        if not df.empty:
+            # Sorting by PV system ID lets reads skip row groups.
+            df = df.rename_axis("pv_system_id").sort_index(kind="mergesort")
+            self._write_part(df.reset_index(), _part_filename(tmp_dir, 0))
+        if os.path.isdir(table_dir):
+            os.rename(table_dir, old_dir)
+        os.rename(tmp_dir, table_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    def _recover_replaced_tables(self):
+        """Finish (or undo) any `replace_table` which was interrupted."""
+        for old_dir in glob.glob(os.path.join(self.path, "*.old")):
+            table_dir = old_dir[: -len(".old")]
+            if os.path.isdir(table_dir):
+                shutil.rmtree(old_dir)
+            else:
+                _LOG.warning("Restoring %s from an interrupted re-write", table_dir)
+                os.rename(old_dir, table_dir)
+        for tmp_dir in glob.glob(os.path.join(self.path, "*.tmp")):
+            shutil.rmtree(tmp_dir)
+
+    def _write_part(self, df: pd.DataFrame, filename: str, schema=None):
+        table = self.pa.Table.from_pandas(df, preserve_index=False)
+        if schema is not None and set(schema.names) == set(table.column_names):
+            # Keep every part of a table readable as one dataset.
+            table = table.select(schema.names).cast(schema)
+        tmp_filename = filename + ".tmp"
+        self.pq.write_table(table, tmp_filename, compression=self.compression)
+        os.replace(tmp_filename, filename)
+
+    def _check_writable(self):
+        if self.mode == "r":
+            raise ValueError("{} is open read-only".format(self.path))
+
+    def _system_dir(self, pv_system_id: int) -> str:
+        return os.path.join(self.path, "timeseries", "pv_system_id={:d}".format(pv_system_id))
+
+    def _table_dir(self, key: str) -> str:
+        return os.path.join(self.path, key.strip("/"))
+
+
+def open_backend(filename: str, mode: str = "a", **kwargs) -> StorageBackend:
+    """Open a `ParquetBackend` if filename ends with '.parquet' (or is a
+    directory), else an `HDFBackend`."""
+    if filename.rstrip("/").endswith(PARQUET_SUFFIX) or os.path.isdir(filename):
+        kwargs.pop("complevel", None)
+        return ParquetBackend(filename.rstrip("/"), mode=mode, **kwargs)
+    return HDFBackend(filename, mode=mode, **kwargs)
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("ParquetBackend needs pyarrow.  Try `pip install pyarrow`.") from e
+    return pyarrow, pyarrow.parquet, pyarrow.dataset
+
+
+def _list_parts(directory: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(directory, "part-*.parquet")), key=_part_number)
+
+
+def _part_number(filename: str) -> int:
+    return int(os.path.basename(filename)[len("part-") : -len(PARQUET_SUFFIX)])
+
+
+def _part_filename(directory: str, part_number: int) -> str:
+    return os.path.join(directory, "part-{:05d}{}".format(part_number, PARQUET_SUFFIX))
+
+
+def _sort_and_de_dupe(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.sort_index(kind="mergesort")
+    return df[~df.index.duplicated()]
+
+
+def _to_timezone_of(timestamp: pd.Timestamp, tz) -> pd.Timestamp:
+    if tz is None:
+        return timestamp if timestamp.tz is None else timestamp.tz_localize(None)
+    return timestamp.tz_localize(tz) if timestamp.tz is None else timestamp.tz_convert(tz)
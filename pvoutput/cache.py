@@ -0,0 +1,205 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import zlib
+from datetime import date, timedelta
+from typing import Dict, Iterator, Optional
+
+import pandas as pd
+
+from pvoutput.consts import RESPONSE_CACHE_DIR
+
+_LOG = logging.getLogger("pvoutput")
+
+# The date param of each service whose responses never change once that
+# date is in the past.
+_IMMUTABLE_SERVICES = {"getstatus": "d", "getbatchstatus": "dt", "getinsolation": "d"}
+
+
+class ResponseCache:
+    """Caches the responses to immutable API queries on disk.
+
+    A getstatus query for a past date, a getbatchstatus query for a year
+    which has ended, or a getinsolation query for a fixed date always gets
+    the same response.  ResponseCache stores those responses (compressed
+    with zlib) in `directory`, one file per query, named by the SHA-256 hash
+    of the service and params.  Every other query (including queries for
+    today or yesterday, which might be today in the PV system's timezone) is
+    never cached.
+
+    When the cache grows beyond `max_size_bytes`, the least recently used
+    files are deleted.  Files are written atomically, so several processes
+    can share one cache directory.
+
+    For example:
+
+        pv = PVOutput(response_cache=ResponseCache())
+    """
+
+    def __init__(self, directory: str = RESPONSE_CACHE_DIR, max_size_bytes: int = 2 * 1024**3):
+        """
+        Args:
+            directory: Created if it doesn't exist.
+            max_size_bytes: The maximum total size of the cached files.
+        """
+        self.directory = directory
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size_bytes = sum(os.path.getsize(filename) for filename in self._filenames())
+
+    def is_cacheable(self, service: str, api_params: Dict, today: Optional[date] = None) -> bool:
+        """Will the response to this query never change?"""
+        date_param = _IMMUTABLE_SERVICES.get(service)
+        if date_param is None or date_param not in api_params:
+            return False
+        if service == "getstatus" and str(api_params.get("h")) != "1":
+            return False
+        if today is None:
+            today = pd.Timestamp.utcnow().date()
+        query_date = pd.Timestamp(str(api_params[date_param])).date()
+        # Allow for PV systems whose local date is ahead of UTC.
+        return query_date < today - timedelta(days=1)
+
+    def get(self, service: str, api_params: Dict, use_data_service: bool = False) -> Optional[str]:
+        """Get a cached response.
+
+        Returns:
+            None if the response isn't cached.  Only queries which are
+            cacheable count as hits or misses.
+        """
+        if not self.is_cacheable(service, api_params):
+            return None
+        filename = self._filename(service, api_params, use_data_service)
+        try:
+            with open(filename, "rb") as fh:
+                text = zlib.decompress(fh.read()).decode("latin1")
+        except (FileNotFoundError, zlib.error):
+            with self._lock:
+                self.misses += 1
+            return None
+        # Touch the file, so eviction knows it was used recently.
+        try:
+            os.utime(filename)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self.hits += 1
+        _LOG.debug("Response cache hit for %s %s", service, api_params)
+        return text
+
+    def put(self, service: str, api_params: Dict, text: str, use_data_service: bool = False):
+        """Cache a response, if the query is immutable."""
+        if not self.is_cacheable(service, api_params) or "Accepted 202" in text:
+            return
+        self._write(service, api_params, use_data_service, zlib.compress(text.encode("latin1")))
+
+    def tee(
+        self,
+        service: str,
+        api_params: Dict,
+        chunks: Iterator[str],
+        use_data_service: bool = False,
+    ) -> Iterator[str]:
+        """Yield chunks of a streamed response, caching them as they pass.
+
+        The compressed chunks are written to a temporary file, which only
+        becomes part of the cache if all the chunks are consumed.
+        """
+        if not self.is_cacheable(service, api_params):
+            yield from chunks
+            return
+        filename = self._filename(service, api_params, use_data_service)
+        fh, tmp_filename = self._open_tmp_file(filename)
+        compressor = zlib.compressobj()
+        is_complete = False
+        try:
+            with fh:
+                for i, chunk in enumerate(chunks):
+                    if i == 0 and "Accepted 202" in chunk:
+                        yield chunk
+                        return
+                    fh.write(compressor.compress(chunk.encode("latin1")))
+                    yield chunk
+                fh.write(compressor.flush())
+            is_complete = True
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+            if is_complete:
+                self._commit(tmp_filename, filename)
+            else:
+                os.remove(tmp_filename)
+
+    def _write(self, service: str, api_params: Dict, use_data_service: bool, data: bytes):
+        filename = self._filename(service, api_params, use_data_service)
+        fh, tmp_filename = self._open_tmp_file(filename)
+        with fh:
+            fh.write(data)
+        self._commit(tmp_filename, filename)
+
+    def _open_tmp_file(self, filename: str):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(filename), suffix=".tmp")
+        return os.fdopen(fd, "wb"), tmp_filename
+
+    def _commit(self, tmp_filename: str, filename: str):
+        # os.replace is atomic, so readers never see a partly written file.
+        size = os.path.getsize(tmp_filename)
+        os.replace(tmp_filename, filename)
+        with self._lock:
+            self._size_bytes += size
+            if self._size_bytes > self.max_size_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Delete the least recently used files until the cache is 90% full."""
+        files = []
+        for filename in self._filenames():
+            try:
+                stat = os.stat(filename)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, filename))
+        files.sort()
+        self._size_bytes = sum(size for _, size, _ in files)
+        target_size = self.max_size_bytes * 0.9
+        num_evicted = 0
+        for _, size, filename in files:
+            if self._size_bytes <= target_size:
+                break
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+            self._size_bytes -= size
+            num_evicted += 1
+        _LOG.info("Response cache: evicted %d files", num_evicted)
+
+    def _filename(self, service: str, api_params: Dict, use_data_service: bool) -> str:
+        key = json.dumps(
+            [service, use_data_service, {k: str(v) for k, v in api_params.items()}],
+            sort_keys=True,
+        )
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + ".zlib")
+
+    def _filenames(self) -> Iterator[str]:
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.endswith(".zlib"):
+                    yield os.path.join(dirpath, filename)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size_bytes
+
+    def info(self) -> Dict:
+        """Hit and miss counts, and the total size of the cache."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size_bytes": self._size_bytes}
@@ -0,0 +1,146 @@
+"""The system catalog: one row of summary numbers per PV system in the store.
+
+Listing the PV systems in an HDF5 store used to mean walking
+`/timeseries`, which reads the PyTables metadata of every table, and
+finding each PV system's time span meant reading its table.  Instead,
+`StoreWriter` keeps a `systems` table with, for each PV system, the first
+and last timestamps of its timeseries, the number of rows, the bytes the
+timeseries takes on disk, and when it was last downloaded.  Like the
+`statistics` table, rows are only ever appended, so the last row for each
+PV system wins, and `SystemCatalog.compact` removes the rest.
+"""
+
+import logging
+from typing import Optional
+
+import pandas as pd
+
+from pvoutput.tablecache import KeyedTableCache
+
+_LOG = logging.getLogger("pvoutput")
+
+SYSTEMS_KEY = "systems"
+CATALOG_COLUMNS = ["first_datetime", "last_datetime", "num_rows", "num_bytes", "last_downloaded"]
+
+
+def read_catalog(backend, pv_system_id: Optional[int] = None) -> pd.DataFrame:
+    """Read the system catalog (for one PV system, or for all of them).
+
+    Args:
+        backend: A `backends.StorageBackend`.
+
+    Returns:
+        pd.DataFrame indexed by pv_system_id (sorted), with CATALOG_COLUMNS.
+
+    Raises:
+        KeyError: If the store has no system catalog.
+    """
+    table = backend.read_table(SYSTEMS_KEY, pv_system_id)
+    table = table[~table.index.duplicated(keep="last")]
+    return table.sort_index(kind="mergesort")
+
+
+def build_catalog(backend) -> pd.DataFrame:
+    """Build the system catalog by scanning every timeseries in the store.
+
+    Only needed for stores written before the catalog existed.
+    `last_downloaded` is the latest `datetime_of_API_request` of each
+    timeseries (NaT for data retrieved before about 2019-08-06).
+    """
+    rows = []
+    for pv_system_id in backend.scan_system_ids():
+        timeseries = backend.read_timeseries(pv_system_id, columns=["datetime_of_API_request"])
+        rows.append(
+            catalog_row(
+                backend,
+                pv_system_id,
+                timeseries.index,
+                last_downloaded=latest_api_request(timeseries),
+            )
+        )
+    if not rows:
+        return pd.DataFrame(columns=CATALOG_COLUMNS)
+    return pd.concat(rows)
+
+
+def write_catalog(backend, catalog: pd.DataFrame):
+    """Replace the system catalog."""
+    backend.replace_table(SYSTEMS_KEY, catalog)
+
+
+def catalog_row(
+    backend,
+    pv_system_id: int,
+    datetimes: pd.DatetimeIndex,
+    existing: Optional[pd.Series] = None,
+    last_downloaded: Optional[pd.Timestamp] = None,
+) -> pd.DataFrame:
+    """A row for the `systems` table, after `datetimes` were appended.
+
+    Timestamps are localtime to the PV system (timezone-aware datetimes are
+    converted to local time, like the rest of the dataset).  Rows are only
+    ever added to a timeseries, so the first and last timestamps are the
+    extremes of `datetimes` and of the `existing` row.  The number of rows
+    and bytes are read from the store (see `StorageBackend.timeseries_size`).
+    """
+    datetimes = pd.DatetimeIndex(datetimes)
+    if datetimes.tz is not None:
+        datetimes = datetimes.tz_localize(None)
+    first_datetime, last_datetime = datetimes.min(), datetimes.max()
+    if existing is not None:
+        first_datetime = min(first_datetime, existing["first_datetime"])
+        last_datetime = max(last_datetime, existing["last_datetime"])
+    num_rows, num_bytes = backend.timeseries_size(pv_system_id)
+    return pd.DataFrame(
+        {
+            "first_datetime": [first_datetime],
+            "last_datetime": [last_datetime],
+            "num_rows": [num_rows],
+            "num_bytes": [num_bytes],
+            "last_downloaded": [pd.Timestamp(last_downloaded)],
+        },
+        index=pd.Index([pv_system_id], name="pv_system_id"),
+    ).astype({"num_rows": "int64", "num_bytes": "int64", "last_downloaded": "datetime64[ns]"})
+
+
+class SystemCatalog(KeyedTableCache):
+    """An in-memory copy of the `systems` table.
+
+    Works like `statistics.StatisticsCache` (see `tablecache.KeyedTableCache`),
+    but builds the catalog if the store has none.
+    """
+
+    key = SYSTEMS_KEY
+
+    def _load_missing(self, backend) -> pd.DataFrame:
+        _LOG.info("Building system catalog")
+        catalog = build_catalog(backend)
+        if not catalog.empty:
+            write_catalog(backend, catalog)
+        return catalog
+
+    def update(
+        self,
+        backend,
+        pv_system_id: int,
+        datetimes: pd.DatetimeIndex,
+        last_downloaded: pd.Timestamp,
+    ):
+        """Update the row of a PV system, after `datetimes` were appended to it."""
+        existing = self.get_row(pv_system_id)
+        if existing is not None:
+            existing = existing.iloc[0]
+        self.put(
+            pv_system_id,
+            catalog_row(backend, pv_system_id, datetimes, existing, last_downloaded),
+        )
+
+
+def latest_api_request(timeseries: pd.DataFrame) -> pd.Timestamp:
+    """The latest `datetime_of_API_request` of a timeseries, as naive UTC (or NaT)."""
+    if "datetime_of_API_request" not in timeseries:
+        return pd.NaT
+    timestamp = pd.Timestamp(timeseries["datetime_of_API_request"].max())
+    if timestamp is not pd.NaT and timestamp.tz is not None:
+        timestamp = timestamp.tz_convert(None)
+    return timestamp
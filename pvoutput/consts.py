@@ -285,6 +285,12 @@ ONE_DAY = timedelta(days=1)
 
 PV_OUTPUT_DATE_FORMAT = "%Y%m%d"
 CONFIG_FILENAME = os.environ.get("PVOUTPUT_CONFIG", os.path.expanduser("~/.pvoutput.yml"))
+QUOTA_LEDGER_FILENAME = os.environ.get(
+    "PVOUTPUT_QUOTA_LEDGER", os.path.expanduser("~/.pvoutput_quota.sqlite")
+)
+RESPONSE_CACHE_DIR = os.environ.get(
+    "PVOUTPUT_RESPONSE_CACHE", os.path.expanduser("~/.pvoutput_cache")
+)
 RATE_LIMIT_PARAMS_TO_API_HEADERS = {
     "rate_limit_remaining": "X-Rate-Limit-Remaining",
     "rate_limit_total": "X-Rate-Limit-Limit",
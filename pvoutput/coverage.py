@@ -0,0 +1,169 @@
+"""The coverage catalog: which dates each PV system in the store covers.
+
+Working out which dates still need downloading used to mean reading the
+whole `/timeseries/<id>` table and the `missing_dates` rows of every PV
+system.  Instead, `StoreWriter` keeps a small `/coverage` table listing,
+for each PV system, the intervals of days which have been downloaded, and
+the intervals of days which are known to be missing.  On each flush,
+`StoreWriter` appends the merged intervals written since the last flush,
+so a PV system may have a few overlapping or adjacent rows (which are
+merged when read) until the writer is closed, when the table is replaced
+by one row per interval.
+"""
+
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Union
+
+import numpy as np
+import pandas as pd
+
+from pvoutput.daterange import DateIntervalSet, DateRange
+
+_LOG = logging.getLogger("pvoutput")
+
+COVERAGE_KEY = "coverage"
+DOWNLOADED = "downloaded"
+MISSING = "missing"
+
+
+@dataclass
+class SystemCoverage:
+    downloaded: DateIntervalSet = field(default_factory=DateIntervalSet)
+    missing: DateIntervalSet = field(default_factory=DateIntervalSet)
+
+    def update(self, kind: str, intervals: DateIntervalSet):
+        if kind == DOWNLOADED:
+            self.downloaded = self.downloaded | intervals
+        else:
+            self.missing = self.missing | intervals
+
+    def date_ranges_to_download(
+        self, start_date: Union[str, pd.Timestamp], end_date: Union[str, pd.Timestamp]
+    ) -> List[DateRange]:
+        """The dates from start_date to end_date which are neither downloaded nor missing."""
+        wanted = DateIntervalSet.from_date_ranges([DateRange(start_date, end_date)])
+        return (wanted - self.downloaded - self.missing).to_date_ranges()
+
+
+def timeseries_coverage(timeseries: pd.DataFrame) -> DateIntervalSet:
+    """The dates with data in `timeseries`, plus the dates which were queried."""
+    intervals = DateIntervalSet.from_dates(timeseries.index)
+    if "query_date" in timeseries:
+        intervals = intervals | DateIntervalSet.from_dates(timeseries["query_date"].dropna())
+    return intervals
+
+
+def missing_dates_coverage(missing_dates: pd.DataFrame) -> Dict[int, DateIntervalSet]:
+    """Maps each PV system ID in a `missing_dates` table to its missing dates."""
+    coverage = {}
+    for pv_system_id, rows in missing_dates.groupby(level=0):
+        coverage[int(pv_system_id)] = DateIntervalSet.from_date_ranges(
+            map(
+                DateRange,
+                rows["missing_start_date_PV_localtime"],
+                rows["missing_end_date_PV_localtime"],
+            )
+        )
+    return coverage
+
+
+def coverage_to_rows(pv_system_id: int, kind: str, intervals: DateIntervalSet) -> pd.DataFrame:
+    """Rows for the `/coverage` table."""
+    rows = pd.DataFrame(
+        {
+            "start_date": pd.DatetimeIndex(intervals.starts.astype("datetime64[D]")),
+            "end_date": pd.DatetimeIndex(intervals.ends.astype("datetime64[D]")),
+            "kind": kind,
+        },
+        index=pd.Index(np.full(len(intervals), pv_system_id, dtype=np.int64), name="pv_system_id"),
+    )
+    return rows
+
+
+def coverage_to_table(coverage: Dict[int, SystemCoverage]) -> pd.DataFrame:
+    """All the rows for the `/coverage` table, sorted by PV system ID."""
+    rows = [
+        coverage_to_rows(pv_system_id, kind, getattr(system_coverage, kind))
+        for pv_system_id, system_coverage in sorted(coverage.items())
+        for kind in [DOWNLOADED, MISSING]
+    ]
+    rows = [df for df in rows if not df.empty]
+    return pd.concat(rows) if rows else pd.DataFrame()
+
+
+def append_coverage(backend, coverage: Dict[int, SystemCoverage]):
+    """Append to the catalog of a `backends.StorageBackend`."""
+    table = coverage_to_table(coverage)
+    if not table.empty:
+        backend.append_table(COVERAGE_KEY, table)
+
+
+def merge_coverage(coverage: Dict[int, SystemCoverage], other: Dict[int, SystemCoverage]):
+    """Add the intervals of `other` to `coverage`, in place."""
+    for pv_system_id, system_coverage in other.items():
+        existing = coverage.setdefault(pv_system_id, SystemCoverage())
+        existing.update(DOWNLOADED, system_coverage.downloaded)
+        existing.update(MISSING, system_coverage.missing)
+
+
+def coverage_from_rows(rows: pd.DataFrame) -> Dict[int, SystemCoverage]:
+    coverage = {}
+    for (pv_system_id, kind), group in rows.groupby([rows.index, "kind"]):
+        intervals = DateIntervalSet(
+            _to_day_numbers(group["start_date"]), _to_day_numbers(group["end_date"])
+        )
+        coverage.setdefault(int(pv_system_id), SystemCoverage()).update(kind, intervals)
+    return coverage
+
+
+def read_coverage(backend, pv_system_id=None) -> Dict[int, SystemCoverage]:
+    """Read the coverage catalog (for one PV system, or for all of them).
+
+    Args:
+        backend: A `backends.StorageBackend`.
+
+    Raises:
+        KeyError: If the store has no coverage catalog.
+    """
+    return coverage_from_rows(backend.read_table(COVERAGE_KEY, pv_system_id))
+
+
+def read_timeseries_coverage(backend, pv_system_id: int) -> DateIntervalSet:
+    """Read just the dates of the timeseries of one PV system."""
+    try:
+        timeseries = backend.read_timeseries(pv_system_id, columns=["query_date"])
+    except KeyError:
+        return DateIntervalSet()
+    return timeseries_coverage(timeseries)
+
+
+def build_coverage(backend) -> Dict[int, SystemCoverage]:
+    """Build the coverage catalog by scanning every table in the store.
+
+    Only needed for stores written before the catalog existed.
+    """
+    coverage = {}
+    for pv_system_id in backend.system_ids():
+        coverage.setdefault(int(pv_system_id), SystemCoverage()).update(
+            DOWNLOADED, read_timeseries_coverage(backend, pv_system_id)
+        )
+    try:
+        missing_dates = backend.read_table(
+            "missing_dates",
+            columns=["missing_start_date_PV_localtime", "missing_end_date_PV_localtime"],
+        )
+    except KeyError:
+        return coverage
+    for pv_system_id, intervals in missing_dates_coverage(missing_dates).items():
+        coverage.setdefault(pv_system_id, SystemCoverage()).update(MISSING, intervals)
+    return coverage
+
+
+def write_coverage(backend, coverage: Dict[int, SystemCoverage]):
+    """Replace the coverage catalog."""
+    backend.replace_table(COVERAGE_KEY, coverage_to_table(coverage))
+
+
+def _to_day_numbers(datetimes: pd.Series) -> np.ndarray:
+    return datetimes.values.astype("datetime64[D]").astype(np.int64)
@@ -48,6 +48,124 @@ class DateRange:
             return new_date_ranges
 
 
+class DateIntervalSet:
+    """A set of dates, stored as sorted, disjoint, inclusive intervals of days.
+
+    Each interval is a pair of int64 days since 1970-01-01, so union,
+    intersection and difference are vectorized NumPy operations on the
+    interval boundaries, and never expand the intervals into individual
+    dates.  Adjacent intervals are merged, so two sets are equal exactly
+    when they contain the same dates.
+    """
+
+    def __init__(self, starts: Iterable[int] = (), ends: Iterable[int] = ()):
+        """
+        Args:
+            starts, ends: The first and last day (inclusive) of each
+                interval, as days since 1970-01-01.  Needn't be sorted or
+                disjoint.
+        """
+        self.starts, self.ends = _normalize_intervals(
+            np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64)
+        )
+
+    @classmethod
+    def from_date_ranges(cls, date_ranges: Iterable[DateRange]):
+        date_ranges = list(date_ranges)
+        return cls(
+            _to_days([date_range.start_date for date_range in date_ranges]),
+            _to_days([date_range.end_date for date_range in date_ranges]),
+        )
+
+    @classmethod
+    def from_dates(cls, dates):
+        """Build from dates, datetimes, or a DatetimeIndex.  Times are ignored."""
+        days = np.unique(_to_days(dates))
+        if len(days) == 0:
+            return cls()
+        location_of_gaps = np.flatnonzero(np.diff(days) > 1)
+        starts = np.concatenate([days[:1], days[location_of_gaps + 1]])
+        ends = np.concatenate([days[location_of_gaps], days[-1:]])
+        return cls(starts, ends)
+
+    def union(self, other):
+        return self._combine(other, np.logical_or)
+
+    def intersection(self, other):
+        return self._combine(other, np.logical_and)
+
+    def difference(self, other):
+        return self._combine(other, lambda in_self, in_other: in_self & ~in_other)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    def _combine(self, other, op):
+        # Split the number line at every interval boundary.  Within each
+        # segment, membership of self and other is constant.
+        boundaries = np.unique(
+            np.concatenate([self.starts, self.ends + 1, other.starts, other.ends + 1])
+        )
+        if len(boundaries) == 0:
+            return DateIntervalSet()
+        keep = op(self._contains_days(boundaries[:-1]), other._contains_days(boundaries[:-1]))
+        return DateIntervalSet(boundaries[:-1][keep], boundaries[1:][keep] - 1)
+
+    def _contains_days(self, days: np.ndarray) -> np.ndarray:
+        if len(self.starts) == 0:
+            return np.zeros(len(days), dtype=bool)
+        i = np.searchsorted(self.starts, days, side="right") - 1
+        return (i >= 0) & (days <= self.ends[np.maximum(i, 0)])
+
+    def to_date_ranges(self) -> List[DateRange]:
+        starts = _from_days(self.starts)
+        ends = _from_days(self.ends)
+        return [DateRange(start, end) for start, end in zip(starts, ends)]
+
+    def num_days(self) -> int:
+        return int((self.ends - self.starts + 1).sum())
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __eq__(self, other) -> bool:
+        return np.array_equal(self.starts, other.starts) and np.array_equal(self.ends, other.ends)
+
+    def __repr__(self) -> str:
+        return "DateIntervalSet({})".format(
+            ", ".join("{} to {}".format(r.start_date, r.end_date) for r in self.to_date_ranges())
+        )
+
+
+def _normalize_intervals(starts: np.ndarray, ends: np.ndarray):
+    """Sort intervals, and merge those which overlap or touch."""
+    if len(starts) == 0:
+        return starts, ends
+    order = np.argsort(starts, kind="mergesort")
+    starts = starts[order]
+    ends = np.maximum.accumulate(ends[order])
+    # A new interval starts wherever there's a gap after all previous intervals.
+    is_new = np.concatenate([[True], starts[1:] > ends[:-1] + 1])
+    new_starts = starts[is_new]
+    new_ends = ends[np.concatenate([np.flatnonzero(is_new)[1:] - 1, [len(ends) - 1]])]
+    return new_starts, new_ends
+
+
+def _to_days(dates) -> np.ndarray:
+    if len(dates) == 0:
+        return np.empty(0, dtype=np.int64)
+    dates = pd.DatetimeIndex(dates)
+    if dates.tz is not None:
+        # Use the local date, not the UTC date.
+        dates = dates.tz_localize(None)
+    return np.asarray(dates.values.astype("datetime64[D]").astype(np.int64))
+
+
+def _from_days(days: np.ndarray) -> np.ndarray:
+    return days.astype("datetime64[D]").astype(object)
+
+
 def get_date_range_list(dates: Iterable[date]) -> List[DateRange]:
     if not dates:
         return []
@@ -116,3 +234,36 @@ def merge_date_ranges_to_years(date_ranges: Iterable[DateRange]) -> List[DateRan
         years_to_download.append(DateRange(date_from, date_to))
 
     return years_to_download
+
+
+def merge_date_ranges_to_minimum_years(
+    date_ranges: Iterable[DateRange], days_per_window: int = 366
+) -> List[DateRange]:
+    """Cover date_ranges with the fewest possible year-long windows.
+
+    Each window is one getbatchstatus request, which returns the 366 days
+    up to and including its `end_date`.  Unlike `merge_date_ranges_to_years`
+    this never splits a date range into more windows than necessary: each
+    window ends on the latest date which isn't yet covered, which is optimal
+    for covering points on a line with fixed-length windows.
+
+    Args:
+        date_ranges: List of DateRanges (inclusive), in any order.  They may
+            overlap.
+        days_per_window: The number of days (inclusive) in each window.
+
+    Returns:
+        List of DateRanges, each representing a year, in descending order.
+    """
+    wanted = DateIntervalSet.from_date_ranges(date_ranges)
+    windows = []
+    last_uncovered_day = None
+    for start, end in zip(wanted.starts[::-1], wanted.ends[::-1]):
+        if last_uncovered_day is not None:
+            end = min(end, last_uncovered_day)
+        while end >= start:
+            window_start = end - (days_per_window - 1)
+            windows.append(DateRange(_from_days(window_start), _from_days(end)))
+            end = window_start - 1
+        last_uncovered_day = end
+    return windows
@@ -0,0 +1,194 @@
+"""Helpers for the tables of an HDF5 store (see docs/dataset.md).
+
+`backends.HDFBackend` is built on these, and `utils` re-exports the
+original ones.
+"""
+
+import logging
+import warnings
+from typing import List, Optional, Tuple
+
+import pandas as pd
+import tables
+
+_LOG = logging.getLogger("pvoutput")
+
+MISSING_DATES_KEY = "missing_dates"
+# Suffixes of the tables left behind if `replace_hdf_table` is interrupted.
+HDF_TMP_SUFFIX = "_compacted"
+HDF_BACKUP_SUFFIX = "_replaced"
+MISSING_START = "missing_start_date_PV_localtime"
+MISSING_END = "missing_end_date_PV_localtime"
+
+
+def system_id_to_hdf_key(system_id: int) -> str:
+    return "/timeseries/{:d}".format(system_id)
+
+
+def sort_and_de_dupe_pv_system(store, pv_system_id):
+    key = system_id_to_hdf_key(pv_system_id)
+    timeseries = store[key]
+    timeseries.sort_index(inplace=True)
+    timeseries = timeseries[~timeseries.index.duplicated()]
+    store.remove(key)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", tables.NaturalNameWarning)
+        store.append(key, timeseries, data_columns=True)
+
+
+def append_and_merge_pv_system(store, pv_system_id, timeseries: pd.DataFrame) -> int:
+    """Append timeseries to the store, keeping the table sorted and de-duplicated.
+
+    Unlike `sort_and_de_dupe_pv_system`, this doesn't re-write the whole
+    table.  Only the existing rows at or after the first new row are
+    re-written, so appending data in chronological order costs (almost)
+    nothing more than a plain append.  Where the existing and new rows
+    have the same index, the existing row is kept.
+
+    Returns:
+        The number of existing rows which were re-written.
+    """
+    if timeseries.empty:
+        return 0
+    key = system_id_to_hdf_key(pv_system_id)
+    timeseries = timeseries.sort_index(kind="mergesort")
+    timeseries = timeseries[~timeseries.index.duplicated()]
+    start = timeseries.index[0]
+
+    num_rows_rewritten = 0
+    if key in store:
+        overlap = store.select(key, where="index >= start")
+        if not overlap.empty:
+            num_rows_rewritten = len(overlap)
+            timeseries = pd.concat([overlap, timeseries]).sort_index(kind="mergesort")
+            timeseries = timeseries[~timeseries.index.duplicated()]
+            store.remove(key, where="index >= start")
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", tables.NaturalNameWarning)
+        store.append(key, timeseries, data_columns=True)
+    return num_rows_rewritten
+
+
+def merge_missing_date_ranges(missing_dates: pd.DataFrame) -> pd.DataFrame:
+    """Merge duplicate, overlapping and adjacent rows of a `missing_dates` table.
+
+    Rows with no `datetime_of_API_request` may not really be missing (see
+    docs/dataset.md), so they're only merged with each other.  Each merged
+    row keeps the latest `datetime_of_API_request` of the rows it replaces.
+
+    Returns:
+        DataFrame sorted by PV system ID, then by missing start date.
+    """
+    if missing_dates.empty:
+        return missing_dates
+    index_name = missing_dates.index.name
+    df = missing_dates.reset_index()
+    id_col = df.columns[0]
+    if "datetime_of_API_request" in df:
+        df["_is_suspect"] = df["datetime_of_API_request"].isnull()
+    else:
+        df["_is_suspect"] = False
+    df = df.sort_values([id_col, "_is_suspect", MISSING_START], kind="mergesort")
+
+    # A new range starts wherever there's a gap after all the previous
+    # ranges of the same PV system.
+    groups = [df[id_col], df["_is_suspect"]]
+    latest_end = df[MISSING_END].groupby(groups).cummax()
+    previous_latest_end = latest_end.groupby(groups).shift()
+    is_new_range = previous_latest_end.isnull() | (
+        df[MISSING_START] > previous_latest_end + pd.Timedelta(days=1)
+    )
+    aggregations = {col: "first" for col in df.columns if col not in [MISSING_START, MISSING_END]}
+    aggregations.update({MISSING_START: "min", MISSING_END: "max"})
+    if "datetime_of_API_request" in df:
+        aggregations["datetime_of_API_request"] = "max"
+    merged = df.groupby(is_new_range.cumsum().values).agg(aggregations)
+    merged = merged.sort_values([id_col, MISSING_START], kind="mergesort")
+    merged = merged.drop(columns="_is_suspect").set_index(id_col)
+    merged.index.name = index_name
+    return merged[missing_dates.columns]
+
+
+def compact_missing_dates(store: pd.HDFStore) -> Tuple[int, int]:
+    """Merge the rows of the `missing_dates` table, and index it by PV system ID.
+
+    The table is re-written, sorted by PV system ID, with a completely
+    sorted (CSI) PyTables index on the PV system ID, so looking up one PV
+    system's missing dates stays fast however large the table gets.  The
+    compacted table is written under a temporary name, and only replaces
+    the original once it's complete.
+
+    Returns:
+        The number of rows before and after compaction.
+    """
+    if MISSING_DATES_KEY not in store:
+        return 0, 0
+    missing_dates = store[MISSING_DATES_KEY]
+    merged = merge_missing_date_ranges(missing_dates)
+    replace_hdf_table(
+        store, MISSING_DATES_KEY, merged, full_index_columns=["index"], data_columns=True
+    )
+    _LOG.info("Compacted missing_dates from %d to %d rows", len(missing_dates), len(merged))
+    return len(missing_dates), len(merged)
+
+
+def replace_hdf_table(
+    store: pd.HDFStore,
+    key: str,
+    value: pd.DataFrame,
+    full_index_columns: Optional[List[str]] = None,
+    **kwargs
+):
+    """Replace a table of an HDF5 store, so an interruption never loses it.
+
+    The new table is written under a temporary name.  Once it's complete,
+    the original is renamed to a backup name, the new table is renamed to
+    `key`, and only then is the backup removed.  If this is interrupted,
+    `recover_replaced_hdf_table` (which `backends.HDFBackend` calls when it
+    opens a store for writing) restores the backup if there's no `key`.  If
+    `value` is empty then the table is removed.
+
+    Args:
+        full_index_columns: If set, create a completely sorted (CSI) index
+            on these columns, instead of the default index.
+        kwargs: Passed to `store.append`.
+    """
+    recover_replaced_hdf_table(store, key)
+    tmp_key = key + HDF_TMP_SUFFIX
+    backup_key = key + HDF_BACKUP_SUFFIX
+    if not value.empty:
+        if full_index_columns:
+            kwargs["index"] = False
+        store.append(tmp_key, value, expectedrows=len(value), **kwargs)
+        if full_index_columns:
+            store.create_table_index(tmp_key, columns=full_index_columns, optlevel=9, kind="full")
+    if key in store:
+        _rename_hdf_node(store, key, backup_key)
+    if not value.empty:
+        _rename_hdf_node(store, tmp_key, key)
+    if backup_key in store:
+        store.remove(backup_key)
+
+
+def recover_replaced_hdf_table(store: pd.HDFStore, key: str):
+    """Undo a `replace_hdf_table` which was interrupted before it finished.
+
+    A backup is only left behind if the new table may not have replaced
+    it, so the backup is restored if there's no `key`, and removed if
+    there is.  A temporary table may be incomplete, so it's removed.
+    """
+    backup_key = key + HDF_BACKUP_SUFFIX
+    if backup_key in store:
+        if key in store:
+            store.remove(backup_key)
+        else:
+            _LOG.warning("Restoring %s from an interrupted re-write", key)
+            _rename_hdf_node(store, backup_key, key)
+    tmp_key = key + HDF_TMP_SUFFIX
+    if tmp_key in store:
+        store.remove(tmp_key)
+
+
+def _rename_hdf_node(store: pd.HDFStore, key: str, new_key: str):
+    store.get_node(key)._f_rename(new_key.strip("/").split("/")[-1])
@@ -0,0 +1,303 @@
+import logging
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from pvoutput.exceptions import RateLimitExceeded
+from pvoutput.pvoutput import PVOutput
+from pvoutput.ratelimit import API, DATA_SERVICE, rate_limit_from_headers
+from pvoutput.utils import _print_and_log
+
+_LOG = logging.getLogger("pvoutput")
+
+
+class PVOutputKeyPool(PVOutput):
+    """Spreads API requests across several API keys.
+
+    PVOutputKeyPool has all the methods of PVOutput (including
+    `download_multiple_systems_to_disk`), but sends each request using
+    whichever API key has the most quota remaining.  Data service requests
+    are only sent using API keys with a `data_service_url`.  If every
+    suitable key has run out of quota then requests wait for the earliest
+    reset time.  Once the data service has accepted a request (e.g. a
+    getbatchstatus job), the same request is sent using the same API key
+    until it's ready, because the job only exists for that key.
+
+    For example:
+
+        pool = PVOutputKeyPool([
+            PVOutput(api_key='key1', system_id='1'),
+            PVOutput(api_key='key2', system_id='2', data_service_url='https://x.pvoutput.org'),
+        ])
+        pool.download_multiple_systems_to_disk(...)
+
+    Attributes:
+        clients: List of PVOutput objects, one per API key.
+        data_service_url: The data service URL of the first client which has one.
+    """
+
+    def __init__(self, clients: Iterable[PVOutput]):
+        """
+        Args:
+            clients: PVOutput objects, each with a different API key.
+        """
+        self.clients = list(clients)
+        if not self.clients:
+            raise ValueError("PVOutputKeyPool needs at least one PVOutput client!")
+        first_client = self.clients[0]
+        super().__init__(
+            api_key=first_client.api_key,
+            system_id=first_client.system_id,
+            config_filename=None,
+            data_service_url=next(
+                (client.data_service_url for client in self.clients if client.data_service_url),
+                None,
+            ),
+            transport=first_client.transport,
+        )
+        # Each request uses the API key, rate limiter, quota ledger and
+        # response_cache (if any) of the client which sends it.
+        self.api_key = None
+        self.system_id = None
+        # Share the first client's session, instead of the one made by PVOutput.
+        self.session.close()
+        self.session = first_client.session
+
+        # Maps (client index, bucket name) to [remaining, total, reset_time].
+        self._budgets = {}
+        # Counts the requests sent while some clients' quotas are unknown.
+        self._num_round_robin_choices = 0
+        # Maps each data service request which was accepted (but isn't ready
+        # yet) to the index of the client which sent it.
+        self._pinned_clients = {}
+        self._lock = threading.Lock()
+
+    def _remaining(self, client_i: int, bucket_name: str, now: pd.Timestamp) -> float:
+        try:
+            remaining, total, reset_time = self._budgets[(client_i, bucket_name)]
+        except KeyError:
+            # We don't know the quota yet, so try this client.
+            return np.inf
+        if now >= reset_time:
+            return total
+        return remaining
+
+    def _choose_client(
+        self, bucket_name: str, spend: bool = True, client_indexes: Optional[List[int]] = None
+    ) -> Tuple[int, float]:
+        """Choose the client with the most quota remaining.
+
+        Until the quota of every client is known (from the headers of its
+        first response), requests go to each client with quota left in turn,
+        so concurrent first requests don't all go to the same client.
+
+        Args:
+            bucket_name: API or DATA_SERVICE.
+            spend: If True, then take one request from the chosen client's
+                quota, so concurrent requests spread across the clients.
+            client_indexes: Optional.  Only choose from these clients.
+
+        Returns:
+            (client index, seconds to wait).  Seconds to wait is 0 if the
+            client has quota remaining; otherwise it's the time until the
+            earliest reset.
+        """
+        candidates = [
+            i
+            for i, client in enumerate(self.clients)
+            if (bucket_name == API or client.data_service_url)
+            and (client_indexes is None or i in client_indexes)
+        ]
+        if not candidates:
+            raise ValueError("None of the clients in the PVOutputKeyPool has a data_service_url!")
+
+        with self._lock:
+            now = pd.Timestamp.utcnow()
+            remaining = [self._remaining(i, bucket_name, now) for i in candidates]
+            if np.isinf(remaining).any():
+                available = [j for j, quota in enumerate(remaining) if quota > 0]
+                best = available[self._num_round_robin_choices % len(available)]
+                self._num_round_robin_choices += 1
+            else:
+                best = int(np.argmax(remaining))
+            client_i = candidates[best]
+            if remaining[best] > 0:
+                budget = self._budgets.get((client_i, bucket_name))
+                if spend and budget is not None:
+                    budget[0] = remaining[best] - 1
+                    if now >= budget[2]:
+                        budget[2] = now + pd.Timedelta("1H")
+                return client_i, 0
+
+            reset_times = [self._budgets[(i, bucket_name)][2] for i in candidates]
+            earliest = int(np.argmin(reset_times))
+            secs_to_wait = (reset_times[earliest] - now).total_seconds() + 1
+            return candidates[earliest], max(secs_to_wait, 1)
+
+    def _record_budget(self, client_i: int, bucket_name: str, headers: Dict):
+        """Record a client's quota from the X-Rate-Limit-* headers of a response."""
+        rate_limit = rate_limit_from_headers(headers)
+        if rate_limit is None:
+            return
+        remaining = rate_limit["remaining"]
+        total = rate_limit["total"]
+        reset_time = pd.Timestamp.utcfromtimestamp(rate_limit["reset_time"]).tz_localize("utc")
+        with self._lock:
+            budget = self._budgets.get((client_i, bucket_name))
+            # Responses may arrive out of order: within one rate limit period,
+            # the lowest remaining count is the latest.
+            if budget is not None and budget[1:] == [total, reset_time]:
+                remaining = min(remaining, budget[0])
+            self._budgets[(client_i, bucket_name)] = [remaining, total, reset_time]
+            self.rate_limit_remaining = remaining
+            self.rate_limit_total = total
+            self.rate_limit_reset_time = reset_time
+
+    def _api_query(
+        self,
+        service: str,
+        api_params: Dict,
+        wait_if_rate_limit_exceeded: bool = False,
+        use_data_service: bool = False,
+        stream: bool = False,
+    ) -> Union[str, Iterator[str]]:
+        """Send API request using the client with the most quota remaining.
+
+        Data service requests which were accepted earlier are sent using the
+        client which they were accepted by.  See `PVOutput._api_query`.
+        """
+        bucket_name = DATA_SERVICE if use_data_service else API
+        pin_key = (service, tuple(sorted(api_params.items()))) if use_data_service else None
+        with self._lock:
+            pinned_client_i = self._pinned_clients.get(pin_key)
+        client_indexes = None if pinned_client_i is None else [pinned_client_i]
+        while True:
+            client_i, secs_to_wait = self._choose_client(bucket_name, client_indexes=client_indexes)
+            if secs_to_wait > 0 and wait_if_rate_limit_exceeded:
+                _print_and_log(
+                    "All API keys have exceeded their rate limit.  Waiting {:.0f} seconds.".format(
+                        secs_to_wait
+                    )
+                )
+                time.sleep(secs_to_wait)
+                continue
+
+            client = self.clients[client_i]
+            _LOG.debug("Sending %s request using client %d", service, client_i)
+
+            def _on_headers(headers, client_i=client_i):
+                self._record_budget(client_i, bucket_name, headers)
+
+            try:
+                text = client._api_query(
+                    service,
+                    api_params,
+                    use_data_service=use_data_service,
+                    stream=stream,
+                    on_headers=_on_headers,
+                )
+            except RateLimitExceeded:
+                # Try another client if one has quota left; otherwise wait.
+                if not wait_if_rate_limit_exceeded and not self._any_quota_left(
+                    bucket_name, client_indexes
+                ):
+                    raise
+                continue
+            except Exception:
+                self._unpin_client(pin_key)
+                raise
+            if pin_key is None:
+                return text
+            if stream:
+                return self._pin_client_on_first_chunk(pin_key, client_i, text)
+            self._pin_client(pin_key, client_i, text)
+            return text
+
+    def _pin_client(self, pin_key: Tuple, client_i: int, text: str):
+        """Send the request using the same client until it stops being accepted."""
+        if "Accepted 202" in text:
+            with self._lock:
+                self._pinned_clients[pin_key] = client_i
+        else:
+            self._unpin_client(pin_key)
+
+    def _unpin_client(self, pin_key: Optional[Tuple]):
+        with self._lock:
+            self._pinned_clients.pop(pin_key, None)
+
+    def _pin_client_on_first_chunk(
+        self, pin_key: Tuple, client_i: int, chunks: Iterator[str]
+    ) -> Iterator[str]:
+        first_chunk = next(chunks, "")
+        self._pin_client(pin_key, client_i, first_chunk)
+        return _prepend_chunk(first_chunk, chunks)
+
+    def _any_quota_left(self, bucket_name: str, client_indexes: Optional[List[int]] = None) -> bool:
+        _, secs_to_wait = self._choose_client(
+            bucket_name, spend=False, client_indexes=client_indexes
+        )
+        return secs_to_wait <= 0
+
+    def budget(self) -> pd.DataFrame:
+        """The last known quota of each client.
+
+        Returns:
+            pd.DataFrame indexed by (client_index, bucket_name).  Columns:
+                system_id, remaining, total, reset_time
+        """
+        with self._lock:
+            rows = [
+                {
+                    "client_index": client_i,
+                    "bucket_name": bucket_name,
+                    "system_id": self.clients[client_i].system_id,
+                    "remaining": remaining,
+                    "total": total,
+                    "reset_time": reset_time,
+                }
+                for (client_i, bucket_name), (remaining, total, reset_time) in sorted(
+                    self._budgets.items()
+                )
+            ]
+        return pd.DataFrame(
+            rows,
+            columns=[
+                "client_index",
+                "bucket_name",
+                "system_id",
+                "remaining",
+                "total",
+                "reset_time",
+            ],
+        ).set_index(["client_index", "bucket_name"])
+
+    def connection_pool_stats(self) -> pd.DataFrame:
+        """Requests served per HTTP connection, for every client."""
+        return pd.concat(
+            [client.connection_pool_stats() for client in self.clients],
+            keys=range(len(self.clients)),
+            names=["client_index"],
+        )
+
+    def wait_for_rate_limit_reset(self):
+        _, secs_to_wait = self._choose_client(API, spend=False)
+        if secs_to_wait > 0:
+            time.sleep(secs_to_wait)
+
+    def rate_limit_info(self) -> Dict:
+        """The rate limit info of each client, keyed by client index."""
+        return {i: client.rate_limit_info() for i, client in enumerate(self.clients)}
+
+
+def _prepend_chunk(first_chunk: str, chunks: Iterator[str]) -> Iterator[str]:
+    """Yield `first_chunk` and then `chunks`.  Closing this closes `chunks` too."""
+    try:
+        yield first_chunk
+        yield from chunks
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
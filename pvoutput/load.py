@@ -0,0 +1,185 @@
+"""Load the timeseries of many PV systems, aligned onto a common time grid.
+
+For example, to get every PV system's power on one day:
+
+    power = load_timeseries("pv.hdf", start="2019-08-09", end="2019-08-09 23:55")
+
+`load_timeseries` returns one wide DataFrame.  For fleet-sized requests,
+`iter_timeseries` yields the same DataFrame in chunks of PV systems, so
+only one chunk is in memory at once.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from itertools import repeat
+from typing import Iterable, Iterator, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from pvoutput.backends import open_backend
+
+DEFAULT_COLUMNS = ["instantaneous_power_gen_W"]
+
+
+def load_timeseries(
+    store_filename: str,
+    system_ids: Optional[Iterable[int]] = None,
+    start: Union[str, pd.Timestamp] = None,
+    end: Union[str, pd.Timestamp] = None,
+    columns: Optional[List[str]] = None,
+    freq: str = "5T",
+    num_workers: Optional[int] = None,
+    dtype=np.float64,
+) -> pd.DataFrame:
+    """Load many PV systems' timeseries onto a common time grid.
+
+    Args:
+        store_filename: HDF5 file or Parquet directory written by
+            `download_multiple_systems_to_disk`.
+        system_ids: If None, load every PV system in the store.
+        start, end: The first and last slot of the grid (localtime to the
+            PV systems, whatever the timezone of each PV system's data: the
+            timezone of tz-aware bounds is dropped).
+        columns: The columns of the timeseries to load.  Defaults to
+            `instantaneous_power_gen_W`.
+        freq: The time between slots.  Each reading is floored to a slot,
+            and if a slot has several readings, then the last one is kept.
+        num_workers: If set, read the HDF5 file using this many processes.
+            (PyTables can't read from several threads.  The Parquet backend
+            always uses multiple threads.)
+        dtype: Of the returned values.  np.float32 halves memory use.
+
+    Returns:
+        pd.DataFrame indexed by datetime, with one column per PV system
+        (or, if there are several `columns`, a column MultiIndex of
+        (variable, pv_system_id)).  Slots with no data are NaN.
+    """
+    chunks = list(
+        iter_timeseries(
+            store_filename,
+            system_ids,
+            start,
+            end,
+            columns,
+            freq,
+            num_workers=num_workers,
+            dtype=dtype,
+        )
+    )
+    timeseries = pd.concat(chunks, axis=1)
+    if isinstance(timeseries.columns, pd.MultiIndex):
+        timeseries = timeseries.sort_index(axis=1, level=0, sort_remaining=False)
+    return timeseries
+
+
+def iter_timeseries(
+    store_filename: str,
+    system_ids: Optional[Iterable[int]] = None,
+    start: Union[str, pd.Timestamp] = None,
+    end: Union[str, pd.Timestamp] = None,
+    columns: Optional[List[str]] = None,
+    freq: str = "5T",
+    systems_per_chunk: int = 100,
+    num_workers: Optional[int] = None,
+    dtype=np.float64,
+) -> Iterator[pd.DataFrame]:
+    """Like `load_timeseries`, but yield `systems_per_chunk` PV systems at a time.
+
+    Peak memory is about one chunk: len(grid) x systems_per_chunk x
+    len(columns) values, plus the rows read from the store for that chunk.
+    """
+    if start is None or end is None:
+        raise ValueError("start and end must be set.")
+    columns = list(columns or DEFAULT_COLUMNS)
+    freq = pd.Timedelta(pd.tseries.frequencies.to_offset(freq))
+    start, end = _to_naive(start), _to_naive(end)
+    grid = pd.date_range(start.floor(freq), end, freq=freq, name="datetime")
+    # Read everything which floors into the last slot.
+    read_end = grid[-1] + freq - pd.Timedelta(1, "ns")
+    if system_ids is None:
+        with open_backend(store_filename, mode="r") as backend:
+            system_ids = backend.system_ids()
+    system_ids = list(system_ids)
+
+    with ExitStack() as stack:
+        executor = None
+        if num_workers:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=num_workers))
+        # If there are no PV systems, yield one empty chunk.
+        for i in range(0, max(len(system_ids), 1), systems_per_chunk):
+            chunk_ids = system_ids[i : i + systems_per_chunk]
+            if executor is None:
+                timeseries = _read_timeseries_many(
+                    store_filename, chunk_ids, grid[0], read_end, columns
+                )
+            else:
+                # Each worker reads an equal share of the chunk.
+                batches = [chunk_ids[j::num_workers] for j in range(num_workers)]
+                batches = [batch for batch in batches if batch]
+                timeseries = pd.concat(
+                    executor.map(
+                        _read_timeseries_many,
+                        repeat(store_filename),
+                        batches,
+                        repeat(grid[0]),
+                        repeat(read_end),
+                        repeat(columns),
+                    )
+                )
+            yield _to_grid(timeseries, chunk_ids, grid, columns, dtype)
+
+
+def _to_naive(timestamp: Union[str, pd.Timestamp]) -> pd.Timestamp:
+    """Local wall time.  Each backend reads naive bounds in the timezone of each PV system."""
+    timestamp = pd.Timestamp(timestamp)
+    return timestamp if timestamp.tz is None else timestamp.tz_localize(None)
+
+
+def _read_timeseries_many(
+    store_filename: str,
+    system_ids: List[int],
+    start: pd.Timestamp,
+    end: pd.Timestamp,
+    columns: List[str],
+) -> pd.DataFrame:
+    if not system_ids:
+        return pd.DataFrame()
+    with open_backend(store_filename, mode="r") as backend:
+        return backend.read_timeseries_many(system_ids, start, end, columns)
+
+
+def _to_grid(
+    timeseries: pd.DataFrame,
+    system_ids: List[int],
+    grid: pd.DatetimeIndex,
+    columns: List[str],
+    dtype,
+) -> pd.DataFrame:
+    """Put rows indexed by (pv_system_id, datetime) into a wide frame indexed by grid."""
+    data = np.full((len(grid), len(columns), len(system_ids)), np.nan, dtype=dtype)
+    if not timeseries.empty:
+        datetimes = pd.DatetimeIndex(timeseries.index.get_level_values("datetime"))
+        if datetimes.tz is not None:
+            datetimes = datetimes.tz_localize(None)
+        slots = (datetimes.asi8 - grid[0].value) // pd.Timedelta(grid.freq).value
+        positions = pd.Index(system_ids).get_indexer(
+            timeseries.index.get_level_values("pv_system_id")
+        )
+        is_on_grid = (slots >= 0) & (slots < len(grid)) & (positions >= 0)
+        slots, positions = slots[is_on_grid], positions[is_on_grid]
+        for i, column in enumerate(columns):
+            if column in timeseries:
+                data[slots, i, positions] = timeseries[column].values[is_on_grid]
+
+    if len(columns) == 1:
+        return pd.DataFrame(
+            data[:, 0, :], index=grid, columns=pd.Index(system_ids, name="pv_system_id")
+        )
+    return pd.DataFrame(
+        data.reshape(len(grid), -1),
+        index=grid,
+        columns=pd.MultiIndex.from_product(
+            [columns, system_ids], names=["variable", "pv_system_id"]
+        ),
+    )
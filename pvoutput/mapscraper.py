@@ -22,6 +22,7 @@ def get_pv_systems_for_country(
     sort_by: Optional[str] = None,
     max_pages: int = _MAX_NUM_PAGES,
     region: Optional[str] = None,
+    session: Optional[requests.Session] = None,
 ) -> pd.DataFrame:
     """
     Args:
@@ -40,6 +41,8 @@ def get_pv_systems_for_country(
             address,
             name
         max_pages: The maximum number of search pages to scrape.
+        session: Optional requests.Session to re-use connections, e.g.
+            `PVOutput.session`.
 
     Returns: pd.DataFrame with index system_id (int) and these columns:
         name, system_DC_capacity_W, panel, inverter, address, orientation,
@@ -49,7 +52,7 @@ def get_pv_systems_for_country(
     """
 
     country_code = _convert_to_country_code(country)
-    regions = [region] if region else get_regions_for_country(country_code)
+    regions = [region] if region else get_regions_for_country(country_code, session=session)
     all_metadata = []
     for region in regions:
         for page_number in range(max_pages):
@@ -65,7 +68,7 @@ def get_pv_systems_for_country(
                 sort_by=sort_by,
                 region=region,
             )
-            soup = get_soup(url)
+            soup = get_soup(url, session=session)
             if _page_is_blank(soup):
                 break
             metadata = _process_metadata(soup)
@@ -309,8 +312,8 @@ def _page_is_blank(soup: BeautifulSoup) -> bool:
     return not bool(pv_system_size_col)
 
 
-def get_soup(url, raw=False, parser="html.parser"):
-    response = requests.get(url)
+def get_soup(url, raw=False, parser="html.parser", session=None):
+    response = (session or requests).get(url)
     soup = BeautifulSoup(response.text, parser)
     if raw:
         return soup
@@ -332,10 +335,10 @@ def clean_soup(soup):
     return soup
 
 
-def get_regions_for_country(country_code: int):
+def get_regions_for_country(country_code: int, session: Optional[requests.Session] = None):
     region_list = []
     url = f"{REGIONS_URL}?country={country_code}"
-    soup = get_soup(url, parser="lxml")
+    soup = get_soup(url, parser="lxml", session=session)
     region_tags = soup.find_all("a", href=re.compile("map\.jsp\?country="))
     for row in region_tags:
         href = row.attrs["href"]
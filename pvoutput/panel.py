@@ -0,0 +1,311 @@
+"""A time-major panel of PV data: one dense (time x PV system) array per variable.
+
+The download store keeps one table per PV system, so reading every PV
+system's power for one day means reading thousands of tables.  A
+`PanelStore` is derived from the download store (see `PanelStore.update`),
+and holds each variable as a 2-D array with one row per time slot (e.g.
+every 5 minutes since `origin`) and one column per PV system.  The array is
+split into chunks on both axes, and each chunk is an uncompressed `.npy`
+file, so chunks can be memory-mapped.  With the default chunk size (one
+week x 256 PV systems), "all PV systems, one day" reads one or two chunks
+per 256 PV systems, and "one PV system, one year" reads 53 chunks.
+
+Layout:
+
+    <path>/panel.json  (the grid, the PV system IDs, and what's been synced)
+    <path>/<variable>/<time chunk>_<system chunk>.npy
+
+Chunks which would only contain NaNs are never written.
+"""
+
+import json
+import logging
+import os
+from typing import Dict, Iterable, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from pvoutput.backends import StorageBackend, open_backend
+from pvoutput.coverage import COVERAGE_KEY, build_coverage, read_coverage
+from pvoutput.daterange import DateIntervalSet
+
+_LOG = logging.getLogger("pvoutput")
+
+METADATA_FILENAME = "panel.json"
+DEFAULT_VARIABLES = ["instantaneous_power_gen_W"]
+
+# Save the sync state after this many PV systems, so an interrupted
+# update doesn't have to start again.
+_SAVE_EVERY_N_SYSTEMS = 100
+
+
+class PanelStore:
+    def __init__(
+        self,
+        path: str,
+        variables: Optional[List[str]] = None,
+        freq: str = "5T",
+        origin: Union[str, pd.Timestamp] = "2010-01-01",
+        time_chunk_size: int = 7 * 288,
+        system_chunk_size: int = 256,
+        dtype: str = "float32",
+    ):
+        """Open the panel at `path`, or create a new one.
+
+        The other args are only used when creating a new panel.
+
+        Args:
+            path: Directory.
+            variables: Columns of the timeseries to keep.
+            freq: The time between slots.  Timestamps are floored to a slot.
+            origin: The first slot.  Earlier data is dropped.
+            time_chunk_size: Number of time slots per chunk.
+            system_chunk_size: Number of PV systems per chunk.
+            dtype: NumPy dtype of the arrays.
+        """
+        self.path = path
+        metadata_filename = os.path.join(path, METADATA_FILENAME)
+        if os.path.exists(metadata_filename):
+            with open(metadata_filename, mode="r") as fh:
+                metadata = json.load(fh)
+        else:
+            metadata = {
+                "variables": list(variables or DEFAULT_VARIABLES),
+                "freq": freq,
+                "origin": str(pd.Timestamp(origin)),
+                "time_chunk_size": time_chunk_size,
+                "system_chunk_size": system_chunk_size,
+                "dtype": np.dtype(dtype).name,
+                "system_ids": [],
+                "synced": {},
+            }
+        self.variables = metadata["variables"]
+        self.freq = pd.Timedelta(pd.tseries.frequencies.to_offset(metadata["freq"]))
+        self.origin = pd.Timestamp(metadata["origin"])
+        self.time_chunk_size = metadata["time_chunk_size"]
+        self.system_chunk_size = metadata["system_chunk_size"]
+        self.dtype = np.dtype(metadata["dtype"])
+        self._metadata = metadata
+        self.system_ids = [int(pv_system_id) for pv_system_id in metadata["system_ids"]]
+        self._columns = {pv_system_id: i for i, pv_system_id in enumerate(self.system_ids)}
+        # Maps PV system ID to the days which have been copied into the panel.
+        self._synced = {
+            int(pv_system_id): DateIntervalSet(
+                *np.array(intervals, dtype=np.int64).reshape(-1, 2).T
+            )
+            for pv_system_id, intervals in metadata["synced"].items()
+        }
+        # The number of chunk files opened to read, e.g. to check that `read`
+        # only opens the chunks it needs.
+        self.num_chunks_read = 0
+
+    def update(
+        self,
+        source: Union[str, StorageBackend],
+        system_ids: Optional[Iterable[int]] = None,
+    ) -> int:
+        """Copy new data from a download store into the panel.
+
+        Only the days which the store's coverage catalog says have been
+        downloaded since the last update are read.
+
+        Args:
+            source: Filename of the download store, or an open backend.
+            system_ids: The PV systems to copy.  If None, copy all of them.
+
+        Returns:
+            The number of PV systems which had new data.
+        """
+        if isinstance(source, str):
+            with open_backend(source, mode="r") as backend:
+                return self.update(backend, system_ids)
+
+        if COVERAGE_KEY in source:
+            coverage = read_coverage(source)
+        else:
+            coverage = build_coverage(source)
+        if system_ids is None:
+            system_ids = sorted(coverage)
+
+        new_days_per_system = {}
+        for pv_system_id in system_ids:
+            if pv_system_id in coverage:
+                synced = self._synced.get(pv_system_id, DateIntervalSet())
+                new_days = coverage[pv_system_id].downloaded - synced
+                if len(new_days):
+                    new_days_per_system[pv_system_id] = new_days
+
+        # Save the columns of new PV systems before writing to them, so a
+        # column is never re-used for another PV system.
+        for pv_system_id in new_days_per_system:
+            self._get_or_add_column(pv_system_id)
+        self.flush()
+
+        num_systems_updated = 0
+        for pv_system_id, new_days in new_days_per_system.items():
+            for date_range in new_days.to_date_ranges():
+                # Local time, like the coverage catalog (see
+                # `StorageBackend.read_timeseries`).  Read the whole of the last day.
+                start = pd.Timestamp(date_range.start_date)
+                end = pd.Timestamp(date_range.end_date) + pd.Timedelta(days=1, nanoseconds=-1)
+                try:
+                    timeseries = source.read_timeseries(pv_system_id, start, end, self.variables)
+                except KeyError:
+                    continue
+                self.write(pv_system_id, timeseries)
+            self._synced[pv_system_id] = (
+                self._synced.get(pv_system_id, DateIntervalSet()) | new_days
+            )
+            num_systems_updated += 1
+            if num_systems_updated % _SAVE_EVERY_N_SYSTEMS == 0:
+                self.flush()
+        self.flush()
+        _LOG.info("Updated %d PV systems in panel %s", num_systems_updated, self.path)
+        return num_systems_updated
+
+    def write(self, pv_system_id: int, timeseries: pd.DataFrame):
+        """Write the values of `timeseries` into the panel.
+
+        Call `update` instead, unless `timeseries` doesn't come from a
+        download store.  Timezone-aware timestamps are converted to local
+        time (like the rest of the dataset).
+        """
+        if timeseries.empty:
+            return
+        if pv_system_id not in self._columns:
+            self._get_or_add_column(pv_system_id)
+            self.flush()
+        column = self._columns[pv_system_id]
+        system_chunk, column_in_chunk = divmod(column, self.system_chunk_size)
+        slots = self.to_slots(timeseries.index)
+        is_on_grid = slots >= 0
+        if not is_on_grid.all():
+            _LOG.debug("system_id %d: Dropping data before %s", pv_system_id, self.origin)
+        time_chunks, rows = np.divmod(slots, self.time_chunk_size)
+        for variable in self.variables:
+            if variable not in timeseries:
+                continue
+            values = timeseries[variable].values.astype(self.dtype)
+            for time_chunk in np.unique(time_chunks[is_on_grid]):
+                in_chunk = is_on_grid & (time_chunks == time_chunk)
+                chunk = self._open_chunk(variable, time_chunk, system_chunk, create=True)
+                chunk[rows[in_chunk], column_in_chunk] = values[in_chunk]
+                chunk.flush()
+                del chunk
+
+    def read(
+        self,
+        variable: str,
+        start: Union[str, pd.Timestamp],
+        end: Union[str, pd.Timestamp],
+        system_ids: Optional[Iterable[int]] = None,
+    ) -> pd.DataFrame:
+        """Read one variable for many PV systems, from start to end inclusive.
+
+        Only reads the chunks which overlap the requested slots and PV
+        systems.
+
+        Args:
+            system_ids: If None, read every PV system in the panel.  PV
+                systems which aren't in the panel are all NaN.
+
+        Returns:
+            pd.DataFrame with one row per time slot and one column per PV system.
+        """
+        system_ids = self.system_ids if system_ids is None else list(system_ids)
+        first_slot = max(int(self.to_slots(pd.DatetimeIndex([pd.Timestamp(start)]))[0]), 0)
+        last_slot = int(self.to_slots(pd.DatetimeIndex([pd.Timestamp(end)]))[0])
+        num_slots = max(last_slot - first_slot + 1, 0)
+        data = np.full((num_slots, len(system_ids)), np.nan, dtype=self.dtype)
+
+        # Group the requested PV systems by chunk.
+        columns = np.array([self._columns.get(i, -1) for i in system_ids], dtype=np.int64)
+        system_chunks, columns_in_chunk = np.divmod(columns, self.system_chunk_size)
+        for system_chunk in np.unique(system_chunks[columns >= 0]):
+            outputs = np.flatnonzero((columns >= 0) & (system_chunks == system_chunk))
+            for time_chunk in range(
+                first_slot // self.time_chunk_size, last_slot // self.time_chunk_size + 1
+            ):
+                chunk = self._open_chunk(variable, time_chunk, system_chunk)
+                if chunk is None:
+                    continue
+                chunk_start = time_chunk * self.time_chunk_size
+                first_row = max(first_slot - chunk_start, 0)
+                last_row = min(last_slot - chunk_start, self.time_chunk_size - 1)
+                first_output_row = chunk_start + first_row - first_slot
+                data[first_output_row : first_output_row + last_row - first_row + 1, outputs] = (
+                    chunk[first_row : last_row + 1, columns_in_chunk[outputs]]
+                )
+
+        index = self.origin + self.freq * np.arange(first_slot, first_slot + num_slots)
+        return pd.DataFrame(
+            data,
+            index=pd.DatetimeIndex(index, name="datetime"),
+            columns=pd.Index(system_ids, name="pv_system_id"),
+        )
+
+    def chunk(self, variable: str, time_chunk: int, system_chunk: int) -> Optional[np.memmap]:
+        """Memory-map one chunk, read-only.  None if the chunk has no data."""
+        return self._open_chunk(variable, time_chunk, system_chunk)
+
+    def to_slots(self, datetimes: pd.DatetimeIndex) -> np.ndarray:
+        """The time slot of each datetime (negative if before `origin`)."""
+        datetimes = pd.DatetimeIndex(datetimes)
+        if datetimes.tz is not None:
+            datetimes = datetimes.tz_localize(None)
+        return (datetimes.asi8 - self.origin.value) // self.freq.value
+
+    @property
+    def synced(self) -> Dict[int, DateIntervalSet]:
+        """Maps each PV system ID to the days which have been copied into the panel."""
+        return dict(self._synced)
+
+    def _get_or_add_column(self, pv_system_id: int) -> int:
+        column = self._columns.get(pv_system_id)
+        if column is None:
+            column = len(self.system_ids)
+            self.system_ids.append(pv_system_id)
+            self._columns[pv_system_id] = column
+        return column
+
+    def _open_chunk(
+        self, variable: str, time_chunk: int, system_chunk: int, create: bool = False
+    ) -> Optional[np.memmap]:
+        filename = os.path.join(
+            self.path, variable, "{:d}_{:d}.npy".format(time_chunk, system_chunk)
+        )
+        if os.path.exists(filename):
+            if not create:
+                self.num_chunks_read += 1
+            return np.load(filename, mmap_mode="r+" if create else "r")
+        if not create:
+            return None
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        chunk = np.lib.format.open_memmap(
+            filename,
+            mode="w+",
+            dtype=self.dtype,
+            shape=(self.time_chunk_size, self.system_chunk_size),
+        )
+        chunk[:] = np.nan
+        return chunk
+
+    def flush(self):
+        """Save the PV system IDs, and which days have been synced.
+
+        `update` writes the chunks before saving which days they contain, so
+        if the process is killed, the metadata never claims days which
+        aren't in the chunks.
+        """
+        metadata = dict(self._metadata)
+        metadata["system_ids"] = self.system_ids
+        metadata["synced"] = {
+            str(pv_system_id): np.stack([intervals.starts, intervals.ends], axis=1).tolist()
+            for pv_system_id, intervals in sorted(self._synced.items())
+        }
+        os.makedirs(self.path, exist_ok=True)
+        filename = os.path.join(self.path, METADATA_FILENAME)
+        with open(filename + ".tmp", mode="w") as fh:
+            json.dump(metadata, fh)
+        os.replace(filename + ".tmp", filename)
@@ -1,17 +1,20 @@
 import logging
-import os
+import threading
 import time
-import warnings
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from datetime import date, datetime, timedelta
 from io import StringIO
-from typing import Dict, Iterable, List, Optional, Union
+from itertools import chain
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 from urllib.parse import urljoin
 
 import numpy as np
 import pandas as pd
 import requests
-import tables
+from urllib3.util.retry import Retry
 
+from pvoutput.cache import ResponseCache
 from pvoutput.consts import (
     BASE_URL,
     CONFIG_FILENAME,
@@ -19,19 +22,28 @@ from pvoutput.consts import (
     PV_OUTPUT_DATE_FORMAT,
     RATE_LIMIT_PARAMS_TO_API_HEADERS,
 )
-from pvoutput.daterange import DateRange, merge_date_ranges_to_years
+from pvoutput.daterange import DateIntervalSet, DateRange, merge_date_ranges_to_minimum_years
 from pvoutput.exceptions import NoStatusFound, RateLimitExceeded
+from pvoutput.quotaledger import QuotaLedger
+from pvoutput.ratelimit import API, DATA_SERVICE, RateLimiter
+from pvoutput.store import StoreWriter
+from pvoutput.transport import RequestsTransport, Transport
 from pvoutput.utils import (
     _get_param_from_config_file,
     _get_response,
+    _get_session_with_retry,
     _print_and_log,
-    get_date_ranges_to_download,
-    sort_and_de_dupe_pv_system,
-    system_id_to_hdf_key,
+    get_connection_pool_stats,
 )
 
 _LOG = logging.getLogger("pvoutput")
 
+# Bytes read at a time when streaming a response.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Threads used to prefetch statistics, if `num_workers` isn't set.
+NUM_STATISTICS_WORKERS = 4
+
 
 class PVOutput:
     """
@@ -42,6 +54,11 @@ class PVOutput:
         rate_limit_total
         rate_limit_reset_time
         data_service_url
+        session: requests.Session shared by all API requests from this
+            object.  Pass it to `mapscraper.get_soup` to re-use connections.
+        rate_limiter: Optional RateLimiter.  Call `rate_limiter.budget()` to
+            see the current budget.
+        quota_ledger: Optional QuotaLedger shared with other processes.
     """
 
     def __init__(
@@ -50,6 +67,13 @@ class PVOutput:
         system_id: str = None,
         config_filename: Optional[str] = CONFIG_FILENAME,
         data_service_url: Optional[str] = None,
+        pool_maxsize: int = 10,
+        max_retries: Optional[Retry] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        quota_ledger: Optional[QuotaLedger] = None,
+        stream_batch_status: bool = False,
+        response_cache: Optional[ResponseCache] = None,
+        transport: Optional[Transport] = None,
     ):
         """
         Args:
@@ -58,9 +82,31 @@ class PVOutput:
                 PV system then you can register with PVOutput.org and select
                 the 'energy consumption only' box.
             config_filename: Optional, the filename of the .yml config file.
+                If None, then no config file is read, so `api_key` and
+                `system_id` must be passed.
             data_service_url: Optional.  If you have subscribed to
                 PVOutput.org's data service then add the data service URL here.
                 This string must end in '.org'.
+            pool_maxsize: The maximum number of HTTP connections to keep
+                alive per host.  Set this to at least the number of threads
+                which share this object.
+            max_retries: Optional urllib3 Retry policy for failed requests.
+                Defaults to `utils._get_retry()`.
+            rate_limiter: Optional RateLimiter.  If set, then requests are
+                paced so they never exceed the rate limit.
+            quota_ledger: Optional QuotaLedger.  If set, then every request is
+                reserved from the ledger first, so several processes can share
+                one API key.
+            stream_batch_status: The default for the `stream` arg of
+                `get_batch_status`, and hence whether
+                `download_multiple_systems_to_disk` streams getbatchstatus
+                responses.
+            response_cache: Optional ResponseCache.  If set, then the
+                responses to immutable queries (e.g. getstatus for a past
+                date) are cached on disk, and never requested twice.
+            transport: Optional Transport which sends the HTTP requests.
+                Defaults to a `RequestsTransport` using `self.session`.  See
+                `pvoutput.transport` for recording and replaying requests.
         """
 
         self.api_key = api_key
@@ -68,7 +114,14 @@ class PVOutput:
         self.rate_limit_remaining = None
         self.rate_limit_total = None
         self.rate_limit_reset_time = None
+        self._rate_limit_lock = threading.Lock()
         self.data_service_url = data_service_url
+        self.session = _get_session_with_retry(pool_maxsize=pool_maxsize, max_retries=max_retries)
+        self.rate_limiter = rate_limiter
+        self.quota_ledger = quota_ledger
+        self.stream_batch_status = stream_batch_status
+        self.response_cache = response_cache
+        self.transport = RequestsTransport(self.session) if transport is None else transport
 
         # Set from config file if None
         for param_name in ["api_key", "system_id"]:
@@ -94,7 +147,7 @@ class PVOutput:
             setattr(self, param_name, str(getattr(self, param_name)))
 
         # Check for data_service_url
-        if self.data_service_url is None:
+        if self.data_service_url is None and config_filename is not None:
             try:
                 self.data_service_url = _get_param_from_config_file(
                     "data_service_url", config_filename
@@ -151,33 +204,9 @@ class PVOutput:
                     latitude,
                     longitude
         """
-        api_params = {"q": query, "country": int(include_country)}
-
-        if lat is not None and lon is not None:
-            api_params["ll"] = "{:f},{:f}".format(lat, lon)
-
+        api_params = _get_search_api_params(query, lat, lon, include_country)
         pv_systems_text = self._api_query(service="search", api_params=api_params, **kwargs)
-
-        pv_systems = pd.read_csv(
-            StringIO(pv_systems_text),
-            names=[
-                "name",
-                "system_DC_capacity_W",
-                "address",
-                "orientation",
-                "num_outputs",
-                "last_output",
-                "system_id",
-                "panel",
-                "inverter",
-                "distance_km",
-                "latitude",
-                "longitude",
-            ],
-            index_col="system_id",
-        )
-
-        return pv_systems
+        return _process_search_results(pv_systems_text)
 
     def get_status(
         self, pv_system_id: int, date: Union[str, datetime], historic: bool = True, **kwargs
@@ -207,69 +236,24 @@ class PVOutput:
                     voltage
         """
         _LOG.info("system_id %d: Requesting system status for %s", pv_system_id, date)
-        date = date_to_pvoutput_str(date)
-        _check_date(date)
-
-        api_params = {
-            "d": date,  # date, YYYYMMDD, localtime of the PV system
-            "h": int(historic == True),  # We want historical data.
-            "limit": 288,  # API limit is 288 (num of 5-min periods per day).
-            "ext": 0,  # Extended data; we don't want extended data.
-            "sid1": pv_system_id,  # SystemID.
-        }
+        api_params = _get_status_api_params(pv_system_id, date, historic)
 
         try:
             pv_system_status_text = self._api_query(
                 service="getstatus", api_params=api_params, **kwargs
             )
         except NoStatusFound:
-            _LOG.info("system_id %d: No status found for date %s", pv_system_id, date)
+            _LOG.info("system_id %d: No status found for date %s", pv_system_id, api_params["d"])
             pv_system_status_text = ""
 
-        # See https://pvoutput.org/help.html#api-getstatus but make sure
-        # you read the 'History Query' subsection, as a historical query
-        # has slightly different return columns compared to a non-historical
-        # query!
-        columns = (
-            [
-                "cumulative_energy_gen_Wh",
-                "energy_efficiency_kWh_per_kW",
-                "instantaneous_power_gen_W",
-                "average_power_gen_W",
-                "power_gen_normalised",
-                "energy_consumption_Wh",
-                "power_demand_W",
-                "temperature_C",
-                "voltage",
-            ]
-            if historic
-            else [
-                "cumulative_energy_gen_Wh",
-                "instantaneous_power_gen_W",
-                "energy_consumption_Wh",
-                "power_demand_W",
-                "power_gen_normalised",
-                "temperature_C",
-                "voltage",
-            ]
-        )
-
-        pv_system_status = pd.read_csv(
-            StringIO(pv_system_status_text),
-            lineterminator=";",
-            names=["date", "time"] + columns,
-            parse_dates={"datetime": ["date", "time"]},
-            index_col=["datetime"],
-            dtype={col: np.float64 for col in columns},
-        ).sort_index()
-
-        return pv_system_status
+        return _process_status(pv_system_status_text, historic)
 
     def get_batch_status(
         self,
         pv_system_id: int,
         date_to: Optional[Union[str, datetime]] = None,
         max_retries: Optional[int] = 1000,
+        stream: Optional[bool] = None,
         **kwargs
     ) -> Union[None, pd.DataFrame]:
         """Get batch PV system status (e.g. power generation).
@@ -297,6 +281,10 @@ class PVOutput:
                 a '202 Accepted' request.  Set `max_retries` to 1 if you want
                 to return immediately, even if data isn't ready yet (and hence
                 this function will return None).
+            stream: If True, then read the response in chunks of
+                `STREAM_CHUNK_SIZE` bytes, and parse each chunk as it
+                arrives, so the whole response is never held in memory.
+                Defaults to `self.stream_batch_status`.
 
         Returns:
             None (if data isn't ready after retrying max_retries times) or
@@ -308,9 +296,11 @@ class PVOutput:
                     temperature_C,
                     voltage
         """
-        api_params = {"sid1": pv_system_id}
-
-        _set_date_param(date_to, api_params, "dt")
+        api_params = _get_batch_status_api_params(pv_system_id, date_to)
+        if stream is None:
+            stream = self.stream_batch_status
+        if stream:
+            kwargs["stream"] = True
 
         for retry in range(max_retries):
             try:
@@ -322,6 +312,15 @@ class PVOutput:
                 pv_system_status_text = ""
                 break
 
+            if stream:
+                # Only the first chunk is needed to check if the data is ready.
+                chunks = pv_system_status_text
+                first_chunk = next(chunks, "")
+                if "Accepted 202" not in first_chunk:
+                    return _process_batch_status_chunks(chain([first_chunk], chunks))
+                chunks.close()
+                pv_system_status_text = first_chunk
+
             if "Accepted 202" in pv_system_status_text:
                 if retry == 0:
                     _print_and_log("Request accepted.")
@@ -339,6 +338,104 @@ class PVOutput:
 
         return _process_batch_status(pv_system_status_text)
 
+    def get_batch_status_for_multiple(
+        self,
+        jobs: Iterable[Tuple[int, Union[str, date]]],
+        max_pending_jobs: int = 50,
+        min_poll_interval: float = 15,
+        max_poll_interval: float = 300,
+        stop_at_first_pending: bool = False,
+        **kwargs
+    ) -> Iterator[Tuple[int, date, pd.DataFrame]]:
+        """Get batch PV system status for many (pv_system_id, date_to) pairs.
+
+        Instead of waiting for each getbatchstatus request to be ready before
+        submitting the next, this submits up to `max_pending_jobs` requests up
+        front and then polls all the pending requests together, yielding each
+        timeseries as soon as it's ready.  Polling backs off (up to
+        `max_poll_interval` seconds) while nothing is ready, and speeds up
+        again (down to `min_poll_interval` seconds) as results land.
+
+        Each polling round visits the pending requests in the order they were
+        submitted.
+
+        Args:
+            jobs: Iterable of (pv_system_id, date_to) pairs.  See
+                `get_batch_status` for the meaning of date_to.
+            max_pending_jobs: The maximum number of requests waiting to be
+                prepared by PVOutput.org at any one time.
+            min_poll_interval, max_poll_interval: Seconds between polling rounds.
+            stop_at_first_pending: If True, then each polling round stops at
+                the first request which isn't ready yet, which saves API quota
+                if PVOutput.org prepares requests in the order they were
+                submitted.
+            **kwargs: Passed to `_api_query`.
+
+        Yields:
+            (pv_system_id, date_to, timeseries) tuples, in the order in which
+            the results are ready.  `timeseries` is the same as the DataFrame
+            returned by `get_batch_status`, and is empty if PVOutput.org
+            returned 'no status found'.
+        """
+        jobs = iter(jobs)
+        pending = []
+        poll_interval = min_poll_interval
+
+        def _query(pv_system_id, date_to):
+            api_params = _get_batch_status_api_params(pv_system_id, date_to)
+            try:
+                return self._api_query(
+                    service="getbatchstatus", api_params=api_params, use_data_service=True, **kwargs
+                )
+            except NoStatusFound:
+                _LOG.info("system_id %d: No status found for date_to %s", pv_system_id, date_to)
+                return ""
+
+        while True:
+            # Submit new jobs.
+            while len(pending) < max_pending_jobs:
+                try:
+                    pv_system_id, date_to = next(jobs)
+                except StopIteration:
+                    break
+                pv_system_status_text = _query(pv_system_id, date_to)
+                if "Accepted 202" in pv_system_status_text:
+                    _LOG.info(
+                        "system_id %d: Request accepted for date_to %s", pv_system_id, date_to
+                    )
+                    pending.append((pv_system_id, date_to))
+                else:
+                    yield pv_system_id, date_to, _process_batch_status(pv_system_status_text)
+
+            if not pending:
+                return
+
+            _print_and_log(
+                "{:d} getbatchstatus requests pending.  Sleeping for {:.0f} seconds.".format(
+                    len(pending), poll_interval
+                )
+            )
+            time.sleep(poll_interval)
+
+            # Poll pending jobs.
+            still_pending = []
+            for i, (pv_system_id, date_to) in enumerate(pending):
+                pv_system_status_text = _query(pv_system_id, date_to)
+                if "Accepted 202" in pv_system_status_text:
+                    still_pending.append((pv_system_id, date_to))
+                    if stop_at_first_pending:
+                        still_pending.extend(pending[i + 1 :])
+                        break
+                else:
+                    yield pv_system_id, date_to, _process_batch_status(pv_system_status_text)
+            num_ready = len(pending) - len(still_pending)
+            pending = still_pending
+
+            if num_ready:
+                poll_interval = max(poll_interval / 2, min_poll_interval)
+            else:
+                poll_interval = min(poll_interval * 2, max_poll_interval)
+
     def get_metadata(self, pv_system_id: int, **kwargs) -> pd.Series:
         """Get metadata for a single PV system.
 
@@ -369,50 +466,9 @@ class PVOutput:
                 secondary_array_tilt_degrees
         """
         pv_metadata_text = self._api_query(
-            service="getsystem",
-            api_params={
-                "array2": 1,  # Provide data about secondary array, if present.
-                "tariffs": 0,
-                "teams": 0,
-                "est": 0,
-                "donations": 0,
-                "sid1": pv_system_id,  # SystemID
-                "ext": 0,  # Include extended data?
-            },
-            **kwargs
+            service="getsystem", api_params=_get_metadata_api_params(pv_system_id), **kwargs
         )
-
-        pv_metadata = pd.read_csv(
-            StringIO(pv_metadata_text),
-            lineterminator=";",
-            names=[
-                "name",
-                "system_DC_capacity_W",
-                "address",
-                "num_panels",
-                "panel_capacity_W_each",
-                "panel_brand",
-                "num_inverters",
-                "inverter_capacity_W",
-                "inverter_brand",
-                "orientation",
-                "array_tilt_degrees",
-                "shade",
-                "install_date",
-                "latitude",
-                "longitude",
-                "status_interval_minutes",
-                "secondary_num_panels",
-                "secondary_panel_capacity_W_each",
-                "secondary_orientation",
-                "secondary_array_tilt_degrees",
-            ],
-            parse_dates=["install_date"],
-            nrows=1,
-        ).squeeze()
-        pv_metadata["system_id"] = pv_system_id
-        pv_metadata.name = pv_system_id
-        return pv_metadata
+        return _process_system_metadata(pv_metadata_text, pv_system_id)
 
     def get_statistic(
         self,
@@ -444,19 +500,8 @@ class PVOutput:
                 query_date_from,
                 query_date_to
         """
-        if date_from and not date_to:
-            date_to = pd.Timestamp.now().date()
-        if date_to and not date_from:
-            date_from = pd.Timestamp("1900-01-01").date()
-
-        api_params = {
-            "c": 0,  # consumption and import
-            "crdr": 0,  # credits / debits
-            "sid1": pv_system_id,  # SystemID
-        }
-
-        _set_date_param(date_from, api_params, "df")
-        _set_date_param(date_to, api_params, "dt")
+        date_from, date_to = _fill_statistic_dates(date_from, date_to)
+        api_params = _get_statistic_api_params(pv_system_id, date_from, date_to)
 
         try:
             pv_metadata_text = self._api_query(
@@ -465,91 +510,7 @@ class PVOutput:
         except NoStatusFound:
             pv_metadata_text = ""
 
-        columns = [
-            "total_energy_gen_Wh",
-            "energy_exported_Wh",
-            "average_daily_energy_gen_Wh",
-            "minimum_daily_energy_gen_Wh",
-            "maximum_daily_energy_gen_Wh",
-            "average_efficiency_kWh_per_kW",
-            "num_outputs",
-            "actual_date_from",
-            "actual_date_to",
-            "record_efficiency_kWh_per_kW",
-            "record_efficiency_date",
-        ]
-        date_cols = ["actual_date_from", "actual_date_to", "record_efficiency_date"]
-        numeric_cols = set(columns) - set(date_cols)
-        pv_metadata = pd.read_csv(
-            StringIO(pv_metadata_text),
-            names=columns,
-            dtype={col: np.float32 for col in numeric_cols},
-            parse_dates=date_cols,
-        )
-        if pv_metadata.empty:
-            data = {col: np.float32(np.NaN) for col in numeric_cols}
-            data.update({col: pd.NaT for col in date_cols})
-            pv_metadata = pd.DataFrame(data, index=[pv_system_id])
-        else:
-            pv_metadata.index = [pv_system_id]
-
-        pv_metadata["query_date_from"] = pd.Timestamp(date_from) if date_from else pd.NaT
-        pv_metadata["query_date_to"] = pd.Timestamp(date_to) if date_to else pd.Timestamp.now()
-        return pv_metadata
-
-    def _get_statistic_with_cache(
-        self,
-        store_filename: str,
-        pv_system_id: int,
-        date_from: Optional[Union[str, date]] = None,
-        date_to: Optional[Union[str, date]] = None,
-        **kwargs
-    ) -> pd.Series:
-        """Will try to get stats from store_filename['statistics'].  If this
-        fails, or if date_to > query_date_to, or if
-        date_from < query_date_from, then will call the API.  Note that the aim
-        of this function is just to find the relevant actual_date_from and
-        actual_date_to, so this function does not respect the other params.
-        """
-
-        if date_from:
-            date_from = pd.Timestamp(date_from).date()
-        if date_to:
-            date_to = pd.Timestamp(date_to).date()
-
-        def _get_fresh_statistic():
-            _LOG.info("pv_system %d: Getting fresh statistic.", pv_system_id)
-            stats = self.get_statistic(pv_system_id, **kwargs)
-            with pd.HDFStore(store_filename, mode="a") as store:
-                try:
-                    store.remove(key="statistics", where="index=pv_system_id")
-                except KeyError:
-                    pass
-                store.append(key="statistics", value=stats)
-            return stats
-
-        try:
-            stats = pd.read_hdf(store_filename, key="statistics", where="index=pv_system_id")
-        except (FileNotFoundError, KeyError):
-            return _get_fresh_statistic()
-
-        if stats.empty:
-            return _get_fresh_statistic()
-
-        query_date_from = stats.iloc[0]["query_date_from"]
-        query_date_to = stats.iloc[0]["query_date_to"]
-
-        if (
-            not pd.isnull(date_from)
-            and not pd.isnull(query_date_from)
-            and date_from < query_date_from.date()
-        ):
-            return _get_fresh_statistic()
-
-        if not pd.isnull(date_to) and date_to > query_date_to.date():
-            return _get_fresh_statistic()
-
-        return stats
+        return _process_statistic(pv_metadata_text, pv_system_id, date_from, date_to)
 
     def download_multiple_systems_to_disk(
         self,
@@ -560,6 +521,8 @@ class PVOutput:
         timezone: Optional[str] = None,
         min_data_availability: Optional[float] = 0.5,
         use_get_batch_status_if_available: Optional[bool] = True,
+        max_pending_batch_jobs: Optional[int] = None,
+        num_workers: Optional[int] = None,
     ):
         """Download multiple PV system IDs to disk.
 
@@ -591,46 +554,187 @@ class PVOutput:
                 PVOutput's getbatchstatus API (which must be paid for, and
                 `data_service_url` must be set in `~/.pvoutput.yml` or when
                 initialising the PVOutput object).
+            max_pending_batch_jobs: Optional int.  Only used with getbatchstatus.
+                If None, then request one PV-system-year at a time and wait
+                for each to be ready before requesting the next.  If an int,
+                then first work out which years to download for every PV
+                system, and then keep up to `max_pending_batch_jobs` requests
+                pending at once.  See `get_batch_status_for_multiple`.
+            num_workers: Optional int.  If None, then download one request at a
+                time.  If an int, then send API requests from a pool of
+                `num_workers` threads, while this thread plans the downloads
+                and is the only thread which writes to `output_filename`.
+                Can't be combined with `max_pending_batch_jobs`.  The HTTP
+                connection pool should be at least as large as
+                `num_workers` (see the `pool_maxsize` arg to PVOutput).
+
+        Before downloading any timeseries, gets statistics for every PV
+        system and drops the PV systems which don't need downloading.
+        See `plan_downloads`.
         """
-        n = len(system_ids)
-        for i, pv_system_id in enumerate(system_ids):
-            _LOG.info("**********************")
-            msg = "system_id {:d}: {:d} of {:d} ({:%})".format(pv_system_id, i + 1, n, (i + 1) / n)
-            _LOG.info(msg)
-            print("\r", msg, end="", flush=True)
-
-            # Sorted list of DateRange objects.  For each DateRange,
-            # we need to download from start_date to end_date inclusive.
-            date_ranges_to_download = get_date_ranges_to_download(
-                output_filename, pv_system_id, start_date, end_date
+        if num_workers and max_pending_batch_jobs:
+            raise ValueError("Set max_pending_batch_jobs or num_workers, not both!")
+        if use_get_batch_status_if_available and not self.data_service_url:
+            raise ValueError("data_service_url is not set!")
+
+        with StoreWriter(output_filename) as writer:
+            plan = self._plan_downloads(
+                writer,
+                system_ids,
+                start_date,
+                end_date,
+                min_data_availability,
+                use_get_status=not use_get_batch_status_if_available,
+                num_workers=num_workers or NUM_STATISTICS_WORKERS,
             )
+            _print_and_log(_summarise_plan(plan))
+            plan = plan[plan["status"] == "download"]
+            system_ids = plan.index.tolist()
+
+            if num_workers:
+                self._download_multiple_in_parallel(
+                    plan["date_ranges"],
+                    writer,
+                    timezone,
+                    use_get_status=not use_get_batch_status_if_available,
+                    num_workers=num_workers,
+                )
+                return
+
+            batch_jobs = []
+            n = len(system_ids)
+            for i, pv_system_id in enumerate(system_ids):
+                _LOG.info("**********************")
+                msg = "system_id {:d}: {:d} of {:d} ({:%})".format(
+                    pv_system_id, i + 1, n, (i + 1) / n
+                )
+                _LOG.info(msg)
+                print("\r", msg, end="", flush=True)
 
-            # How much data is actually available?
-            date_ranges_to_download = self._filter_date_range(
-                output_filename, pv_system_id, date_ranges_to_download, min_data_availability
-            )
+                # Sorted list of DateRange objects.  For each DateRange,
+                # we need to download from start_date to end_date inclusive.
+                date_ranges_to_download = plan.at[pv_system_id, "date_ranges"]
+                _LOG.info(
+                    "system_id %d: Will download these date ranges: %s",
+                    pv_system_id,
+                    date_ranges_to_download,
+                )
 
-            if not date_ranges_to_download:
-                _LOG.info("system_id %d: No data left to download :)", pv_system_id)
-                continue
+                if use_get_batch_status_if_available:
+                    if max_pending_batch_jobs:
+                        years = merge_date_ranges_to_minimum_years(date_ranges_to_download)[::-1]
+                        batch_jobs.extend((pv_system_id, year.end_date) for year in years)
+                    else:
+                        self._download_multiple_using_get_batch_status(
+                            writer, pv_system_id, date_ranges_to_download, timezone
+                        )
+                else:
+                    self._download_multiple_using_get_status(
+                        writer, pv_system_id, date_ranges_to_download, timezone
+                    )
 
-            _LOG.info(
-                "system_id %d: Will download these date ranges: %s",
-                pv_system_id,
-                date_ranges_to_download,
+            if batch_jobs:
+                self._download_batch_jobs(writer, batch_jobs, timezone, max_pending_batch_jobs)
+
+    def plan_downloads(
+        self,
+        system_ids: Iterable[int],
+        start_date: datetime,
+        end_date: datetime,
+        output_filename: str,
+        min_data_availability: Optional[float] = 0.5,
+        use_get_batch_status_if_available: Optional[bool] = True,
+        num_workers: int = NUM_STATISTICS_WORKERS,
+    ) -> pd.DataFrame:
+        """Work out what `download_multiple_systems_to_disk` would download.
+
+        Gets statistics for every PV system (from `output_filename`, or
+        from the API, using `num_workers` threads), so this may use up to
+        one API request per PV system.  Doesn't download any timeseries.
+
+        Returns:
+            pd.DataFrame with one row per PV system.  See `_triage_statistics`
+            for the columns.
+        """
+        with StoreWriter(output_filename) as writer:
+            return self._plan_downloads(
+                writer,
+                system_ids,
+                start_date,
+                end_date,
+                min_data_availability,
+                use_get_status=not use_get_batch_status_if_available,
+                num_workers=num_workers,
             )
 
-            if use_get_batch_status_if_available:
-                if self.data_service_url:
-                    self._download_multiple_using_get_batch_status(
-                        output_filename, pv_system_id, date_ranges_to_download, timezone
-                    )
-                else:
-                    raise ValueError("data_service_url is not set!")
+    def _plan_downloads(
+        self,
+        writer: StoreWriter,
+        system_ids: Iterable[int],
+        start_date: datetime,
+        end_date: datetime,
+        min_data_availability: Optional[float],
+        use_get_status: bool,
+        num_workers: int,
+    ) -> pd.DataFrame:
+        # Remove duplicate PV system IDs, but keep the order.
+        system_ids = list(dict.fromkeys(system_ids))
+        date_ranges = pd.Series(
+            [writer.get_date_ranges_to_download(i, start_date, end_date) for i in system_ids],
+            index=pd.Index(system_ids, name="pv_system_id"),
+            dtype=object,
+        )
+        # Only PV systems with dates left to download need stats.
+        stats = self._prefetch_statistics(
+            writer, date_ranges[date_ranges.map(len) > 0], num_workers
+        )
+        return _triage_statistics(date_ranges, stats, min_data_availability, use_get_status)
+
+    def _prefetch_statistics(
+        self, writer: StoreWriter, date_ranges: pd.Series, num_workers: int
+    ) -> pd.DataFrame:
+        """Get stats for each PV system in `date_ranges`, from the store or the API.
+
+        Stats which aren't in the store (or which are too old to cover the
+        dates to download) are fetched from the API by a pool of
+        `num_workers` threads.  This thread is the only one which writes to
+        the store.
+
+        Returns:
+            pd.DataFrame of stats, one row per PV system, with an extra
+            `stats_from_cache` column.
+        """
+        rows = {}
+        systems_to_fetch = []
+        for pv_system_id, ranges in date_ranges.items():
+            stats = writer.get_statistic(pv_system_id, date_to=ranges[-1].end_date)
+            if stats is None:
+                systems_to_fetch.append(pv_system_id)
             else:
-                self._download_multiple_using_get_status(
-                    output_filename, pv_system_id, date_ranges_to_download, timezone
-                )
+                rows[pv_system_id] = stats.assign(stats_from_cache=True)
+
+        if systems_to_fetch:
+            _print_and_log(
+                "Getting fresh statistics for {:d} PV systems.".format(len(systems_to_fetch))
+            )
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                futures = {
+                    executor.submit(
+                        self.get_statistic, pv_system_id, wait_if_rate_limit_exceeded=True
+                    ): pv_system_id
+                    for pv_system_id in systems_to_fetch
+                }
+                for future in as_completed(futures):
+                    pv_system_id = futures[future]
+                    stats = future.result()
+                    writer.put_statistic(pv_system_id, stats)
+                    rows[pv_system_id] = stats.assign(stats_from_cache=False)
+
+        if not rows:
+            return pd.DataFrame(
+                columns=["num_outputs", "actual_date_from", "actual_date_to", "stats_from_cache"]
+            )
+        return pd.concat(rows.values())
 
     def get_insolation_forecast(
         self,
@@ -660,112 +764,194 @@ class PVOutput:
         Returns:
 
         """
-        date = date_to_pvoutput_str(date)
-        _check_date(date, prediction=True)
-        api_params = {
-            "d": date,  # date, YYYYMMDD, localtime of the PV system
-            "sid1": pv_system_id,  # SystemID.
-            "tz": timezone,  # defaults to configured timezone of system otherwise GMT
-        }
-        if lat is not None and lon is not None:
-            api_params["ll"] = "{:f},{:f}".format(lat, lon)
-
+        api_params = _get_insolation_api_params(date, pv_system_id, timezone, lat, lon)
         try:
             pv_insolation_text = self._api_query(
                 service="getinsolation", api_params=api_params, **kwargs
             )
         except NoStatusFound:
-            _LOG.info("system_id %d: No status found for date %s", pv_system_id, date)
+            _LOG.info("system_id %d: No status found for date %s", pv_system_id, api_params["d"])
             pv_insolation_text = ""
 
-        columns = ["predicted_power_gen_W", "predicted_cumulative_energy_gen_Wh"]
-        pv_insolation = pd.read_csv(
-            StringIO(pv_insolation_text),
-            lineterminator=";",
-            names=["time"] + columns,
-            dtype={col: np.float64 for col in columns},
-        ).sort_index()
-        pv_insolation.index = pd.to_datetime(
-            date + " " + pv_insolation.time, format="%Y-%m-%d %H:%M"
-        )
-        pv_insolation.drop("time", axis=1, inplace=True)
-        return pv_insolation
+        return _process_insolation(pv_insolation_text, api_params["d"])
 
-    def _filter_date_range(
+    def _download_multiple_using_get_batch_status(
         self,
-        store_filename: str,
-        system_id: int,
-        date_ranges: Iterable[DateRange],
-        min_data_availability: Optional[float] = 0.5,
-    ) -> List[DateRange]:
-        """Check getstatistic to see if system_id has data for all date ranges.
-
-        Args:
-            system_id: PV system ID.
-            store_filename: HDF5 filename to cache statistics to / from.
-            date_ranges: List of DateRange objects.
-            min_data_availability: A float in the range [0, 1].  1 means only
-                accept PV systems which have no days of missing data.  0 means
-                accept all PV systems, no matter if they have missing data.
-        """
-        if not date_ranges:
-            return date_ranges
+        writer: StoreWriter,
+        pv_system_id,
+        date_ranges_to_download,
+        timezone: Optional[str] = None,
+    ):
+        # Download the oldest year first, so each year is appended after
+        # the existing data, and the writer doesn't have to merge it.
+        years = merge_date_ranges_to_minimum_years(date_ranges_to_download)[::-1]
+        dates_to = [year.end_date for year in years]
+        self._download_multiple_worker(
+            writer, pv_system_id, dates_to, timezone, use_get_status=False
+        )
 
-        stats = self._get_statistic_with_cache(
-            store_filename,
-            system_id,
-            date_to=date_ranges[-1].end_date,
-            wait_if_rate_limit_exceeded=True,
-        ).squeeze()
+    def _download_multiple_using_get_status(
+        self,
+        writer: StoreWriter,
+        pv_system_id,
+        date_ranges_to_download,
+        timezone: Optional[str] = None,
+    ):
+        for date_range in date_ranges_to_download:
+            dates = date_range.date_range()
+            self._download_multiple_worker(
+                writer, pv_system_id, dates, timezone, use_get_status=True
+            )
 
-        if pd.isnull(stats["actual_date_from"]) or pd.isnull(stats["actual_date_to"]):
-            _LOG.info("system_id %d: Stats say there is no data!", system_id)
-            return []
+    def _download_batch_jobs(
+        self,
+        writer: StoreWriter,
+        jobs: List[Tuple[int, date]],
+        timezone: Optional[str] = None,
+        max_pending_jobs: int = 50,
+    ):
+        """Download (pv_system_id, date_to) pairs using get_batch_status_for_multiple."""
+        n = len(jobs)
+        results = self.get_batch_status_for_multiple(
+            jobs, max_pending_jobs=max_pending_jobs, wait_if_rate_limit_exceeded=True
+        )
+        for i, (pv_system_id, date_to, timeseries) in enumerate(results):
+            msg = "system_id {:d}: {:d} of {:d} getbatchstatus requests ({:%})".format(
+                pv_system_id, i + 1, n, (i + 1) / n
+            )
+            _LOG.info(msg)
+            print("\r", msg, end="", flush=True)
+            self._write_downloaded_timeseries(
+                writer,
+                pv_system_id,
+                date_to,
+                timeseries,
+                datetime_of_api_request=pd.Timestamp.utcnow(),
+                timezone=timezone,
+                use_get_status=False,
+            )
 
-        timeseries_date_range = DateRange(stats["actual_date_from"], stats["actual_date_to"])
+    def _download_multiple_in_parallel(
+        self,
+        date_ranges: pd.Series,
+        writer: StoreWriter,
+        timezone: Optional[str],
+        use_get_status: bool,
+        num_workers: int,
+    ):
+        """Download multiple PV systems using a pool of `num_workers` threads.
 
-        data_availability = stats["num_outputs"] / (timeseries_date_range.total_days() + 1)
+        Args:
+            date_ranges: The DateRanges to download, indexed by PV system ID
+                (the `date_ranges` column of the plan from `_plan_downloads`).
 
-        if data_availability < min_data_availability:
+        The worker threads only send API requests (HDF5 isn't thread-safe).
+        This thread passes each timeseries to `writer` as soon as it arrives,
+        so, just like the sequential downloader, the job can be killed and
+        re-started.
+        """
+        systems_to_queue = iter(date_ranges.items())
+        download_jobs = deque()
+        max_pending = num_workers * 2
+        # Maps each Future to (pv_system_id, date_to_load).
+        pending_downloads = {}
+        num_jobs_remaining = Counter()
+        total_rows = Counter()
+        num_systems_queued = 0
+        num_jobs_planned = 0
+        num_jobs_done = 0
+
+        def _queue_downloads(pv_system_id, date_ranges):
+            nonlocal num_jobs_planned
             _LOG.info(
-                "system_id %d: Data availability too low!  Only %.0f %%.",
-                system_id,
-                data_availability * 100,
+                "system_id %d: Will download these date ranges: %s", pv_system_id, date_ranges
             )
-            return []
-
-        new_date_ranges = []
-        for date_range in date_ranges:
-            new_date_range = date_range.intersection(timeseries_date_range)
-            if new_date_range:
-                new_date_ranges.append(new_date_range)
-        return new_date_ranges
+            if use_get_status:
+                dates = [d for date_range in date_ranges for d in date_range.date_range()]
+            else:
+                years = merge_date_ranges_to_minimum_years(date_ranges)[::-1]
+                dates = [year.end_date for year in years]
+            download_jobs.extend((pv_system_id, date_to_load) for date_to_load in dates)
+            num_jobs_remaining[pv_system_id] += len(dates)
+            num_jobs_planned += len(dates)
+
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            while True:
+                # Keep the workers busy.  Only queue the next PV system's
+                # requests once the queue is empty, so it stays short.
+                while len(pending_downloads) < max_pending:
+                    if download_jobs:
+                        pv_system_id, date_to_load = download_jobs.popleft()
+                        future = executor.submit(
+                            self._fetch_timeseries, pv_system_id, date_to_load, use_get_status
+                        )
+                        pending_downloads[future] = (pv_system_id, date_to_load)
+                        continue
+                    next_system = next(systems_to_queue, None)
+                    if next_system is None:
+                        break
+                    num_systems_queued += 1
+                    _queue_downloads(*next_system)
+
+                if not pending_downloads:
+                    break
+
+                done, _ = wait(pending_downloads, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pv_system_id, date_to_load = pending_downloads.pop(future)
+                    datetime_of_api_request, timeseries = future.result()
+                    total_rows[pv_system_id] += self._write_downloaded_timeseries(
+                        writer,
+                        pv_system_id,
+                        date_to_load,
+                        timeseries,
+                        datetime_of_api_request,
+                        timezone,
+                        use_get_status,
+                    )
+                    num_jobs_done += 1
+                    num_jobs_remaining[pv_system_id] -= 1
+                    if num_jobs_remaining[pv_system_id] == 0:
+                        writer.flush()
+                        _LOG.info(
+                            "system_id %d: %d total rows downloaded",
+                            pv_system_id,
+                            total_rows[pv_system_id],
+                        )
 
-    def _download_multiple_using_get_batch_status(
-        self, output_filename, pv_system_id, date_ranges_to_download, timezone: Optional[str] = None
-    ):
-        years = merge_date_ranges_to_years(date_ranges_to_download)
-        dates_to = [year.end_date for year in years]
-        total_rows = self._download_multiple_worker(
-            output_filename, pv_system_id, dates_to, timezone, use_get_status=False
-        )
+                    msg = (
+                        "{:d} of {:d} requests done for {:d} of {:d} PV systems queued so far."
+                        "  {:d} requests in flight.".format(
+                            num_jobs_done,
+                            num_jobs_planned,
+                            num_systems_queued,
+                            len(date_ranges),
+                            len(pending_downloads),
+                        )
+                    )
+                    _LOG.info(msg)
+                    print("\r", msg, end="", flush=True)
 
-        # Re-load data, sort, remove duplicate indicies, append back
-        if total_rows:
-            with pd.HDFStore(output_filename, mode="a", complevel=9) as store:
-                sort_and_de_dupe_pv_system(store, pv_system_id)
+    def _fetch_timeseries(
+        self, pv_system_id: int, date_to_load: date, use_get_status: bool
+    ) -> Tuple[pd.Timestamp, pd.DataFrame]:
+        """Download one day (getstatus) or one year (getbatchstatus) of data.
 
-    def _download_multiple_using_get_status(
-        self, output_filename, pv_system_id, date_ranges_to_download, timezone: Optional[str] = None
-    ):
-        for date_range in date_ranges_to_download:
-            dates = date_range.date_range()
-            self._download_multiple_worker(
-                output_filename, pv_system_id, dates, timezone, use_get_status=True
+        Returns:
+            (datetime_of_api_request, timeseries)
+        """
+        _LOG.info("system_id %d: Requesting date: %s", pv_system_id, date_to_load)
+        datetime_of_api_request = pd.Timestamp.utcnow()
+        if use_get_status:
+            timeseries = self.get_status(
+                pv_system_id, date_to_load, wait_if_rate_limit_exceeded=True
             )
+        else:
+            timeseries = self.get_batch_status(pv_system_id, date_to=date_to_load)
+        return datetime_of_api_request, timeseries
 
     def _download_multiple_worker(
-        self, output_filename, pv_system_id, dates, timezone, use_get_status
+        self, writer: StoreWriter, pv_system_id, dates, timezone, use_get_status
     ) -> int:
         """
         Returns:
@@ -773,64 +959,79 @@ class PVOutput:
         """
         total_rows = 0
         for date_to_load in dates:
-            _LOG.info("system_id %d: Requesting date: %s", pv_system_id, date_to_load)
-            datetime_of_api_request = pd.Timestamp.utcnow()
+            datetime_of_api_request, timeseries = self._fetch_timeseries(
+                pv_system_id, date_to_load, use_get_status
+            )
+            total_rows += self._write_downloaded_timeseries(
+                writer,
+                pv_system_id,
+                date_to_load,
+                timeseries,
+                datetime_of_api_request,
+                timezone,
+                use_get_status,
+            )
+
+        _LOG.info("system_id %d: %d total rows downloaded", pv_system_id, total_rows)
+        return total_rows
+
+    def _write_downloaded_timeseries(
+        self,
+        writer: StoreWriter,
+        pv_system_id,
+        date_to_load,
+        timeseries,
+        datetime_of_api_request,
+        timezone,
+        use_get_status,
+    ) -> int:
+        """Buffer one downloaded timeseries in `writer`, and record missing dates.
+
+        Returns:
+            number of rows written
+        """
+        if timeseries.empty:
+            _LOG.info("system_id %d: Got empty timeseries back for %s", pv_system_id, date_to_load)
             if use_get_status:
-                timeseries = self.get_status(
-                    pv_system_id, date_to_load, wait_if_rate_limit_exceeded=True
+                _append_missing_date_range(
+                    writer,
+                    pv_system_id,
+                    date_to_load,
+                    date_to_load,
+                    datetime_of_api_request,
                 )
             else:
-                timeseries = self.get_batch_status(pv_system_id, date_to=date_to_load)
-            if timeseries.empty:
-                _LOG.info(
-                    "system_id %d: Got empty timeseries back for %s", pv_system_id, date_to_load
-                )
-                if use_get_status:
-                    _append_missing_date_range(
-                        output_filename,
-                        pv_system_id,
-                        date_to_load,
-                        date_to_load,
-                        datetime_of_api_request,
-                    )
-                else:
-                    _append_missing_date_range(
-                        output_filename,
-                        pv_system_id,
-                        date_to_load - timedelta(days=365),
-                        date_to_load,
-                        datetime_of_api_request,
-                    )
-            else:
-                total_rows += len(timeseries)
-                timeseries = timeseries.tz_localize(timezone)
-                _LOG.info(
-                    "system_id: %d: %d rows retrieved: %s to %s",
+                _append_missing_date_range(
+                    writer,
                     pv_system_id,
-                    len(timeseries),
-                    timeseries.index[0],
-                    timeseries.index[-1],
+                    date_to_load - timedelta(days=365),
+                    date_to_load,
+                    datetime_of_api_request,
                 )
-                if use_get_status:
-                    check_pv_system_status(timeseries, date_to_load)
-                else:
-                    _record_gaps(
-                        output_filename,
-                        pv_system_id,
-                        date_to_load,
-                        timeseries,
-                        datetime_of_api_request,
-                    )
-                timeseries["datetime_of_API_request"] = datetime_of_api_request
-                timeseries["query_date"] = pd.Timestamp(date_to_load)
-                key = system_id_to_hdf_key(pv_system_id)
-                with pd.HDFStore(output_filename, mode="a", complevel=9) as store:
-                    with warnings.catch_warnings():
-                        warnings.simplefilter("ignore", tables.NaturalNameWarning)
-                        store.append(key=key, value=timeseries, data_columns=True)
-
-        _LOG.info("system_id %d: %d total rows downloaded", pv_system_id, total_rows)
-        return total_rows
+            return 0
+
+        timeseries = timeseries.tz_localize(timezone)
+        _LOG.info(
+            "system_id: %d: %d rows retrieved: %s to %s",
+            pv_system_id,
+            len(timeseries),
+            timeseries.index[0],
+            timeseries.index[-1],
+        )
+        if use_get_status:
+            check_pv_system_status(timeseries, date_to_load)
+        else:
+            _record_gaps(
+                writer,
+                pv_system_id,
+                date_to_load,
+                timeseries,
+                datetime_of_api_request,
+            )
+        timeseries["datetime_of_API_request"] = datetime_of_api_request
+        timeseries["query_date"] = pd.Timestamp(date_to_load)
+        writer.append_timeseries(pv_system_id, timeseries)
+        return len(timeseries)
 
     def _api_query(
         self,
@@ -838,7 +1039,9 @@ class PVOutput:
         api_params: Dict,
         wait_if_rate_limit_exceeded: bool = False,
         use_data_service: bool = False,
-    ) -> str:
+        stream: bool = False,
+        on_headers: Optional[Callable[[Dict], None]] = None,
+    ) -> Union[str, Iterator[str]]:
         """Send API request to PVOutput.org and return content text.
 
         Args:
@@ -846,23 +1049,47 @@ class PVOutput:
             api_params: dict
             wait_if_rate_limit_exceeded: bool
             use_data_service: bool
+            stream: If True, then return an iterator of decoded chunks of the
+                content, instead of the whole content.  The chunks are not
+                stripped of whitespace.
+            on_headers: Optional function which is called with the headers of
+                every response (e.g. to read its X-Rate-Limit-* headers).
 
         Raises:
             NoStatusFound
             RateLimitExceeded
         """
+        if self.response_cache is not None:
+            content = self.response_cache.get(service, api_params, use_data_service)
+            if content is not None:
+                return iter([content]) if stream else content
+
         get_response_func = (
             self._get_data_service_response if use_data_service else self._get_api_response
         )
+        bucket_name = DATA_SERVICE if use_data_service else API
+        while True:
+            secs_to_wait = self._reserve_request(bucket_name)
+            if secs_to_wait <= 0:
+                break
+            _LOG.debug("Waiting %.1f seconds for %s quota.", secs_to_wait, bucket_name)
+            time.sleep(secs_to_wait)
 
         try:
-            response = get_response_func(service, api_params)
+            if stream:
+                response = get_response_func(service, api_params, stream=True)
+            else:
+                response = get_response_func(service, api_params)
         except Exception as e:
             _LOG.exception(e)
             raise
 
+        self._update_quotas(bucket_name, response.headers)
+        if on_headers is not None:
+            on_headers(response.headers)
+
         try:
-            return self._process_api_response(response)
+            content = self._process_api_response(response, stream=stream)
         except RateLimitExceeded:
             msg = "PVOutput.org API rate limit exceeded!" "  Rate limit will be reset at {}".format(
                 self.rate_limit_reset_time
@@ -870,15 +1097,57 @@ class PVOutput:
             _print_and_log(msg)
             if wait_if_rate_limit_exceeded:
                 self.wait_for_rate_limit_reset()
-                return self._api_query(service, api_params, wait_if_rate_limit_exceeded=False)
+                return self._api_query(
+                    service,
+                    api_params,
+                    wait_if_rate_limit_exceeded=False,
+                    use_data_service=use_data_service,
+                    stream=stream,
+                    on_headers=on_headers,
+                )
 
             raise RateLimitExceeded(response, msg)
 
-    def _get_api_response(self, service: str, api_params: Dict) -> requests.Response:
+        if self.response_cache is not None:
+            if stream:
+                content = self.response_cache.tee(service, api_params, content, use_data_service)
+            else:
+                self.response_cache.put(service, api_params, content, use_data_service)
+        return content
+
+    def _reserve_request(self, bucket_name: str) -> float:
+        """Reserve one request from the rate limiter and the quota ledger, if set.
+
+        Returns:
+            0 if a request can be sent now.  Otherwise, the number of seconds
+            to wait before trying again.
+        """
+        if self.rate_limiter is not None:
+            secs_to_wait = self.rate_limiter.reserve(bucket_name)
+            if secs_to_wait > 0:
+                return secs_to_wait
+        if self.quota_ledger is not None:
+            secs_to_wait = self.quota_ledger.reserve(self.api_key, bucket_name)
+            if secs_to_wait > 0 and self.rate_limiter is not None:
+                # The request won't be sent (yet), so don't waste its token.
+                self.rate_limiter.refund(bucket_name)
+            return secs_to_wait
+        return 0
+
+    def _update_quotas(self, bucket_name: str, headers: Dict):
+        if self.rate_limiter is not None:
+            self.rate_limiter.update_from_headers(bucket_name, headers)
+        if self.quota_ledger is not None:
+            self.quota_ledger.update_from_headers(self.api_key, bucket_name, headers)
+
+    def _get_api_response(
+        self, service: str, api_params: Dict, stream: bool = False
+    ) -> requests.Response:
         """
         Args:
             service: string, e.g. 'search', 'getstatus'
             api_params: dict
+            stream: If True, then don't read the response content yet.
         """
         self._check_api_params()
         # Create request headers
@@ -890,13 +1159,23 @@ class PVOutput:
 
         api_url = urljoin(BASE_URL, "service/r2/{}.jsp".format(service))
 
-        return _get_response(api_url, api_params, headers)
+        return _get_response(
+            api_url,
+            api_params,
+            headers,
+            session=self.session,
+            stream=stream,
+            transport=self.transport,
+        )
 
-    def _get_data_service_response(self, service: str, api_params: Dict) -> requests.Response:
+    def _get_data_service_response(
+        self, service: str, api_params: Dict, stream: bool = False
+    ) -> requests.Response:
         """
         Args:
             service: string, e.g. 'getbatchstatus'
             api_params: dict
+            stream: If True, then don't read the response content yet.
         """
         self._check_api_params()
         if self.data_service_url is None:
@@ -909,7 +1188,14 @@ class PVOutput:
 
         api_url = urljoin(self.data_service_url, "service/r2/{}.jsp".format(service))
 
-        return _get_response(api_url, api_params, headers)
+        return _get_response(
+            api_url,
+            api_params,
+            headers,
+            session=self.session,
+            stream=stream,
+            transport=self.transport,
+        )
 
     def _check_api_params(self):
         # Check we have relevant login details:
@@ -918,26 +1204,49 @@ class PVOutput:
                 raise ValueError("Please set the {} parameter.".format(param_name))
 
     def _set_rate_limit_params(self, headers):
-        for param_name, header_key in RATE_LIMIT_PARAMS_TO_API_HEADERS.items():
-            header_value = int(headers[header_key])
-            setattr(self, param_name, header_value)
-
-        self.rate_limit_reset_time = pd.Timestamp.utcfromtimestamp(self.rate_limit_reset_time)
-        self.rate_limit_reset_time = self.rate_limit_reset_time.tz_localize("utc")
+        params = {
+            param_name: int(headers[header_key])
+            for param_name, header_key in RATE_LIMIT_PARAMS_TO_API_HEADERS.items()
+        }
+        params["rate_limit_reset_time"] = pd.Timestamp.utcfromtimestamp(
+            params["rate_limit_reset_time"]
+        ).tz_localize("utc")
+
+        with self._rate_limit_lock:
+            # Responses handled by several threads may arrive out of order:
+            # within one rate limit period (of the same quota), the lowest
+            # remaining count is the latest.
+            if (
+                params["rate_limit_reset_time"] == self.rate_limit_reset_time
+                and params["rate_limit_total"] == self.rate_limit_total
+                and self.rate_limit_remaining is not None
+            ):
+                params["rate_limit_remaining"] = min(
+                    params["rate_limit_remaining"], self.rate_limit_remaining
+                )
+            for param_name, value in params.items():
+                setattr(self, param_name, value)
 
         _LOG.debug("%s", self.rate_limit_info())
 
+    def connection_pool_stats(self) -> pd.DataFrame:
+        """Requests served per HTTP connection.  See `utils.get_connection_pool_stats`."""
+        return get_connection_pool_stats(self.session)
+
     def rate_limit_info(self) -> Dict:
         info = {}
         for param_name in RATE_LIMIT_PARAMS_TO_API_HEADERS:
             info[param_name] = getattr(self, param_name)
         return info
 
-    def _process_api_response(self, response: requests.Response) -> str:
+    def _process_api_response(
+        self, response: requests.Response, stream: bool = False
+    ) -> Union[str, Iterator[str]]:
         """Turns an API response into text.
 
         Args:
             response: from _get_api_response()
+            stream: If True, then return an iterator of decoded chunks.
 
         Returns:
             content of the response.
@@ -966,6 +1275,9 @@ class PVOutput:
         if response.status_code == 403 and self.rate_limit_remaining <= 0:
             raise RateLimitExceeded(response=response)
 
+        if stream:
+            return _iter_decoded_chunks(response)
+
         try:
             content = response.content.decode("latin1").strip()
         except Exception as e:
@@ -1046,45 +1358,475 @@ def check_pv_system_status(pv_system_status: pd.DataFrame, requested_date: date)
                 )
 
 
+def _get_search_api_params(
+    query: str, lat: Optional[float], lon: Optional[float], include_country: bool
+) -> Dict:
+    api_params = {"q": query, "country": int(include_country)}
+
+    if lat is not None and lon is not None:
+        api_params["ll"] = "{:f},{:f}".format(lat, lon)
+    return api_params
+
+
+def _process_search_results(pv_systems_text: str) -> pd.DataFrame:
+    return pd.read_csv(
+        StringIO(pv_systems_text),
+        names=[
+            "name",
+            "system_DC_capacity_W",
+            "address",
+            "orientation",
+            "num_outputs",
+            "last_output",
+            "system_id",
+            "panel",
+            "inverter",
+            "distance_km",
+            "latitude",
+            "longitude",
+        ],
+        index_col="system_id",
+    )
+
+
+def _get_status_api_params(pv_system_id: int, date: Union[str, datetime], historic: bool) -> Dict:
+    date = date_to_pvoutput_str(date)
+    _check_date(date)
+
+    return {
+        "d": date,  # date, YYYYMMDD, localtime of the PV system
+        "h": int(historic == True),  # We want historical data.
+        "limit": 288,  # API limit is 288 (num of 5-min periods per day).
+        "ext": 0,  # Extended data; we don't want extended data.
+        "sid1": pv_system_id,  # SystemID.
+    }
+
+
+def _process_status(pv_system_status_text: str, historic: bool = True) -> pd.DataFrame:
+    # See https://pvoutput.org/help.html#api-getstatus but make sure
+    # you read the 'History Query' subsection, as a historical query
+    # has slightly different return columns compared to a non-historical
+    # query!
+    columns = (
+        [
+            "cumulative_energy_gen_Wh",
+            "energy_efficiency_kWh_per_kW",
+            "instantaneous_power_gen_W",
+            "average_power_gen_W",
+            "power_gen_normalised",
+            "energy_consumption_Wh",
+            "power_demand_W",
+            "temperature_C",
+            "voltage",
+        ]
+        if historic
+        else [
+            "cumulative_energy_gen_Wh",
+            "instantaneous_power_gen_W",
+            "energy_consumption_Wh",
+            "power_demand_W",
+            "power_gen_normalised",
+            "temperature_C",
+            "voltage",
+        ]
+    )
+
+    # Each record is 'yyyymmdd,HH:MM,<values>'.  Replacing ':' with ','
+    # splits the time into hours and minutes, so the C CSV parser can read
+    # every field as a number, and we never parse date strings.
+    records = pd.read_csv(
+        StringIO(pv_system_status_text.replace(":", ",")),
+        lineterminator=";",
+        names=["date", "hour", "minute"] + columns,
+        dtype=np.float64,
+    ).to_numpy()
+    records = records[~np.isnan(records[:, :3]).any(axis=1)]
+    dates = _yyyymmdd_to_datetime64(records[:, 0].astype(np.int64))
+    return _records_to_timeseries(dates, records[:, 1], records[:, 2], records[:, 3:], columns)
+
+
+def _get_batch_status_api_params(
+    pv_system_id: int, date_to: Optional[Union[str, datetime]] = None
+) -> Dict:
+    api_params = {"sid1": pv_system_id}
+    _set_date_param(date_to, api_params, "dt")
+    return api_params
+
+
+def _get_insolation_api_params(
+    date: Union[str, datetime],
+    pv_system_id: Optional[int] = None,
+    timezone: Optional[str] = None,
+    lat: Optional[float] = None,
+    lon: Optional[float] = None,
+) -> Dict:
+    date = date_to_pvoutput_str(date)
+    _check_date(date, prediction=True)
+    api_params = {
+        "d": date,  # date, YYYYMMDD, localtime of the PV system
+        "sid1": pv_system_id,  # SystemID.
+        "tz": timezone,  # defaults to configured timezone of system otherwise GMT
+    }
+    if lat is not None and lon is not None:
+        api_params["ll"] = "{:f},{:f}".format(lat, lon)
+    return api_params
+
+
+def _process_insolation(pv_insolation_text: str, date: str) -> pd.DataFrame:
+    columns = ["predicted_power_gen_W", "predicted_cumulative_energy_gen_Wh"]
+    pv_insolation = pd.read_csv(
+        StringIO(pv_insolation_text),
+        lineterminator=";",
+        names=["time"] + columns,
+        dtype={col: np.float64 for col in columns},
+    ).sort_index()
+    pv_insolation.index = pd.to_datetime(date + " " + pv_insolation.time, format="%Y-%m-%d %H:%M")
+    pv_insolation.drop("time", axis=1, inplace=True)
+    return pv_insolation
+
+
+def _get_metadata_api_params(pv_system_id: int) -> Dict:
+    return {
+        "array2": 1,  # Provide data about secondary array, if present.
+        "tariffs": 0,
+        "teams": 0,
+        "est": 0,
+        "donations": 0,
+        "sid1": pv_system_id,  # SystemID
+        "ext": 0,  # Include extended data?
+    }
+
+
+def _process_system_metadata(pv_metadata_text: str, pv_system_id: int) -> pd.Series:
+    pv_metadata = pd.read_csv(
+        StringIO(pv_metadata_text),
+        lineterminator=";",
+        names=[
+            "name",
+            "system_DC_capacity_W",
+            "address",
+            "num_panels",
+            "panel_capacity_W_each",
+            "panel_brand",
+            "num_inverters",
+            "inverter_capacity_W",
+            "inverter_brand",
+            "orientation",
+            "array_tilt_degrees",
+            "shade",
+            "install_date",
+            "latitude",
+            "longitude",
+            "status_interval_minutes",
+            "secondary_num_panels",
+            "secondary_panel_capacity_W_each",
+            "secondary_orientation",
+            "secondary_array_tilt_degrees",
+        ],
+        parse_dates=["install_date"],
+        nrows=1,
+    ).squeeze()
+    pv_metadata["system_id"] = pv_system_id
+    pv_metadata.name = pv_system_id
+    return pv_metadata
+
+
+def _fill_statistic_dates(date_from, date_to):
+    if date_from and not date_to:
+        date_to = pd.Timestamp.now().date()
+    if date_to and not date_from:
+        date_from = pd.Timestamp("1900-01-01").date()
+    return date_from, date_to
+
+
+def _get_statistic_api_params(pv_system_id: int, date_from, date_to) -> Dict:
+    api_params = {
+        "c": 0,  # consumption and import
+        "crdr": 0,  # credits / debits
+        "sid1": pv_system_id,  # SystemID
+    }
+
+    _set_date_param(date_from, api_params, "df")
+    _set_date_param(date_to, api_params, "dt")
+    return api_params
+
+
+def _process_statistic(
+    pv_metadata_text: str, pv_system_id: int, date_from, date_to
+) -> pd.DataFrame:
+    columns = [
+        "total_energy_gen_Wh",
+        "energy_exported_Wh",
+        "average_daily_energy_gen_Wh",
+        "minimum_daily_energy_gen_Wh",
+        "maximum_daily_energy_gen_Wh",
+        "average_efficiency_kWh_per_kW",
+        "num_outputs",
+        "actual_date_from",
+        "actual_date_to",
+        "record_efficiency_kWh_per_kW",
+        "record_efficiency_date",
+    ]
+    date_cols = ["actual_date_from", "actual_date_to", "record_efficiency_date"]
+    numeric_cols = set(columns) - set(date_cols)
+    pv_metadata = pd.read_csv(
+        StringIO(pv_metadata_text),
+        names=columns,
+        dtype={col: np.float32 for col in numeric_cols},
+        parse_dates=date_cols,
+    )
+    if pv_metadata.empty:
+        data = {col: np.float32(np.NaN) for col in numeric_cols}
+        data.update({col: pd.NaT for col in date_cols})
+        pv_metadata = pd.DataFrame(data, index=[pv_system_id])
+    else:
+        pv_metadata.index = [pv_system_id]
+
+    pv_metadata["query_date_from"] = pd.Timestamp(date_from) if date_from else pd.NaT
+    pv_metadata["query_date_to"] = pd.Timestamp(date_to) if date_to else pd.Timestamp.now()
+    return pv_metadata
+
+
+def _filter_date_ranges_using_statistic(
+    system_id: int,
+    date_ranges: Iterable[DateRange],
+    stats: pd.DataFrame,
+    min_data_availability: Optional[float] = 0.5,
+) -> List[DateRange]:
+    """Intersect date_ranges with the date range for which stats say there's data.
+
+    Returns:
+        An empty list if there's no data, or if data availability is
+        below min_data_availability.
+    """
+    stats = stats.squeeze()
+    if pd.isnull(stats["actual_date_from"]) or pd.isnull(stats["actual_date_to"]):
+        _LOG.info("system_id %d: Stats say there is no data!", system_id)
+        return []
+
+    timeseries_date_range = DateRange(stats["actual_date_from"], stats["actual_date_to"])
+
+    data_availability = stats["num_outputs"] / (timeseries_date_range.total_days() + 1)
+
+    if data_availability < min_data_availability:
+        _LOG.info(
+            "system_id %d: Data availability too low!  Only %.0f %%.",
+            system_id,
+            data_availability * 100,
+        )
+        return []
+
+    new_date_ranges = []
+    for date_range in date_ranges:
+        new_date_range = date_range.intersection(timeseries_date_range)
+        if new_date_range:
+            new_date_ranges.append(new_date_range)
+    return new_date_ranges
+
+
+def _triage_statistics(
+    date_ranges: pd.Series,
+    stats: pd.DataFrame,
+    min_data_availability: Optional[float] = 0.5,
+    use_get_status: bool = False,
+) -> pd.DataFrame:
+    """Decide which PV systems to download, using their stats.
+
+    Args:
+        date_ranges: Maps PV system ID to the list of DateRanges which
+            haven't been downloaded yet.
+        stats: Stats for (at least) every PV system with dates to download.
+        min_data_availability: See `download_multiple_systems_to_disk`.
+        use_get_status: If True, count getstatus requests (one per day).
+            Else count getbatchstatus requests (one per year).
+
+    Returns:
+        pd.DataFrame indexed by pv_system_id, with columns:
+            num_days_wanted: Days not yet in the store.
+            stats_from_cache: False if the stats were fetched from the API.
+            num_outputs, actual_date_from, actual_date_to: From the stats.
+            data_availability: num_outputs / days from actual_date_from to
+                actual_date_to.
+            status: 'done' (nothing left to download), 'no_data',
+                'low_availability', 'no_data_in_date_range' or 'download'.
+            date_ranges: The DateRanges to download.
+            num_days_to_download
+            num_api_calls: The expected number of download requests.
+    """
+    plan = pd.DataFrame(index=date_ranges.index)
+    stats = stats.reindex(plan.index)
+    plan["num_days_wanted"] = np.array(
+        [DateIntervalSet.from_date_ranges(ranges).num_days() for ranges in date_ranges],
+        dtype=np.int64,
+    )
+    plan["stats_from_cache"] = stats["stats_from_cache"]
+    plan["num_outputs"] = stats["num_outputs"].astype(np.float64)
+    plan["actual_date_from"] = pd.to_datetime(stats["actual_date_from"])
+    plan["actual_date_to"] = pd.to_datetime(stats["actual_date_to"])
+    days_with_data = (plan["actual_date_to"] - plan["actual_date_from"]).dt.days + 1
+    plan["data_availability"] = plan["num_outputs"] / days_with_data
+
+    is_done = plan["num_days_wanted"] == 0
+    has_no_data = plan["actual_date_from"].isnull() | plan["actual_date_to"].isnull()
+    is_low_availability = plan["data_availability"] < (min_data_availability or 0)
+    status = np.select(
+        [is_done, has_no_data, is_low_availability],
+        ["done", "no_data", "low_availability"],
+        default="download",
+    )
+
+    # Intersect the dates to download with the dates which have data.
+    usable_date_ranges = {
+        pv_system_id: _filter_date_ranges_using_statistic(
+            pv_system_id, date_ranges[pv_system_id], stats.loc[[pv_system_id]], 0
+        )
+        for pv_system_id in plan.index[status == "download"]
+    }
+    plan["date_ranges"] = pd.Series(
+        [usable_date_ranges.get(i, []) for i in plan.index], index=plan.index, dtype=object
+    )
+    num_date_ranges = plan["date_ranges"].map(len).values
+    plan["status"] = np.where(
+        (status == "download") & (num_date_ranges == 0), "no_data_in_date_range", status
+    )
+
+    plan["num_days_to_download"] = np.array(
+        [DateIntervalSet.from_date_ranges(ranges).num_days() for ranges in plan["date_ranges"]],
+        dtype=np.int64,
+    )
+    if use_get_status:
+        plan["num_api_calls"] = plan["num_days_to_download"]
+    else:
+        plan["num_api_calls"] = np.array(
+            [len(merge_date_ranges_to_minimum_years(ranges)) for ranges in plan["date_ranges"]],
+            dtype=np.int64,
+        )
+    return plan
+
+
+def _summarise_plan(plan: pd.DataFrame) -> str:
+    counts = plan["status"].value_counts()
+    return (
+        "Plan for {:d} PV systems: {:d} to download using {:d} API requests"
+        " ({:d} days).  {:d} already downloaded, {:d} with no data, {:d} with"
+        " low data availability, {:d} with no data in the date range."
+        "  {:d} statistics fetched from the API.".format(
+            len(plan),
+            counts.get("download", 0),
+            plan["num_api_calls"].sum(),
+            plan["num_days_to_download"].sum(),
+            counts.get("done", 0),
+            counts.get("no_data", 0),
+            counts.get("low_availability", 0),
+            counts.get("no_data_in_date_range", 0),
+            plan["stats_from_cache"].eq(False).sum(),
+        )
+    )
+
+
 def _process_batch_status(pv_system_status_text):
     # See https://pvoutput.org/help.html#dataservice-getbatchstatus
 
-    # PVOutput uses a non-standard format for the data.  The text
-    # needs some processing before it can be read as a CSV.
-    processed_lines = []
-    for line in pv_system_status_text.split("\n"):
-        line_sections = line.split(";")
-        date = line_sections[0]
-        time_and_data = line_sections[1:]
-        processed_line = [
-            "{date},{payload}".format(date=date, payload=payload) for payload in time_and_data
-        ]
-        processed_lines.extend(processed_line)
+    # PVOutput uses a non-standard format for the data: one line per day,
+    # 'yyyymmdd;HH:MM,<values>;HH:MM,<values>;...'.  We join all the
+    # records into one string (replacing ':' with ',' to split each time
+    # into hours and minutes), so the C CSV parser can read every field
+    # as a number, and we repeat each line's date for each of its records.
+    lines = [line for line in pv_system_status_text.splitlines() if line]
+    columns = ["cumulative_energy_gen_Wh", "instantaneous_power_gen_W", "temperature_C", "voltage"]
 
-    if processed_lines:
-        first_line = processed_lines[0]
-        num_cols = len(first_line.split(","))
+    if lines:
+        first_record = lines[0].split(";", 2)[1] if ";" in lines[0] else ""
+        num_cols = len(first_record.split(",")) + 1
         if num_cols >= 8:
             raise NotImplementedError("Handling of consumption data is not implemented!")
 
-    processed_text = "\n".join(processed_lines)
-    del processed_lines
+    line_dates = np.array([line[:8] for line in lines], dtype=np.int64)
+    records_per_line = np.array([line.count(";") for line in lines], dtype=np.int64)
+    records_text = ";".join(line[9:] for line in lines if len(line) > 9)
+    records = pd.read_csv(
+        StringIO(records_text.replace(":", ",")),
+        lineterminator=";",
+        names=["hour", "minute"] + columns,
+        dtype=np.float64,
+    ).to_numpy()
+    if len(records) != records_per_line.sum():
+        # Empty records (e.g. ';;').  The CSV parser skips them, so count
+        # the non-empty records the slow way.
+        records_per_line = np.array(
+            [sum(1 for record in line.split(";")[1:] if record) for line in lines],
+            dtype=np.int64,
+        )
 
-    columns = ["cumulative_energy_gen_Wh", "instantaneous_power_gen_W", "temperature_C", "voltage"]
+    dates = _yyyymmdd_to_datetime64(np.repeat(line_dates, records_per_line))
+    return _records_to_timeseries(dates, records[:, 0], records[:, 1], records[:, 2:], columns)
 
-    pv_system_status = pd.read_csv(
-        StringIO(processed_text),
-        names=["date", "time"] + columns,
-        parse_dates={"datetime": ["date", "time"]},
-        index_col=["datetime"],
-        dtype={col: np.float64 for col in columns},
-    ).sort_index()
 
-    return pv_system_status
+def _process_batch_status_chunks(chunks: Iterable[str]) -> pd.DataFrame:
+    """Parse a getbatchstatus response, one chunk at a time.
+
+    Each chunk's complete lines are parsed as soon as the chunk arrives, so
+    only the parsed data and (at most) one chunk and one line of text are
+    in memory at once.
+    """
+    timeseries = []
+    partial_line = ""
+    for chunk in chunks:
+        text = partial_line + chunk
+        end_of_last_line = text.rfind("\n")
+        if end_of_last_line == -1:
+            partial_line = text
+            continue
+        timeseries.append(_process_batch_status(text[:end_of_last_line]))
+        partial_line = text[end_of_last_line + 1 :]
+    timeseries.append(_process_batch_status(partial_line))
+    timeseries = [df for df in timeseries if not df.empty] or timeseries[-1:]
+    if len(timeseries) == 1:
+        return timeseries[0]
+    return pd.concat(timeseries).sort_index(kind="stable")
+
+
+def _iter_decoded_chunks(
+    response: requests.Response, chunk_size: int = STREAM_CHUNK_SIZE
+) -> Iterator[str]:
+    """Read a streamed response in chunks.  Closes the response when done.
+
+    latin1 maps every byte to one character, so each chunk can be decoded
+    on its own.
+    """
+    try:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            yield chunk.decode("latin1")
+    finally:
+        response.close()
+
+
+def _yyyymmdd_to_datetime64(yyyymmdd: np.ndarray) -> np.ndarray:
+    """Convert integers like 20190131 to datetime64[D], using integer arithmetic."""
+    year = yyyymmdd // 10000
+    month = (yyyymmdd // 100) % 100
+    day = yyyymmdd % 100
+    months_since_epoch = ((year - 1970) * 12 + month - 1).astype("datetime64[M]")
+    return months_since_epoch.astype("datetime64[D]") + (day - 1).astype("timedelta64[D]")
+
+
+def _records_to_timeseries(
+    dates: np.ndarray,
+    hours: np.ndarray,
+    minutes: np.ndarray,
+    values: np.ndarray,
+    columns: List[str],
+) -> pd.DataFrame:
+    """Combine dates, hours and minutes into a sorted DatetimeIndex for values."""
+    minutes_since_midnight = (hours * 60 + minutes).astype(np.int64).astype("timedelta64[m]")
+    datetimes = (dates + minutes_since_midnight).astype("datetime64[ns]")
+    order = np.argsort(datetimes, kind="stable")
+    index = pd.DatetimeIndex(datetimes[order], name="datetime")
+    return pd.DataFrame(values[order], index=index, columns=columns)
 
 
 def _append_missing_date_range(
-    output_filename, pv_system_id, missing_start_date, missing_end_date, datetime_of_api_request
+    writer, pv_system_id, missing_start_date, missing_end_date, datetime_of_api_request
 ):
 
     data = {
@@ -1100,11 +1842,10 @@ def _append_missing_date_range(
         missing_start_date,
         missing_end_date,
     )
-    with pd.HDFStore(output_filename, mode="a", complevel=9) as store:
-        store.append(key="missing_dates", value=new_missing_date_range, data_columns=True)
+    writer.append_missing_dates(new_missing_date_range)
 
 
-def _record_gaps(output_filename, pv_system_id, date_to, timeseries, datetime_of_api_request):
+def _record_gaps(writer, pv_system_id, date_to, timeseries, datetime_of_api_request):
     dates_of_data = (
         timeseries["instantaneous_power_gen_W"].dropna().resample("D").mean().dropna().index.date
     )
@@ -1125,8 +1866,7 @@ def _record_gaps(output_filename, pv_system_id, date_to, timeseries, datetime_of
     missing_date_ranges["pv_system_id"] = pv_system_id
     missing_date_ranges["datetime_of_API_request"] = datetime_of_api_request
     missing_date_ranges.set_index("pv_system_id", inplace=True)
-    with pd.HDFStore(output_filename, mode="a", complevel=9) as store:
-        store.append(key="missing_dates", value=missing_date_ranges, data_columns=True)
+    writer.append_missing_dates(missing_date_ranges)
 
 
 def _convert_consecutive_dates_to_date_ranges(missing_dates):
@@ -0,0 +1,157 @@
+import hashlib
+import sqlite3
+import time
+from contextlib import closing
+from typing import Callable, Dict
+
+import pandas as pd
+
+from pvoutput.consts import QUOTA_LEDGER_FILENAME
+from pvoutput.ratelimit import RATE_LIMIT_PERIOD_SECS, rate_limit_from_headers
+
+_CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS quota (
+    api_key_hash TEXT NOT NULL,
+    bucket_name TEXT NOT NULL,
+    remaining INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    reset_time REAL NOT NULL,
+    PRIMARY KEY (api_key_hash, bucket_name)
+)
+"""
+
+
+class QuotaLedger:
+    """Shares the API quota of each API key between processes.
+
+    The ledger is a SQLite file.  Before each request, every process
+    reserves one request from the ledger; after each response, the ledger is
+    updated from the response's X-Rate-Limit-* headers.  SQLite's locking
+    makes each reservation atomic, so N processes using the same API key
+    (on the same machine) never send more requests than the quota allows.
+
+    API keys are stored as SHA-256 hashes.
+    """
+
+    def __init__(
+        self,
+        filename: str = QUOTA_LEDGER_FILENAME,
+        headroom: int = 0,
+        timeout: float = 60,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            filename: The SQLite file.  Created if it doesn't exist.
+            headroom: The number of requests to hold in reserve in each quota.
+            timeout: Seconds to wait for another process to release the lock.
+            clock: Function which returns seconds since the epoch.  Only
+                replaced for testing.
+        """
+        self.filename = filename
+        self.headroom = headroom
+        self.timeout = timeout
+        self.clock = clock
+        with closing(self._connect()) as connection:
+            with connection:
+                connection.execute(_CREATE_TABLE_SQL)
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None so we can issue BEGIN IMMEDIATE, which takes
+        # the write lock before we read the current quota.
+        return sqlite3.connect(self.filename, timeout=self.timeout, isolation_level=None)
+
+    def reserve(self, api_key: str, bucket_name: str) -> float:
+        """Try to reserve one request.
+
+        Returns:
+            0 if a request was reserved (or if the quota is unknown), and hence
+            a request can be sent now.  Otherwise, the number of seconds to
+            wait before trying again.
+        """
+        api_key_hash = _hash_api_key(api_key)
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    "SELECT remaining, total, reset_time FROM quota"
+                    " WHERE api_key_hash = ? AND bucket_name = ?",
+                    (api_key_hash, bucket_name),
+                ).fetchone()
+                if row is None:
+                    secs_to_wait = 0
+                else:
+                    remaining, total, reset_time = row
+                    now = self.clock()
+                    if now >= reset_time:
+                        # The quota has been reset.  Assume we've got the full
+                        # quota until a response tells us otherwise.
+                        remaining = total
+                        reset_time = now + RATE_LIMIT_PERIOD_SECS
+                    if remaining - self.headroom <= 0:
+                        secs_to_wait = reset_time - now + 1
+                    else:
+                        secs_to_wait = 0
+                        remaining -= 1
+                    connection.execute(
+                        "UPDATE quota SET remaining = ?, reset_time = ?"
+                        " WHERE api_key_hash = ? AND bucket_name = ?",
+                        (remaining, reset_time, api_key_hash, bucket_name),
+                    )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        return secs_to_wait
+
+    def update(self, api_key: str, bucket_name: str, remaining: int, total: int, reset_time: float):
+        """Record the rate limit reported by PVOutput.org.
+
+        Responses can arrive after other processes have reserved requests
+        which PVOutput.org hasn't seen yet, so within one rate limit period
+        the ledger keeps the lower of its own count and `remaining`.
+        """
+        api_key_hash = _hash_api_key(api_key)
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    "SELECT remaining, reset_time FROM quota"
+                    " WHERE api_key_hash = ? AND bucket_name = ?",
+                    (api_key_hash, bucket_name),
+                ).fetchone()
+                if reset_time <= self.clock():
+                    # A late response from an earlier rate limit period.
+                    connection.execute("COMMIT")
+                    return
+                if row is not None:
+                    ledger_remaining, ledger_reset_time = row
+                    if reset_time == ledger_reset_time:
+                        remaining = min(remaining, ledger_remaining)
+                connection.execute(
+                    "INSERT OR REPLACE INTO quota"
+                    " (api_key_hash, bucket_name, remaining, total, reset_time)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (api_key_hash, bucket_name, remaining, total, reset_time),
+                )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+
+    def update_from_headers(self, api_key: str, bucket_name: str, headers: Dict):
+        """Record the X-Rate-Limit-* headers of a response, if present."""
+        rate_limit = rate_limit_from_headers(headers)
+        if rate_limit is not None:
+            self.update(api_key, bucket_name, **rate_limit)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """The ledger, one row per (API key hash, bucket)."""
+        with closing(self._connect()) as connection:
+            quota = pd.read_sql_query("SELECT * FROM quota", connection)
+        quota["reset_time"] = pd.to_datetime(quota["reset_time"], unit="s", utc=True)
+        return quota.set_index(["api_key_hash", "bucket_name"])
+
+
+def _hash_api_key(api_key: str) -> str:
+    return hashlib.sha256(str(api_key).encode("utf-8")).hexdigest()
@@ -0,0 +1,226 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+import pandas as pd
+
+from pvoutput.consts import RATE_LIMIT_PARAMS_TO_API_HEADERS
+
+_LOG = logging.getLogger("pvoutput")
+
+# PVOutput.org resets its quotas every hour.
+RATE_LIMIT_PERIOD_SECS = 60 * 60
+
+API = "api"
+DATA_SERVICE = "data_service"
+
+
+def rate_limit_from_headers(headers: Dict) -> Optional[Dict]:
+    """Read the X-Rate-Limit-* headers of a response.
+
+    Returns:
+        None if the headers are missing.  Otherwise a dict with keys
+        remaining, total and reset_time (seconds since the epoch).
+    """
+    try:
+        values = {
+            param_name: int(headers[header_key])
+            for param_name, header_key in RATE_LIMIT_PARAMS_TO_API_HEADERS.items()
+        }
+    except (KeyError, ValueError):
+        return None
+    return {
+        "remaining": values["rate_limit_remaining"],
+        "total": values["rate_limit_total"],
+        "reset_time": values["rate_limit_reset_time"],
+    }
+
+
+@dataclass
+class TokenBucket:
+    """The state of one quota.  Times are seconds since the epoch."""
+
+    remaining: Optional[int] = None
+    total: Optional[int] = None
+    reset_time: Optional[float] = None
+    tokens: float = 0
+    last_refill_time: Optional[float] = None
+
+
+class RateLimiter:
+    """Paces API requests so that the quota lasts until it is reset.
+
+    PVOutput.org tells us our quota in the X-Rate-Limit-* headers of every
+    response.  RateLimiter uses those headers to maintain a token bucket per
+    quota: the bucket holds at most `burst` tokens and refills at the rate
+    which spreads the remaining quota (minus `headroom`) evenly until the reset
+    time.  Each request takes one token.  When the quota is used up,
+    requests wait until the reset time, so requests are never rejected by
+    PVOutput.org for exceeding the rate limit.
+
+    The regular API and the data service have separate quotas, and hence
+    separate buckets: `API` and `DATA_SERVICE`.
+
+    RateLimiter is thread-safe.
+    """
+
+    def __init__(
+        self,
+        headroom: int = 2,
+        burst: int = 10,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """
+        Args:
+            headroom: The number of requests to hold in reserve in each quota,
+                e.g. for other programs using the same API key.
+            burst: The maximum number of requests which can be sent without
+                pausing.
+            clock, sleep: Functions to get the time and to wait.  Only
+                replaced for testing.
+        """
+        self.headroom = headroom
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _get_bucket(self, bucket_name: str) -> TokenBucket:
+        if bucket_name not in self._buckets:
+            self._buckets[bucket_name] = TokenBucket(tokens=self.burst)
+        return self._buckets[bucket_name]
+
+    def update(self, bucket_name: str, remaining: int, total: int, reset_time: float):
+        """Update a bucket from the rate limit reported by PVOutput.org.
+
+        Responses to concurrent requests can arrive out of order, so, within
+        one quota period (i.e. while the reset time is unchanged), the
+        bucket keeps the lower of its own count and the reported count.
+
+        Args:
+            bucket_name: API or DATA_SERVICE.
+            remaining: The number of requests left before the reset time.
+            total: The total number of requests allowed per hour.
+            reset_time: Seconds since the epoch.
+        """
+        with self._lock:
+            bucket = self._get_bucket(bucket_name)
+            if bucket.remaining is not None and reset_time == bucket.reset_time:
+                remaining = min(remaining, bucket.remaining)
+            bucket.remaining = remaining
+            bucket.total = total
+            bucket.reset_time = reset_time
+
+    def update_from_headers(self, bucket_name: str, headers: Dict):
+        """Update a bucket from the X-Rate-Limit-* headers of a response, if present."""
+        rate_limit = rate_limit_from_headers(headers)
+        if rate_limit is not None:
+            self.update(bucket_name, **rate_limit)
+
+    def reserve(self, bucket_name: str) -> float:
+        """Try to take a token from the bucket.
+
+        The quota is unknown until the first response with rate limit
+        headers arrives, so until then requests are never paced: each
+        thread may send one request before the first response sets the
+        quota.
+
+        Returns:
+            0 if a token was taken, and hence a request can be sent now.
+            Otherwise, the number of seconds to wait before trying again.
+        """
+        with self._lock:
+            bucket = self._get_bucket(bucket_name)
+            now = self.clock()
+
+            if bucket.remaining is None:
+                # We don't know the quota until we get the first response.
+                return 0
+
+            if now >= bucket.reset_time:
+                # PVOutput.org has reset the quota.  Assume we've got the full
+                # quota until the next response tells us otherwise.
+                bucket.remaining = bucket.total
+                bucket.reset_time = now + RATE_LIMIT_PERIOD_SECS
+                bucket.tokens = self.burst
+                bucket.last_refill_time = now
+
+            usable = bucket.remaining - self.headroom
+            if usable <= 0:
+                return bucket.reset_time - now + 1
+
+            # Refill the bucket.
+            refill_rate = usable / max(bucket.reset_time - now, 1)
+            if bucket.last_refill_time is not None:
+                bucket.tokens += refill_rate * (now - bucket.last_refill_time)
+            bucket.tokens = min(bucket.tokens, self.burst, usable)
+            bucket.last_refill_time = now
+
+            if bucket.tokens < 1:
+                return (1 - bucket.tokens) / refill_rate
+
+            bucket.tokens -= 1
+            bucket.remaining -= 1
+            return 0
+
+    def refund(self, bucket_name: str):
+        """Give back the token taken by `reserve`, if the request wasn't sent."""
+        with self._lock:
+            bucket = self._get_bucket(bucket_name)
+            if bucket.remaining is None:
+                # `reserve` didn't take a token.
+                return
+            bucket.tokens = min(bucket.tokens + 1, self.burst)
+            bucket.remaining += 1
+
+    def acquire(self, bucket_name: str) -> float:
+        """Wait until a request can be sent.
+
+        Returns:
+            The number of seconds spent waiting.
+        """
+        total_secs_waited = 0
+        while True:
+            secs_to_wait = self.reserve(bucket_name)
+            if secs_to_wait <= 0:
+                return total_secs_waited
+            _LOG.debug(
+                "Rate limiter: waiting %.1f seconds for %s quota.", secs_to_wait, bucket_name
+            )
+            self.sleep(secs_to_wait)
+            total_secs_waited += secs_to_wait
+
+    def budget(self) -> pd.DataFrame:
+        """The current state of each bucket.
+
+        Returns:
+            pd.DataFrame with one row per bucket.  Columns:
+                remaining, total, reset_time (UTC), usable (remaining minus
+                headroom), tokens (requests which can be sent without
+                waiting), secs_per_request (the pacing interval).
+        """
+        rows = {}
+        with self._lock:
+            now = self.clock()
+            for bucket_name, bucket in self._buckets.items():
+                if bucket.remaining is None:
+                    continue
+                usable = max(bucket.remaining - self.headroom, 0)
+                secs_to_reset = max(bucket.reset_time - now, 0)
+                rows[bucket_name] = {
+                    "remaining": bucket.remaining,
+                    "total": bucket.total,
+                    "reset_time": pd.Timestamp(bucket.reset_time, unit="s", tz="utc"),
+                    "usable": usable,
+                    "tokens": bucket.tokens,
+                    "secs_per_request": secs_to_reset / usable if usable else secs_to_reset,
+                }
+        return pd.DataFrame.from_dict(
+            rows,
+            orient="index",
+            columns=["remaining", "total", "reset_time", "usable", "tokens", "secs_per_request"],
+        )
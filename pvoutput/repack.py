@@ -0,0 +1,231 @@
+"""Re-write a store into a new, compact HDF5 file.
+
+Months of small appends, and of `store.remove` calls (when rows are merged
+or superseded), leave an HDF5 file fragmented into many small chunks, with
+free space which HDF5 never reclaims.  `repack_store` reads every table of
+a store, and writes a new file in which:
+
+- each timeseries is sorted, de-duplicated, written in one append with
+  `expectedrows` set (so PyTables picks the chunk size for the whole
+  table), and has a completely sorted (CSI) index on `datetime`;
+- `missing_dates` is merged (see `hdf.compact_missing_dates`), and
+  `statistics` and `systems` only keep the latest row for each PV system;
+- the coverage catalog and the system catalog are re-built from the data
+  which was copied, so they always match the new file;
+- every table is compressed with the chosen codec.
+
+The source is only ever opened read-only, and the output is written under
+a temporary name which is only renamed to `output_filename` once it's
+complete.  To repack a store which is still being downloaded to, copy it
+(between flushes), repack the copy, then point the next download at the
+repacked file: data written to the original after the copy was taken
+isn't in the copy, so the coverage catalog says it's still to download.
+
+The source may also be a Parquet store (see `pvoutput.backends`).
+"""
+
+import logging
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from itertools import repeat
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+import tables
+
+from pvoutput.backends import HDFBackend, open_backend
+from pvoutput.catalog import SYSTEMS_KEY, catalog_row, latest_api_request, read_catalog
+from pvoutput.coverage import (
+    COVERAGE_KEY,
+    MISSING,
+    SystemCoverage,
+    missing_dates_coverage,
+    timeseries_coverage,
+    write_coverage,
+)
+from pvoutput.hdf import (
+    HDF_BACKUP_SUFFIX,
+    HDF_TMP_SUFFIX,
+    MISSING_DATES_KEY,
+    merge_missing_date_ranges,
+    system_id_to_hdf_key,
+)
+from pvoutput.statistics import STATISTICS_KEY
+
+_LOG = logging.getLogger("pvoutput")
+
+# PV systems read by each worker process at a time.
+_SYSTEMS_PER_TASK = 8
+
+
+def repack_store(
+    source_filename: str,
+    output_filename: str,
+    complib: str = "blosc:zstd",
+    complevel: int = 5,
+    num_workers: Optional[int] = None,
+) -> Dict[str, int]:
+    """Re-write a store into a new, compact HDF5 file.
+
+    Args:
+        source_filename: HDF5 file or Parquet directory.  Opened read-only.
+        output_filename: The new HDF5 file.  Must not exist.
+        complib: PyTables compression library, e.g. 'zlib' (the default of
+            `pd.HDFStore`) or 'blosc:zstd', which is smaller and about twice as
+            fast to read, but needs an HDF5 reader with the Blosc filter
+            (PyTables, and so pandas, include it).
+        complevel: Compression level, 0 to 9.  Levels above 5 take much
+            longer to write, for little gain.
+        num_workers: If set, read and sort the timeseries using this many
+            processes.  (Only one process can write to an HDF5 file.)
+
+    Returns:
+        The number of PV systems, the number of timeseries rows before and
+        after de-duplication, and the size in bytes of the source and of
+        the output.
+    """
+    if os.path.exists(output_filename):
+        raise FileExistsError(output_filename)
+    tmp_filename = output_filename + ".tmp"
+    if os.path.exists(tmp_filename):
+        os.remove(tmp_filename)
+
+    with ExitStack() as stack:
+        source = stack.enter_context(open_backend(source_filename, mode="r"))
+        system_ids = source.scan_system_ids()
+        try:
+            source_catalog = read_catalog(source)["last_downloaded"]
+        except KeyError:
+            source_catalog = pd.Series(dtype="datetime64[ns]")
+        output = HDFBackend(
+            stack.enter_context(
+                pd.HDFStore(tmp_filename, mode="w", complib=complib, complevel=complevel)
+            )
+        )
+        executor = None
+        if num_workers:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=num_workers))
+
+        _LOG.info("Repacking %d PV systems from %s", len(system_ids), source_filename)
+        coverage = {}
+        catalog_rows = []
+        num_rows_before = num_rows_after = 0
+        batch_size = _SYSTEMS_PER_TASK * (num_workers or 1)
+        for i in range(0, len(system_ids), batch_size):
+            batch = system_ids[i : i + batch_size]
+            if executor is None:
+                results = [_read_sorted_timeseries(source_filename, batch)]
+            else:
+                tasks = [
+                    batch[j : j + _SYSTEMS_PER_TASK]
+                    for j in range(0, len(batch), _SYSTEMS_PER_TASK)
+                ]
+                results = executor.map(_read_sorted_timeseries, repeat(source_filename), tasks)
+            for result in results:
+                for pv_system_id, timeseries, num_rows_read in result:
+                    num_rows_before += num_rows_read
+                    num_rows_after += len(timeseries)
+                    if timeseries.empty:
+                        continue
+                    _write_timeseries(output.store, pv_system_id, timeseries)
+                    coverage[pv_system_id] = SystemCoverage(
+                        downloaded=timeseries_coverage(timeseries)
+                    )
+                    catalog_rows.append(
+                        catalog_row(
+                            output,
+                            pv_system_id,
+                            timeseries.index,
+                            last_downloaded=source_catalog.get(
+                                pv_system_id, latest_api_request(timeseries)
+                            ),
+                        )
+                    )
+            _LOG.info("Repacked %d of %d PV systems", i + len(batch), len(system_ids))
+
+        if MISSING_DATES_KEY in source:
+            missing_dates = merge_missing_date_ranges(source.read_table(MISSING_DATES_KEY))
+            output.replace_table(MISSING_DATES_KEY, missing_dates)
+            for pv_system_id, intervals in missing_dates_coverage(missing_dates).items():
+                coverage.setdefault(pv_system_id, SystemCoverage()).update(MISSING, intervals)
+        if STATISTICS_KEY in source:
+            statistics = source.read_table(STATISTICS_KEY)
+            statistics = statistics[~statistics.index.duplicated(keep="last")]
+            output.replace_table(STATISTICS_KEY, statistics.sort_index(kind="mergesort"))
+        write_coverage(output, coverage)
+        if catalog_rows:
+            output.replace_table(SYSTEMS_KEY, pd.concat(catalog_rows))
+        _copy_other_tables(source, output)
+        output.flush()
+
+    os.replace(tmp_filename, output_filename)
+    return {
+        "num_systems": len(system_ids),
+        "num_rows_before": num_rows_before,
+        "num_rows_after": num_rows_after,
+        "bytes_before": store_size(source_filename),
+        "bytes_after": store_size(output_filename),
+    }
+
+
+def store_size(filename: str) -> int:
+    """The size in bytes of an HDF5 file, or of a Parquet directory."""
+    if not os.path.isdir(filename):
+        return os.path.getsize(filename)
+    return sum(
+        os.path.getsize(os.path.join(directory, name))
+        for directory, _, names in os.walk(filename)
+        for name in names
+    )
+
+
+def _read_sorted_timeseries(
+    source_filename: str, system_ids: List[int]
+) -> List[Tuple[int, pd.DataFrame, int]]:
+    """Read, sort and de-duplicate timeseries (in a worker process).
+
+    Where rows have the same datetime, the first is kept (like
+    `hdf.append_and_merge_pv_system`).
+
+    Returns:
+        (pv_system_id, timeseries, number of rows read) for each PV system.
+    """
+    results = []
+    with open_backend(source_filename, mode="r") as source:
+        for pv_system_id in system_ids:
+            timeseries = source.read_timeseries(pv_system_id)
+            num_rows_read = len(timeseries)
+            timeseries = timeseries.sort_index(kind="mergesort")
+            timeseries = timeseries[~timeseries.index.duplicated()]
+            results.append((pv_system_id, timeseries, num_rows_read))
+    return results
+
+
+def _write_timeseries(store: pd.HDFStore, pv_system_id: int, timeseries: pd.DataFrame):
+    key = system_id_to_hdf_key(pv_system_id)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", tables.NaturalNameWarning)
+        store.append(key, timeseries, data_columns=True, expectedrows=len(timeseries), index=False)
+    store.create_table_index(key, columns=["index"], optlevel=9, kind="full")
+
+
+def _copy_other_tables(source, output: HDFBackend):
+    """Copy any other tables of an HDF5 source (e.g. `metadata`) as they are."""
+    if not isinstance(source, HDFBackend):
+        return
+    known_keys = {MISSING_DATES_KEY, STATISTICS_KEY, COVERAGE_KEY, SYSTEMS_KEY}
+    for key in source.store.keys():
+        key = key.strip("/")
+        if key in known_keys or key.startswith("timeseries/"):
+            continue
+        if key.endswith(HDF_TMP_SUFFIX) or key.endswith(HDF_BACKUP_SUFFIX):
+            # Left by an interrupted `replace_table` (see `HDFBackend`).
+            continue
+        _LOG.info("Copying table %s", key)
+        value = source.store[key]
+        if isinstance(value, pd.DataFrame) and source.store.get_storer(key).is_table:
+            output.store.append(key, value, data_columns=True, expectedrows=len(value))
+        else:
+            output.store.put(key, value)
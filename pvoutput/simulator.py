@@ -0,0 +1,370 @@
+"""A local stand-in for the PVOutput.org API, for load-testing and benchmarks.
+
+PVOutputSimulator serves synthetic, deterministic data for getstatus,
+getbatchstatus (including the 'Accepted 202' flow), getstatistic, getsystem
+and search, with X-Rate-Limit-* headers, per-API-key quotas and configurable
+latency.  For example:
+
+    with PVOutputSimulator(system_ids=range(1, 101), latency_secs=0.05) as simulator:
+        pv = simulator.make_client()
+        pv.download_multiple_systems_to_disk(...)
+"""
+
+import logging
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import date, timedelta
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from pvoutput.pvoutput import PVOutput
+from pvoutput.ratelimit import API, DATA_SERVICE
+from pvoutput.transport import RequestsTransport
+
+_LOG = logging.getLogger("pvoutput")
+
+NO_STATUS_FOUND = "Bad request 400: No status found"
+ACCEPTED = "Accepted 202: Request has been queued"
+
+# Status every 5 minutes from 06:00 to 19:55.
+_TIMES = pd.date_range("2000-01-01 06:00", "2000-01-01 19:55", freq="5T").strftime("%H:%M")
+_NUM_CLOUD_LEVELS = 8
+
+
+class PVOutputSimulator:
+    """A local HTTP server which imitates the PVOutput.org API.
+
+    Each PV system has a capacity, a first date of data (between
+    `start_date` and a year later) and a last date of data (`end_date`),
+    and is missing about 2% of days.  All of these, and the power on each
+    day, are derived from the PV system ID, so every run serves the same
+    data.
+
+    Attributes:
+        url: The base URL of the server, e.g. 'http://127.0.0.1:54321'.
+        num_requests: Counter of requests received per service.
+    """
+
+    def __init__(
+        self,
+        system_ids: Iterable[int] = range(1, 1001),
+        start_date: date = date(2015, 1, 1),
+        end_date: date = date(2019, 12, 31),
+        latency_secs: float = 0,
+        quota: int = 300,
+        data_service_quota: int = 900,
+        quota_period_secs: float = 3600,
+        batch_polls_until_ready: int = 1,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        """
+        Args:
+            system_ids: The PV system IDs which have data.
+            start_date, end_date: The range of dates with data.
+            latency_secs: Seconds to wait before answering each request.
+            quota, data_service_quota: Requests allowed per API key per
+                quota period, for the API and the data service.
+            quota_period_secs: Seconds until quotas are reset.
+            batch_polls_until_ready: The number of times each getbatchstatus
+                request is answered with 'Accepted 202' before the data is
+                ready.  0 means the data is ready immediately.
+            host, port: Address to serve on.  Port 0 picks a free port.
+        """
+        self.system_ids = set(system_ids)
+        self.start_date = pd.Timestamp(start_date).date()
+        self.end_date = pd.Timestamp(end_date).date()
+        self.latency_secs = latency_secs
+        self.quotas = {API: quota, DATA_SERVICE: data_service_quota}
+        self.quota_period_secs = quota_period_secs
+        self.batch_polls_until_ready = batch_polls_until_ready
+        self.num_requests = Counter()
+        self._lock = threading.Lock()
+        # Maps (api_key, bucket_name) to [remaining, reset_time].
+        self._quota_state = {}
+        # Maps (api_key, pv_system_id, date_to) to number of polls so far.
+        self._batch_jobs = Counter()
+
+        simulator = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                simulator._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return "http://{}:{:d}".format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def make_client(self, **kwargs):
+        """A PVOutput object which sends all its requests to this simulator.
+
+        Args:
+            **kwargs: Passed to PVOutput (see the module-level `make_client`).
+        """
+        return make_client(self.url, **kwargs)
+
+    # ********** Request handling **********
+
+    def _handle(self, handler: BaseHTTPRequestHandler):
+        split_url = urlsplit(handler.path)
+        service = split_url.path.rsplit("/", 1)[-1].replace(".jsp", "")
+        params = dict(parse_qsl(split_url.query))
+        api_key = handler.headers.get("X-Pvoutput-Apikey") or params.get("key", "")
+        bucket_name = DATA_SERVICE if service == "getbatchstatus" else API
+
+        if self.latency_secs:
+            time.sleep(self.latency_secs)
+
+        with self._lock:
+            self.num_requests[service] += 1
+            remaining, reset_time = self._use_quota(api_key, bucket_name)
+
+        if remaining < 0:
+            status_code = 403
+            text = "Forbidden 403: Exceeded {:d} requests per hour".format(self.quotas[bucket_name])
+        else:
+            handle_func = {
+                "getstatus": self._get_status,
+                "getbatchstatus": self._get_batch_status,
+                "getstatistic": self._get_statistic,
+                "getsystem": self._get_system,
+                "search": self._search,
+            }.get(service)
+            if handle_func is None:
+                status_code, text = 404, "Not found 404"
+            else:
+                params["api_key"] = api_key
+                try:
+                    status_code, text = handle_func(params)
+                except (KeyError, ValueError) as e:
+                    status_code, text = 400, "Bad request 400: {}".format(e)
+
+        body = text.encode("latin1")
+        handler.send_response(status_code)
+        handler.send_header("Content-Type", "text/plain;charset=ISO-8859-1")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.send_header("X-Rate-Limit-Remaining", str(max(remaining, 0)))
+        handler.send_header("X-Rate-Limit-Limit", str(self.quotas[bucket_name]))
+        handler.send_header("X-Rate-Limit-Reset", str(int(reset_time)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _use_quota(self, api_key: str, bucket_name: str) -> Tuple[int, float]:
+        now = time.time()
+        state = self._quota_state.get((api_key, bucket_name))
+        if state is None or now >= state[1]:
+            state = [self.quotas[bucket_name], now + self.quota_period_secs]
+            self._quota_state[(api_key, bucket_name)] = state
+        state[0] -= 1
+        return state[0], state[1]
+
+    def _get_status(self, params: Dict) -> Tuple[int, str]:
+        pv_system_id = int(params["sid1"])
+        day = _parse_date(params["d"])
+        if not self._has_data(pv_system_id, day):
+            return 400, NO_STATUS_FOUND
+        capacity, cloud_level = self._day_params(pv_system_id, day)
+        template = _status_template(capacity, cloud_level)
+        return 200, template.replace("DATE", day.strftime("%Y%m%d"))
+
+    def _get_batch_status(self, params: Dict) -> Tuple[int, str]:
+        pv_system_id = int(params["sid1"])
+        date_to = _parse_date(params["dt"]) if "dt" in params else self.end_date
+        job = (params["api_key"], pv_system_id, date_to)
+        with self._lock:
+            num_polls = self._batch_jobs[job]
+            if num_polls < self.batch_polls_until_ready:
+                self._batch_jobs[job] += 1
+                return 200, ACCEPTED
+            del self._batch_jobs[job]
+
+        lines = []
+        for day in pd.date_range(date_to - timedelta(days=365), date_to, freq="D").date[::-1]:
+            if self._has_data(pv_system_id, day):
+                capacity, cloud_level = self._day_params(pv_system_id, day)
+                lines.append(day.strftime("%Y%m%d") + ";" + _batch_template(capacity, cloud_level))
+        if not lines:
+            return 400, NO_STATUS_FOUND
+        return 200, "\n".join(lines)
+
+    def _get_statistic(self, params: Dict) -> Tuple[int, str]:
+        pv_system_id = int(params["sid1"])
+        if pv_system_id not in self.system_ids:
+            return 400, NO_STATUS_FOUND
+        first_date, last_date = self._date_range(pv_system_id)
+        if "df" in params:
+            first_date = max(first_date, _parse_date(params["df"]))
+        if "dt" in params:
+            last_date = min(last_date, _parse_date(params["dt"]))
+        days = pd.date_range(first_date, last_date, freq="D").date
+        num_outputs = sum(1 for day in days if not self._is_missing(pv_system_id, day))
+        if num_outputs == 0:
+            return 400, NO_STATUS_FOUND
+        capacity = self._capacity(pv_system_id)
+        daily_energy = capacity * 4
+        return 200, ",".join(
+            str(value)
+            for value in [
+                daily_energy * num_outputs,
+                0,
+                daily_energy,
+                daily_energy // 10,
+                daily_energy * 2,
+                "{:.3f}".format(daily_energy / capacity),
+                num_outputs,
+                first_date.strftime("%Y%m%d"),
+                last_date.strftime("%Y%m%d"),
+                "{:.3f}".format(2 * daily_energy / capacity),
+                first_date.strftime("%Y%m%d"),
+            ]
+        )
+
+    def _get_system(self, params: Dict) -> Tuple[int, str]:
+        pv_system_id = int(params["sid1"])
+        if pv_system_id not in self.system_ids:
+            return 400, NO_STATUS_FOUND
+        return 200, self._system_metadata(pv_system_id)
+
+    def _search(self, params: Dict) -> Tuple[int, str]:
+        query = params.get("q", "")
+        lines = []
+        for pv_system_id in sorted(self.system_ids):
+            name = "System {:d}".format(pv_system_id)
+            if query and query.lower() not in name.lower() and query != str(pv_system_id):
+                continue
+            lat, lon = self._location(pv_system_id)
+            lines.append(
+                (
+                    "{},{:d},United Kingdom AB1,S,{:d},1 day ago,{:d},"
+                    "Panels,Inverter,NaN,{:f},{:f}"
+                ).format(name, self._capacity(pv_system_id), 100, pv_system_id, lat, lon)
+            )
+            if len(lines) == 30:
+                break
+        return 200, "\n".join(lines)
+
+    # ********** Synthetic data **********
+
+    def _date_range(self, pv_system_id: int) -> Tuple[date, date]:
+        first_date = self.start_date + timedelta(days=_hash(pv_system_id, "first_date") % 366)
+        return min(first_date, self.end_date), self.end_date
+
+    def _has_data(self, pv_system_id: int, day: date) -> bool:
+        if pv_system_id not in self.system_ids:
+            return False
+        first_date, last_date = self._date_range(pv_system_id)
+        return first_date <= day <= last_date and not self._is_missing(pv_system_id, day)
+
+    def _is_missing(self, pv_system_id: int, day: date) -> bool:
+        return _hash(pv_system_id, day) % 50 == 0
+
+    def _capacity(self, pv_system_id: int) -> int:
+        return 1000 + 500 * (_hash(pv_system_id, "capacity") % 19)
+
+    def _location(self, pv_system_id: int) -> Tuple[float, float]:
+        h = _hash(pv_system_id, "location")
+        return 50 + (h % 800) / 100, -5 + ((h // 800) % 700) / 100
+
+    def _day_params(self, pv_system_id: int, day: date) -> Tuple[int, int]:
+        return self._capacity(pv_system_id), _hash(pv_system_id, day, "cloud") % _NUM_CLOUD_LEVELS
+
+    def _system_metadata(self, pv_system_id: int) -> str:
+        capacity = self._capacity(pv_system_id)
+        lat, lon = self._location(pv_system_id)
+        first_date, _ = self._date_range(pv_system_id)
+        return (
+            "System {sid:d},{capacity:d},AB1,{num_panels:d},250,Panels,1,{capacity:d},Inverter,"
+            "S,30.0,No,{install_date},{lat:f},{lon:f},5,0,0,,0;".format(
+                sid=pv_system_id,
+                capacity=capacity,
+                num_panels=capacity // 250,
+                install_date=first_date.strftime("%Y%m%d"),
+                lat=lat,
+                lon=lon,
+            )
+        )
+
+
+def make_client(url: str, api_key: str = "key", system_id: str = "1", **kwargs):
+    """A PVOutput object which sends all its requests to the simulator at `url`.
+
+    Useful when the simulator runs in another process.
+
+    Args:
+        **kwargs: Passed to PVOutput.
+    """
+    kwargs.setdefault("data_service_url", "https://simulator.pvoutput.org")
+    pv = PVOutput(api_key=api_key, system_id=system_id, **kwargs)
+    pv.transport = RequestsTransport(pv.session, base_url=url)
+    return pv
+
+
+def _hash(*args) -> int:
+    return zlib.crc32("-".join(str(arg) for arg in args).encode("utf-8"))
+
+
+def _parse_date(yyyymmdd: str) -> date:
+    return pd.Timestamp(yyyymmdd).date()
+
+
+def _power_profile(capacity: int, cloud_level: int) -> np.ndarray:
+    hours = np.arange(len(_TIMES)) / 12
+    shape = np.sin(np.pi * (hours + 0.5 / 12) / 14)
+    cloudiness = 1 - cloud_level / (_NUM_CLOUD_LEVELS + 1)
+    return np.round(capacity * shape * cloudiness).astype(int)
+
+
+@lru_cache(maxsize=None)
+def _batch_template(capacity: int, cloud_level: int) -> str:
+    """The records of one day of getbatchstatus: 'HH:MM,energy,power;...'"""
+    power = _power_profile(capacity, cloud_level)
+    energy = np.cumsum(power) // 12
+    return ";".join(
+        "{},{:d},{:d}".format(time_str, e, p) for time_str, e, p in zip(_TIMES, energy, power)
+    )
+
+
+@lru_cache(maxsize=None)
+def _status_template(capacity: int, cloud_level: int) -> str:
+    """One day of historic getstatus, newest first, with 'DATE' for the date."""
+    power = _power_profile(capacity, cloud_level)
+    energy = np.cumsum(power) // 12
+    records = [
+        "DATE,{},{:d},{:.3f},{:d},{:d},{:.3f},NaN,NaN,15.0,240.0".format(
+            time_str, e, e / capacity, p, p, p / capacity
+        )
+        for time_str, e, p in zip(_TIMES, energy, power)
+    ]
+    return ";".join(records[::-1])
@@ -0,0 +1,68 @@
+from datetime import date
+from typing import Optional, Union
+
+import pandas as pd
+
+from pvoutput.tablecache import KeyedTableCache
+
+STATISTICS_KEY = "statistics"
+
+
+def is_statistic_fresh(
+    stats: pd.DataFrame,
+    date_from: Optional[Union[str, date]] = None,
+    date_to: Optional[Union[str, date]] = None,
+) -> bool:
+    """Can these cached stats be used for a query from date_from to date_to?
+
+    Returns:
+        False if date_to > query_date_to, or if date_from < query_date_from;
+        in which case the caller should get fresh stats from the API.
+    """
+    if date_from:
+        date_from = pd.Timestamp(date_from).date()
+    if date_to:
+        date_to = pd.Timestamp(date_to).date()
+
+    query_date_from = stats.iloc[0]["query_date_from"]
+    query_date_to = stats.iloc[0]["query_date_to"]
+
+    if (
+        not pd.isnull(date_from)
+        and not pd.isnull(query_date_from)
+        and date_from < query_date_from.date()
+    ):
+        return False
+
+    if not pd.isnull(date_to) and date_to > query_date_to.date():
+        return False
+
+    return True
+
+
+class StatisticsCache(KeyedTableCache):
+    """An in-memory copy of the `statistics` table of the store.
+
+    The table is read once, on the first lookup, instead of once per PV
+    system.  Refreshed stats are kept in memory, and appended to the table in
+    one batch by `flush` (see `tablecache.KeyedTableCache`).
+    """
+
+    key = STATISTICS_KEY
+
+    def get(
+        self,
+        pv_system_id: int,
+        date_from: Optional[Union[str, date]] = None,
+        date_to: Optional[Union[str, date]] = None,
+    ) -> Optional[pd.DataFrame]:
+        """Get the stats for one PV system, if they're fresh enough.
+
+        Returns:
+            None if there are no stats for pv_system_id, or if they aren't
+            fresh (see `is_statistic_fresh`).
+        """
+        stats = self.get_row(pv_system_id)
+        if stats is None:
+            return None
+        return stats if is_statistic_fresh(stats, date_from, date_to) else None
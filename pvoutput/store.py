@@ -0,0 +1,311 @@
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from pvoutput.backends import StorageBackend, open_backend
+from pvoutput.catalog import SystemCatalog
+from pvoutput.coverage import (
+    COVERAGE_KEY,
+    SystemCoverage,
+    append_coverage,
+    build_coverage,
+    merge_coverage,
+    missing_dates_coverage,
+    read_coverage,
+    timeseries_coverage,
+    write_coverage,
+)
+from pvoutput.daterange import DateIntervalSet, DateRange
+from pvoutput.hdf import MISSING_DATES_KEY, merge_missing_date_ranges
+from pvoutput.statistics import StatisticsCache
+
+_LOG = logging.getLogger("pvoutput")
+
+
+class StoreWriter:
+    """Buffers appends to the store, and writes them in large batches.
+
+    Opening the HDF5 file and appending a few hundred rows at a time is slow,
+    and leaves the tables fragmented into many small chunks.  StoreWriter
+    holds the store open (see `backends.open_backend`: the store may also be
+    a directory of Parquet files), and buffers the rows for each PV system (and for
+    `missing_dates`) in memory until `max_buffered_rows` rows are buffered
+    or `max_secs_between_flushes` seconds have passed since the last flush.
+    Timeseries are merged into the store using
+    `StorageBackend.append_timeseries`, so each PV system's table stays
+    sorted, with no duplicate timestamps.
+
+    StoreWriter also caches the `statistics` table (see `StatisticsCache`),
+    and maintains the coverage catalog (see `pvoutput.coverage`)
+    on every flush, and keeps a copy of it in memory, so
+    `get_date_ranges_to_download` never has to read the timeseries tables.
+    Likewise, the system catalog (see `pvoutput.catalog`) is updated for
+    every PV system written by a flush.
+
+    Rows only reach the disk when the buffer is flushed, so callers must
+    call `flush` before treating any work as done.  If the process is
+    killed then the buffered rows are lost, and will be downloaded again
+    when the download is re-started.
+
+    StoreWriter is not thread-safe: only one thread should use it.
+
+    For example:
+
+        with StoreWriter(output_filename) as writer:
+            writer.append_timeseries(pv_system_id, timeseries)
+            writer.append_missing_dates(missing_dates)
+    """
+
+    def __init__(
+        self,
+        output_filename: str,
+        max_buffered_rows: int = 50000,
+        max_secs_between_flushes: float = 300,
+        complevel: int = 9,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            output_filename: HDF5 filename (or Parquet directory, ending
+                with '.parquet') to write data to.
+            max_buffered_rows: Flush when at least this many rows are buffered.
+            max_secs_between_flushes: Flush (on the next append) when this
+                many seconds have passed since the last flush.
+            complevel: Compression level of the HDF5 file.  Not used by
+                the Parquet backend.
+            clock: Function which returns seconds.  Only replaced for testing.
+        """
+        self.output_filename = output_filename
+        self.max_buffered_rows = max_buffered_rows
+        self.max_secs_between_flushes = max_secs_between_flushes
+        self.complevel = complevel
+        self.clock = clock
+        self.num_flushes = 0
+        self._backend = None
+        # Maps PV system ID to list of timeseries waiting to be appended.
+        self._timeseries_buffers = defaultdict(list)
+        self._missing_dates_buffer = []
+        # Maps PV system ID to the coverage of the buffered rows.
+        self._coverage_buffer = {}
+        self._coverage = None
+        self._has_appended_coverage = False
+        self._statistics = StatisticsCache()
+        self._catalog = SystemCatalog()
+        self._num_buffered_rows = 0
+        self._last_flush_time = clock()
+
+    @property
+    def backend(self) -> StorageBackend:
+        """The open store.  Call `flush` first to see buffered rows."""
+        if self._backend is None:
+            self._backend = open_backend(self.output_filename, complevel=self.complevel)
+        return self._backend
+
+    @property
+    def store(self) -> pd.HDFStore:
+        """The open HDF5 store (only for the HDF5 backend)."""
+        return self.backend.store
+
+    @property
+    def num_buffered_rows(self) -> int:
+        return self._num_buffered_rows
+
+    @property
+    def coverage(self) -> Dict[int, SystemCoverage]:
+        """Maps each PV system ID to its coverage, including buffered rows.
+
+        Read from the store the first time it's used.  If the store was
+        written before the coverage catalog existed, then the catalog is
+        built by scanning the store, which may take a while.
+        """
+        if self._coverage is None:
+            backend = self.backend
+            if COVERAGE_KEY in backend:
+                self._coverage = read_coverage(backend)
+            else:
+                _LOG.info("Building coverage catalog for %s", self.output_filename)
+                self._coverage = build_coverage(backend)
+                write_coverage(backend, self._coverage)
+            merge_coverage(self._coverage, self._coverage_buffer)
+        return self._coverage
+
+    @property
+    def catalog(self) -> pd.DataFrame:
+        """The system catalog (see `pvoutput.catalog`), as of the last flush.
+
+        Read from the store the first time it's used (or built by scanning
+        the store, if it was written before the system catalog existed).
+        """
+        self._catalog.load(self.backend)
+        return self._catalog.table
+
+    def get_date_ranges_to_download(
+        self, pv_system_id: int, start_date, end_date
+    ) -> List[DateRange]:
+        """Like `utils.get_date_ranges_to_download`, but without reading the store."""
+        system_coverage = self.coverage.get(pv_system_id, SystemCoverage())
+        return system_coverage.date_ranges_to_download(start_date, end_date)
+
+    def get_statistic(
+        self, pv_system_id: int, date_from=None, date_to=None
+    ) -> Optional[pd.DataFrame]:
+        """Get cached stats for one PV system, if they're fresh enough.
+
+        The whole `statistics` table is read the first time this is called.
+        See `statistics.is_statistic_fresh`.
+        """
+        self._statistics.load(self.backend)
+        return self._statistics.get(pv_system_id, date_from, date_to)
+
+    def put_statistic(self, pv_system_id: int, stats: pd.DataFrame):
+        """Cache fresh stats, and buffer them to write to the store."""
+        self._statistics.put(pv_system_id, stats)
+
+    def append_timeseries(self, pv_system_id: int, timeseries: pd.DataFrame):
+        """Buffer rows to append to the timeseries of `pv_system_id`."""
+        if not timeseries.empty:
+            self._add_coverage(
+                {pv_system_id: SystemCoverage(downloaded=timeseries_coverage(timeseries))}
+            )
+            self._append(self._timeseries_buffers[pv_system_id], timeseries)
+
+    def append_missing_dates(self, missing_dates: pd.DataFrame):
+        """Buffer rows to append to the `missing_dates` table.
+
+        Rows whose dates are already known to be missing are dropped, so
+        re-downloading a year doesn't duplicate its gaps.
+        """
+        if self._coverage is not None and not missing_dates.empty:
+            missing_dates = missing_dates[~self._is_known_missing(missing_dates)]
+        self._add_coverage(
+            {
+                pv_system_id: SystemCoverage(missing=intervals)
+                for pv_system_id, intervals in missing_dates_coverage(missing_dates).items()
+            }
+        )
+        self._append(self._missing_dates_buffer, missing_dates)
+
+    def _is_known_missing(self, missing_dates: pd.DataFrame) -> np.ndarray:
+        is_known = np.zeros(len(missing_dates), dtype=bool)
+        for i, (pv_system_id, start_date, end_date) in enumerate(
+            zip(
+                missing_dates.index,
+                missing_dates["missing_start_date_PV_localtime"],
+                missing_dates["missing_end_date_PV_localtime"],
+            )
+        ):
+            system_coverage = self._coverage.get(pv_system_id)
+            if system_coverage is not None:
+                dates = DateIntervalSet.from_date_ranges([DateRange(start_date, end_date)])
+                is_known[i] = (dates - system_coverage.missing).num_days() == 0
+        return is_known
+
+    def _add_coverage(self, coverage: Dict[int, SystemCoverage]):
+        merge_coverage(self._coverage_buffer, coverage)
+        if self._coverage is not None:
+            merge_coverage(self._coverage, coverage)
+
+    def _append(self, buffer: list, df: pd.DataFrame):
+        if df.empty:
+            return
+        buffer.append(df)
+        self._num_buffered_rows += len(df)
+        self.flush_if_needed()
+
+    def flush_if_needed(self) -> bool:
+        """Flush if the buffer is full or the last flush was too long ago.
+
+        Returns:
+            True if the buffer was flushed.
+        """
+        secs_since_last_flush = self.clock() - self._last_flush_time
+        if (
+            self._num_buffered_rows >= self.max_buffered_rows
+            or secs_since_last_flush >= self.max_secs_between_flushes
+        ):
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        """Write all buffered rows (and stats) to disk."""
+        if self._num_buffered_rows or self._statistics.num_pending:
+            _LOG.debug(
+                "Flushing %d rows for %d PV systems to %s",
+                self._num_buffered_rows,
+                len(self._timeseries_buffers),
+                self.output_filename,
+            )
+            backend = self.backend
+            if self._timeseries_buffers:
+                self._catalog.load(backend)
+            now = pd.Timestamp.utcnow().tz_localize(None)
+            for pv_system_id, dfs in self._timeseries_buffers.items():
+                timeseries = pd.concat(dfs)
+                num_rows_rewritten = backend.append_timeseries(pv_system_id, timeseries)
+                if num_rows_rewritten:
+                    _LOG.debug(
+                        "system_id %d: Merged %d existing rows", pv_system_id, num_rows_rewritten
+                    )
+                self._catalog.update(backend, pv_system_id, timeseries.index, last_downloaded=now)
+            if self._missing_dates_buffer:
+                backend.append_table(
+                    MISSING_DATES_KEY,
+                    merge_missing_date_ranges(pd.concat(self._missing_dates_buffer)),
+                )
+            if self._statistics.num_pending:
+                self._statistics.load(backend)
+                self._statistics.flush(backend)
+            self._catalog.flush(backend)
+            # The coverage catalog is written last, so if the process is killed
+            # mid-flush, the catalog never claims data which isn't there.
+            if COVERAGE_KEY in backend:
+                append_coverage(backend, self._coverage_buffer)
+                self._has_appended_coverage = True
+            else:
+                write_coverage(backend, build_coverage(backend))
+            backend.flush()
+            self.num_flushes += 1
+        self._timeseries_buffers.clear()
+        self._missing_dates_buffer = []
+        self._coverage_buffer = {}
+        self._num_buffered_rows = 0
+        self._last_flush_time = self.clock()
+
+    @contextmanager
+    def paused(self):
+        """Close the store (but keep the buffer), so other code can open it.
+
+        PyTables can't open a file read-only while it is open for writing.
+        """
+        self._close_store()
+        yield
+
+    def _close_store(self):
+        if self._backend is not None:
+            self._backend.close()
+            self._backend = None
+
+    def close(self):
+        """Flush and close the store."""
+        self.flush()
+        if self._statistics.is_loaded:
+            self._statistics.compact(self.backend)
+        if self._catalog.is_loaded:
+            self._catalog.compact(self.backend)
+        if self._has_appended_coverage:
+            # Replace the rows appended by each flush with one row per interval.
+            write_coverage(self.backend, self.coverage)
+            self._has_appended_coverage = False
+        self._close_store()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,94 @@
+"""An in-memory copy of a small table which is keyed by PV system ID.
+
+The `statistics` and `systems` tables hold one row per PV system, which
+is updated as PV systems are downloaded.  Rows are only ever appended to
+these tables (re-writing a table for every update would be slow), so a PV
+system may have several rows: the last row for each PV system wins.
+`KeyedTableCache` reads such a table once, keeps new rows in memory,
+appends them in one batch, and re-writes the table without superseded
+rows when asked.
+"""
+
+import logging
+from typing import Optional
+
+import pandas as pd
+
+_LOG = logging.getLogger("pvoutput")
+
+
+class KeyedTableCache:
+    """An in-memory copy of the table `key`, with one row per PV system.
+
+    The table is read by `load`, rows `put` since then are appended to the
+    store in one batch by `flush`, and `compact` removes superseded rows.
+    Subclasses set `key`.  The cache doesn't open the store itself:
+    `StoreWriter` passes in its `backends.StorageBackend`.
+    """
+
+    key = None
+
+    def __init__(self):
+        self._table = None
+        self._num_superseded_rows = 0
+        # Maps PV system ID to the row which hasn't been written to the store.
+        self._pending = {}
+
+    def load(self, backend):
+        """Read the table from the store, once."""
+        if self._table is not None:
+            return
+        if self.key in backend:
+            table = backend.read_table(self.key)
+            is_superseded = table.index.duplicated(keep="last")
+            self._num_superseded_rows = int(is_superseded.sum())
+            self._table = table[~is_superseded]
+        else:
+            self._table = self._load_missing(backend)
+        _LOG.info("Loaded %s for %d PV systems", self.key, len(self._table))
+
+    def _load_missing(self, backend) -> pd.DataFrame:
+        """The table to start from, if the store has none."""
+        return pd.DataFrame()
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._table is not None
+
+    @property
+    def table(self) -> pd.DataFrame:
+        """The table, as of the last `flush`, sorted by PV system ID."""
+        return self._table.sort_index(kind="mergesort")
+
+    def get_row(self, pv_system_id: int) -> Optional[pd.DataFrame]:
+        """The latest row of a PV system (including rows not yet flushed), or None."""
+        row = self._pending.get(pv_system_id)
+        if row is None and pv_system_id in self._table.index:
+            row = self._table.loc[[pv_system_id]]
+        return row
+
+    def put(self, pv_system_id: int, row: pd.DataFrame):
+        self._pending[pv_system_id] = row
+
+    @property
+    def num_pending(self) -> int:
+        return len(self._pending)
+
+    def flush(self, backend):
+        """Append the pending rows to the store."""
+        if not self._pending:
+            return
+        pending = pd.concat(self._pending.values())
+        backend.append_table(self.key, pending)
+        self._num_superseded_rows += int(pending.index.isin(self._table.index).sum())
+        table = pd.concat([self._table, pending]) if len(self._table) else pending
+        self._table = table[~table.index.duplicated(keep="last")]
+        self._pending = {}
+
+    def compact(self, backend):
+        """Remove superseded rows from the store, if there are any."""
+        if not self._num_superseded_rows:
+            return
+        _LOG.info("Removing %d superseded rows of %s", self._num_superseded_rows, self.key)
+        backend.replace_table(self.key, self.table)
+        self._num_superseded_rows = 0
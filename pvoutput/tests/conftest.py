@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+
+
+class FakeClock:
+    """A clock for RateLimiter, QuotaLedger and StoreWriter, which only moves when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.now += secs
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def make_timeseries():
+    """Makes a timeseries of `instantaneous_power_gen_W`, indexed by datetime.
+
+    The power is 0, 1, 2, ... unless `value` is set.  Any other columns are
+    passed as keyword args.
+    """
+
+    def _make_timeseries(start, periods=3, value=None, freq="5T", tz=None, **columns):
+        index = pd.date_range(start, periods=periods, freq=freq, tz=tz, name="datetime")
+        power = np.arange(periods) if value is None else np.full(periods, value)
+        return pd.DataFrame(
+            {"instantaneous_power_gen_W": power.astype(float), **columns}, index=index
+        )
+
+    return _make_timeseries
+
+
+@pytest.fixture
+def make_response():
+    """Makes a `requests.Response` from PVOutput.org, with rate limit headers."""
+
+    def _make_response(text, status_code=200, remaining=100, total=100, reset_time=1566000000):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = text.encode("latin1")
+        response.headers["X-Rate-Limit-Remaining"] = str(remaining)
+        response.headers["X-Rate-Limit-Limit"] = str(total)
+        response.headers["X-Rate-Limit-Reset"] = str(int(reset_time))
+        return response
+
+    return _make_response
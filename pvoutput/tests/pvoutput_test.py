@@ -1,11 +1,13 @@
+from collections import Counter
 from datetime import date
-from io import StringIO
+from io import BytesIO, StringIO
 
 import numpy as np
 import pandas as pd
 import pytest
 
-from pvoutput import pvoutput
+from pvoutput import PVOutputKeyPool, pvoutput
+from pvoutput.ratelimit import API, DATA_SERVICE
 
 
 def test_date_to_pvoutput_str():
@@ -78,8 +80,294 @@ datetime,cumulative_energy_gen_Wh,instantaneous_power_gen_W,temperature_C,voltag
     )
     pd.testing.assert_frame_equal(df, correct_df)
 
+    # Windows line endings.
+    df = pvoutput._process_batch_status(response_text.replace("\n", "\r\n"))
+    pd.testing.assert_frame_equal(df, correct_df)
+
     empty_df = pvoutput._process_batch_status("")
     assert empty_df.empty, "DataFrame should be empty but it was:\n{}\n".format(empty_df)
 
     with pytest.raises(NotImplementedError):
         pvoutput._process_batch_status("20140330;07:35,2,24,2,24,23.1,230.3")
+
+
+def test_process_status():
+    response_text = (
+        "20190102,00:05,2,0.1,24,24,0.2,NaN,NaN,12.5,240.1;"
+        "20190101,23:55,1,0.1,12,12,0.1,NaN,NaN,NaN,NaN"
+    )
+    df = pvoutput._process_status(response_text)
+    assert df.index.tolist() == [
+        pd.Timestamp("2019-01-01 23:55"),
+        pd.Timestamp("2019-01-02 00:05"),
+    ]
+    assert df.index.name == "datetime"
+    assert df["instantaneous_power_gen_W"].tolist() == [12, 24]
+    assert df["voltage"].iloc[1] == 240.1
+    assert (df.dtypes == np.float64).all()
+
+    assert pvoutput._process_status("").empty
+
+
+def test_get_batch_status_for_multiple(monkeypatch, make_response):
+    # System 1 is ready after one poll, system 2 after three polls,
+    # and system 3 has no data.
+    num_polls_until_ready = {1: 1, 2: 3}
+    requests_sent = []
+
+    def _get_data_service_response(service, api_params):
+        pv_system_id = api_params["sid1"]
+        requests_sent.append(pv_system_id)
+        if pv_system_id == 3:
+            return make_response("no status found", status_code=400)
+        if num_polls_until_ready[pv_system_id] > 0:
+            num_polls_until_ready[pv_system_id] -= 1
+            return make_response("Accepted 202")
+        return make_response("20190101;07:35,2,24;07:40,4,24")
+
+    monkeypatch.setattr(pvoutput.time, "sleep", lambda secs: None)
+    pv = pvoutput.PVOutput(api_key="key", system_id="1", data_service_url="https://example.org")
+    pv._get_data_service_response = _get_data_service_response
+    jobs = [(1, "20190102"), (2, "20190102"), (3, "20190102")]
+
+    results = list(pv.get_batch_status_for_multiple(jobs))
+
+    assert [pv_system_id for pv_system_id, _, _ in results] == [3, 1, 2]
+    assert results[0][2].empty
+    assert len(results[1][2]) == 2
+    # Every pending system is polled in each round.
+    assert requests_sent == [1, 2, 3, 1, 2, 2, 2]
+
+    # System 1 is ready after two polls: system 2 isn't polled until then.
+    num_polls_until_ready.update({1: 2, 2: 1})
+    requests_sent.clear()
+    results = list(pv.get_batch_status_for_multiple(jobs, stop_at_first_pending=True))
+    assert [pv_system_id for pv_system_id, _, _ in results] == [3, 1, 2]
+    assert requests_sent == [1, 2, 3, 1, 1, 2]
+
+    # By default, system 2 is ready before system 1.
+    num_polls_until_ready.update({1: 3, 2: 1})
+    requests_sent.clear()
+    results = list(pv.get_batch_status_for_multiple(jobs))
+    assert [pv_system_id for pv_system_id, _, _ in results] == [3, 2, 1]
+    assert requests_sent == [1, 2, 3, 1, 2, 1, 1]
+
+
+def test_key_pool_uses_client_with_most_quota(make_response):
+    def _make_client(remaining, data_service_url=None):
+        client = pvoutput.PVOutput(api_key="key", system_id="1", data_service_url=data_service_url)
+        client.remaining = remaining
+        client.num_requests = 0
+
+        def _get_response(service, api_params):
+            client.num_requests += 1
+            client.remaining -= 1
+            response = make_response("20190101,07:35,2,0.1,24,24,0.2,NaN,NaN,NaN,NaN")
+            response.headers["X-Rate-Limit-Remaining"] = str(client.remaining)
+            response.headers["X-Rate-Limit-Reset"] = str(
+                int((pd.Timestamp.utcnow() + pd.Timedelta("1H")).timestamp())
+            )
+            return response
+
+        client._get_api_response = _get_response
+        client._get_data_service_response = _get_response
+        return client
+
+    clients = [_make_client(10), _make_client(3), _make_client(5, "https://example.org")]
+    pool = PVOutputKeyPool(clients)
+    assert pool.data_service_url == "https://example.org"
+    assert pool.transport is clients[0].transport
+
+    # While their quotas are unknown, concurrent requests go to each client in turn.
+    unknown_pool = PVOutputKeyPool(clients)
+    assert [unknown_pool._choose_client(API)[0] for _ in range(4)] == [0, 1, 2, 0]
+
+    for _ in range(9):
+        pool.get_status(123, "20190101")
+    # Each client is tried once, because its quota is unknown, and then
+    # requests go to whichever client has the most quota left.
+    assert [client.num_requests for client in clients] == [7, 1, 1]
+    assert pool.budget()["remaining"].tolist() == [3, 2, 4]
+
+    # Only client 2 can use the data service.
+    pool._api_query("getbatchstatus", {"sid1": 123}, use_data_service=True)
+    assert clients[2].num_requests == 2
+
+
+def test_key_pool_pins_batch_jobs_to_one_client(monkeypatch, make_response):
+    reset_time = (pd.Timestamp.utcnow() + pd.Timedelta("1H")).timestamp()
+
+    def _make_client(data_service_remaining):
+        client = pvoutput.PVOutput(
+            api_key="key", system_id="1", data_service_url="https://example.org"
+        )
+        client.requests_sent = []
+        client.jobs = set()
+
+        def _get_api_response(service, api_params):
+            return make_response("1", remaining=999, reset_time=reset_time)
+
+        def _get_data_service_response(service, api_params):
+            job = api_params["sid1"]
+            client.requests_sent.append(job)
+            # Each job only exists for the API key it was submitted with.
+            text = "20190101;07:35,2,24;07:40,4,24" if job in client.jobs else ""
+            client.jobs.add(job)
+            return make_response(
+                text or "Accepted 202",
+                remaining=data_service_remaining - len(client.requests_sent),
+                reset_time=reset_time,
+            )
+
+        client._get_api_response = _get_api_response
+        client._get_data_service_response = _get_data_service_response
+        return client
+
+    monkeypatch.setattr(pvoutput.time, "sleep", lambda secs: None)
+    clients = [_make_client(10), _make_client(50)]
+    pool = PVOutputKeyPool(clients)
+    assert pool.session is clients[0].session
+    jobs = list(pool.get_batch_status_for_multiple([(1, "20190101"), (2, "20190101")]))
+    assert [pv_system_id for pv_system_id, _, _ in jobs] == [1, 2]
+    assert all(len(timeseries) == 2 for _, _, timeseries in jobs)
+    # Job 1 is polled using client 0, although client 1 has more quota left.
+    assert clients[0].requests_sent == [1, 1]
+    assert clients[1].requests_sent == [2, 2]
+    assert not pool._pinned_clients
+
+    # Each bucket's quota is read from its own responses.
+    pool._api_query("getstatus", {"sid1": 1})
+    budget = pool.budget()["remaining"]
+    assert budget[(0, DATA_SERVICE)] == 8
+    assert budget[(1, DATA_SERVICE)] == 48
+    assert budget.xs(API, level="bucket_name").tolist() == [999]
+
+
+def test_download_multiple_systems_to_disk_in_parallel(tmp_path, monkeypatch, make_response):
+    output_filename = str(tmp_path / "pv.hdf")
+    pv = pvoutput.PVOutput(api_key="key", system_id="1")
+    systems_planned = Counter()
+    get_date_ranges_to_download = pvoutput.StoreWriter.get_date_ranges_to_download
+
+    def _count_planning(writer, pv_system_id, *args, **kwargs):
+        systems_planned[pv_system_id] += 1
+        return get_date_ranges_to_download(writer, pv_system_id, *args, **kwargs)
+
+    monkeypatch.setattr(pvoutput.StoreWriter, "get_date_ranges_to_download", _count_planning)
+
+    def _get_api_response(service, api_params):
+        if service == "getstatistic":
+            return make_response("100,0,10,1,20,1.0,3,20190101,20190103,1.0,20190102")
+        if api_params["sid1"] == 3 and api_params["d"] == "20190102":
+            return make_response("no status found", status_code=400)
+        return make_response("{},07:35,2,0.1,24,24,0.2,NaN,NaN,NaN,NaN".format(api_params["d"]))
+
+    pv._get_api_response = _get_api_response
+    kwargs = dict(
+        system_ids=[1, 2, 3],
+        start_date=date(2019, 1, 1),
+        end_date=date(2019, 1, 3),
+        output_filename=output_filename,
+        use_get_batch_status_if_available=False,
+        num_workers=4,
+    )
+    pv.download_multiple_systems_to_disk(**kwargs)
+
+    with pd.HDFStore(output_filename, mode="r") as store:
+        for pv_system_id in [1, 2, 3]:
+            timeseries = store["/timeseries/{:d}".format(pv_system_id)]
+            num_days = 2 if pv_system_id == 3 else 3
+            assert len(timeseries) == num_days
+        missing_dates = store["missing_dates"]
+    assert missing_dates.index.tolist() == [3]
+    # The downloads follow the plan, instead of planning each PV system again.
+    assert systems_planned == {1: 1, 2: 1, 3: 1}
+
+    # Everything has been downloaded, so re-starting sends no requests.
+    pv._get_api_response = None
+    pv.download_multiple_systems_to_disk(**kwargs)
+
+
+def test_plan_downloads(tmp_path, make_response):
+    output_filename = str(tmp_path / "pv.hdf")
+    pv = pvoutput.PVOutput(api_key="key", system_id="1")
+    statistics = {
+        1: "100,0,10,1,20,1.0,3,20190101,20190103,1.0,20190102",
+        2: None,  # No data.
+        3: "100,0,10,1,20,1.0,1,20190101,20190103,1.0,20190102",  # Low availability.
+        4: "100,0,10,1,20,1.0,30,20180101,20180130,1.0,20180102",  # Before the dates.
+    }
+    requests_sent = Counter()
+
+    def _get_api_response(service, api_params):
+        requests_sent[service] += 1
+        if service == "getstatistic":
+            text = statistics[api_params["sid1"]]
+            return make_response(text or "no status found", status_code=200 if text else 400)
+        return make_response("{},07:35,2,0.1,24,24,0.2,NaN,NaN,NaN,NaN".format(api_params["d"]))
+
+    pv._get_api_response = _get_api_response
+    kwargs = dict(
+        system_ids=[1, 2, 3, 4, 1],
+        start_date=date(2019, 1, 1),
+        end_date=date(2019, 1, 3),
+        output_filename=output_filename,
+        use_get_batch_status_if_available=False,
+    )
+    plan = pv.plan_downloads(**kwargs)
+    assert plan.index.tolist() == [1, 2, 3, 4]
+    assert plan["status"].tolist() == [
+        "download",
+        "no_data",
+        "low_availability",
+        "no_data_in_date_range",
+    ]
+    assert plan["num_api_calls"].tolist() == [3, 0, 0, 0]
+    assert plan.at[1, "data_availability"] == 1
+    assert requests_sent == {"getstatistic": 4}
+
+    # The stats are cached, so only PV system 1 sends any requests.
+    requests_sent.clear()
+    pv.download_multiple_systems_to_disk(**kwargs)
+    assert requests_sent == {"getstatus": 3}
+    with pd.HDFStore(output_filename, mode="r") as store:
+        assert store.select_column("/timeseries/1", "index").size == 3
+        assert "/timeseries/3" not in store
+
+    plan = pv.plan_downloads(**kwargs)
+    assert plan["status"].tolist()[0] == "done"
+    assert plan["num_api_calls"].sum() == 0
+    assert plan["stats_from_cache"].dropna().all()
+
+
+def test_get_batch_status_streaming(monkeypatch, make_response):
+    # Make the response bigger than one chunk, so lines are split across chunks.
+    times = pd.date_range("2019-01-01 00:00", periods=200, freq="5T").strftime("%H:%M")
+    lines = [
+        "201901{:02d};".format(day) + ";".join("{},{:d},24".format(t, day) for t in times)
+        for day in range(30, 0, -1)
+    ]
+    response_text = "\n".join(lines)
+    assert len(response_text) > pvoutput.STREAM_CHUNK_SIZE
+    responses = ["Accepted 202", response_text]
+
+    def _get_data_service_response(service, api_params, stream=False):
+        assert stream
+        response = make_response("")
+        response._content = False
+        response.raw = BytesIO(responses.pop(0).encode("latin1"))
+        return response
+
+    monkeypatch.setattr(pvoutput.time, "sleep", lambda secs: None)
+    pv = pvoutput.PVOutput(
+        api_key="key",
+        system_id="1",
+        data_service_url="https://example.org",
+        stream_batch_status=True,
+    )
+    pv._get_data_service_response = _get_data_service_response
+
+    timeseries = pv.get_batch_status(123, date_to="20190130")
+    pd.testing.assert_frame_equal(timeseries, pvoutput._process_batch_status(response_text))
+    assert len(timeseries) == 30 * 200
+    assert not responses
@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import time
+
+import pandas as pd
+
+from pvoutput import AsyncPVOutput
+
+
+class _FakeAPI:
+    def __init__(self, make_response, quota: int):
+        self.make_response = make_response
+        self.remaining = quota
+        self.num_in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, service, api_params):
+        with self.lock:
+            self.num_in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.num_in_flight)
+        time.sleep(0.01)
+        with self.lock:
+            self.num_in_flight -= 1
+            self.remaining -= 1
+            remaining = self.remaining
+        text = "{},07:35,2,0.1,24,24,0.2,NaN,NaN,NaN,NaN".format(api_params["d"])
+        reset_time = pd.Timestamp.utcnow() + pd.Timedelta("1H")
+        return self.make_response(
+            text, remaining=remaining, total=300, reset_time=reset_time.timestamp()
+        )
+
+
+def test_get_status_concurrently(make_response):
+    pv = AsyncPVOutput(api_key="key", system_id="1", max_concurrent_requests=4)
+    fake_api = _FakeAPI(make_response, quota=300)
+    pv.client._get_api_response = fake_api
+    dates = pd.date_range("2019-01-01", periods=12, freq="D")
+
+    async def _get_all():
+        return await asyncio.gather(*[pv.get_status(123, date) for date in dates])
+
+    statuses = asyncio.run(_get_all())
+    assert [status.index[0].date() for status in statuses] == list(dates.date)
+    assert statuses[0]["instantaneous_power_gen_W"].iloc[0] == 24
+    assert 1 < fake_api.max_in_flight <= 4
+    assert pv.rate_limit_remaining == 300 - len(dates)
+
+
+def test_scheduler_respects_rate_limit_remaining(make_response):
+    pv = AsyncPVOutput(api_key="key", system_id="1", max_concurrent_requests=8)
+    fake_api = _FakeAPI(make_response, quota=3)
+    pv.client._get_api_response = fake_api
+
+    async def _get_all():
+        await pv.get_status(123, "20190101")
+        assert pv.rate_limit_remaining == 2
+        await asyncio.gather(*[pv.get_status(123, "20190102") for _ in range(2)])
+
+    asyncio.run(_get_all())
+    assert fake_api.max_in_flight <= 2
+    assert pv.rate_limit_remaining == 0
+
+
+def test_client_can_be_used_from_several_event_loops(make_response):
+    pv = AsyncPVOutput(api_key="key", system_id="1")
+    fake_api = _FakeAPI(make_response, quota=300)
+    pv.client._get_api_response = fake_api
+    for date in ["20190101", "20190102"]:
+        status = asyncio.run(pv.get_status(123, date))
+        assert len(status) == 1
+    assert pv.rate_limit_remaining == 298
+
+
+def test_get_insolation_forecast(make_response):
+    pv = AsyncPVOutput(api_key="key", system_id="1")
+    pv.client._get_api_response = lambda service, api_params: make_response(
+        "05:00,0,0;05:05,10,1", remaining=299
+    )
+    date = pd.Timestamp.now().normalize() + pd.Timedelta("1D")
+    insolation = asyncio.run(pv.get_insolation_forecast(date, pv_system_id=123))
+    assert insolation["predicted_power_gen_W"].tolist() == [0, 10]
@@ -0,0 +1,156 @@
+import pandas as pd
+import pytest
+
+from pvoutput import hdf
+from pvoutput.backends import HDFBackend, open_backend
+from pvoutput.daterange import DateRange
+from pvoutput.store import StoreWriter
+from pvoutput.utils import get_date_ranges_to_download, get_system_ids_in_store
+
+# Args for `make_timeseries`.
+_TWICE_DAILY = dict(freq="12H", cumulative_energy_gen_Wh=1.0)
+
+
+@pytest.fixture(params=["pv.hdf", "pv.parquet"])
+def filename(request, tmp_path):
+    if request.param.endswith(".parquet"):
+        pytest.importorskip("pyarrow")
+    return str(tmp_path / request.param)
+
+
+def test_open_backend(tmp_path):
+    with open_backend(str(tmp_path / "pv.hdf")) as backend:
+        assert isinstance(backend, HDFBackend)
+
+
+def test_timeseries(filename, make_timeseries):
+    with open_backend(filename) as backend:
+        assert backend.system_ids() == []
+        assert (
+            backend.append_timeseries(2, make_timeseries("2018-12-31", 4, 1, **_TWICE_DAILY)) == 0
+        )
+        assert (
+            backend.append_timeseries(2, make_timeseries("2019-01-03", 2, 2, **_TWICE_DAILY)) == 0
+        )
+        # Overlapping rows are merged, and the existing rows are kept.
+        assert backend.append_timeseries(2, make_timeseries("2019-01-01", 6, 3, **_TWICE_DAILY)) > 0
+        backend.append_timeseries(1, make_timeseries("2019-01-01", 2, 4, **_TWICE_DAILY))
+        assert backend.system_ids() == [1, 2]
+        assert "/timeseries/2" in backend
+        assert "/timeseries/3" not in backend
+
+        timeseries = backend.read_timeseries(2)
+        assert timeseries.index.is_monotonic_increasing
+        assert timeseries["instantaneous_power_gen_W"].tolist() == [1, 1, 1, 1, 3, 3, 2, 2]
+
+        timeseries = backend.read_timeseries(
+            2, start="2019-01-01 12:00", end="2019-01-03", columns=["cumulative_energy_gen_Wh"]
+        )
+        assert timeseries.columns.tolist() == ["cumulative_energy_gen_Wh"]
+        assert timeseries.index[0] == pd.Timestamp("2019-01-01 12:00")
+        assert timeseries.index[-1] == pd.Timestamp("2019-01-03")
+
+        # Columns which aren't in the table are left out.
+        timeseries = backend.read_timeseries(1, columns=["query_date"])
+        assert timeseries.columns.tolist() == []
+        assert len(timeseries) == 2
+
+        with pytest.raises(KeyError):
+            backend.read_timeseries(3)
+
+        many = backend.read_timeseries_many([1, 2, 3], start="2019-01-01 12:00")
+        assert many.index.names == ["pv_system_id", "datetime"]
+        assert many.index.get_level_values(0).unique().tolist() == [1, 2]
+        assert len(many) == 6
+
+
+def test_read_timeseries_in_local_time(filename, make_timeseries):
+    with open_backend(filename) as backend:
+        backend.append_timeseries(1, make_timeseries("2019-08-09", 288, 1, tz="Europe/London"))
+        # Naive bounds are in the timezone of the stored timeseries.
+        timeseries = backend.read_timeseries(1, start="2019-08-09 10:00", end="2019-08-09 11:00")
+        assert len(timeseries) == 13
+        assert timeseries.index[0] == pd.Timestamp("2019-08-09 10:00", tz="Europe/London")
+        assert timeseries.index[-1] == pd.Timestamp("2019-08-09 11:00", tz="Europe/London")
+
+
+def test_tables(filename):
+    def _make_rows(pv_system_ids, value):
+        return pd.DataFrame(
+            {"num_outputs": float(value)}, index=pd.Index(pv_system_ids, name="pv_system_id")
+        )
+
+    with open_backend(filename) as backend:
+        with pytest.raises(KeyError):
+            backend.read_table("statistics")
+        backend.append_table("statistics", _make_rows([1, 2], 1))
+        backend.append_table("statistics", _make_rows([2], 2))
+        assert "statistics" in backend
+        assert backend.read_table("statistics", 2)["num_outputs"].tolist() == [1, 2]
+
+        backend.replace_table("statistics", _make_rows([3, 1], 3))
+        statistics = backend.read_table("statistics")
+        assert statistics.index.tolist() == ([1, 3] if filename.endswith(".parquet") else [3, 1])
+
+        backend.replace_table("statistics", pd.DataFrame())
+        assert "statistics" not in backend
+
+
+def test_hdf_replace_table_is_recovered_after_interruption(tmp_path, monkeypatch):
+    filename = str(tmp_path / "pv.hdf")
+    statistics = pd.DataFrame(
+        {"num_outputs": [1.0, 2.0]}, index=pd.Index([1, 2], name="pv_system_id")
+    )
+    with HDFBackend(filename) as backend:
+        backend.append_table("statistics", statistics)
+        # Killed after the original was moved to its backup.
+        rename_hdf_node = hdf._rename_hdf_node
+        renames = []
+
+        def _rename_then_die(store, key, new_key):
+            renames.append(key)
+            if len(renames) == 2:
+                raise KeyboardInterrupt
+            rename_hdf_node(store, key, new_key)
+
+        monkeypatch.setattr(hdf, "_rename_hdf_node", _rename_then_die)
+        with pytest.raises(KeyboardInterrupt):
+            backend.replace_table("statistics", statistics.iloc[:1])
+        monkeypatch.undo()
+        assert "/statistics" not in backend.store
+
+    with HDFBackend(filename, mode="r") as backend:
+        assert "statistics" in backend
+        pd.testing.assert_frame_equal(backend.read_table("statistics"), statistics)
+
+    with HDFBackend(filename) as backend:
+        assert backend.store.keys() == ["/statistics"]
+        pd.testing.assert_frame_equal(backend.read_table("statistics"), statistics)
+        backend.replace_table("statistics", statistics.iloc[:1])
+        assert backend.store.keys() == ["/statistics"]
+        assert len(backend.read_table("statistics")) == 1
+
+
+def test_store_writer_resumes(filename, make_timeseries):
+    with StoreWriter(filename) as writer:
+        writer.append_timeseries(1, make_timeseries("2019-01-01", 4, 1, **_TWICE_DAILY))
+        missing_dates = pd.DataFrame(
+            {
+                "missing_start_date_PV_localtime": [pd.Timestamp("2019-01-05")],
+                "missing_end_date_PV_localtime": [pd.Timestamp("2019-01-06")],
+                "datetime_of_API_request": [pd.Timestamp("2019-08-10")],
+            },
+            index=pd.Index([1], name="pv_system_id"),
+        )
+        writer.append_missing_dates(missing_dates)
+
+    assert get_system_ids_in_store(filename) == [1]
+    assert get_date_ranges_to_download(filename, 1, "2019-01-01", "2019-01-10") == [
+        DateRange("2019-01-03", "2019-01-04"),
+        DateRange("2019-01-07", "2019-01-10"),
+    ]
+    with StoreWriter(filename) as writer:
+        assert writer.get_date_ranges_to_download(1, "2019-01-01", "2019-01-10") == [
+            DateRange("2019-01-03", "2019-01-04"),
+            DateRange("2019-01-07", "2019-01-10"),
+        ]
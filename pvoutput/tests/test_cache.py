@@ -0,0 +1,75 @@
+import os
+import time
+from datetime import date
+
+from pvoutput import PVOutput, ResponseCache
+
+
+def test_is_cacheable(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    today = date(2019, 6, 10)
+    assert cache.is_cacheable("getstatus", {"d": "20190601", "h": 1}, today=today)
+    # Today and yesterday might still be changing.
+    assert not cache.is_cacheable("getstatus", {"d": "20190609", "h": 1}, today=today)
+    # Only historic getstatus queries are immutable.
+    assert not cache.is_cacheable("getstatus", {"d": "20190601", "h": 0}, today=today)
+    assert cache.is_cacheable("getbatchstatus", {"sid1": 1, "dt": "20190101"}, today=today)
+    # getbatchstatus without date_to gets the latest year.
+    assert not cache.is_cacheable("getbatchstatus", {"sid1": 1}, today=today)
+    assert cache.is_cacheable("getinsolation", {"d": "20190601", "sid1": 1}, today=today)
+    assert not cache.is_cacheable("getsystem", {"sid1": 1}, today=today)
+
+
+def test_put_and_get(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    params = {"sid1": 1, "dt": "20190101"}
+    assert cache.get("getbatchstatus", params) is None
+    cache.put("getbatchstatus", params, "Accepted 202")
+    assert cache.get("getbatchstatus", params) is None
+    cache.put("getbatchstatus", params, "20190101;07:35,2,24")
+    assert cache.get("getbatchstatus", params) == "20190101;07:35,2,24"
+    # Data service responses are cached separately.
+    assert cache.get("getbatchstatus", params, use_data_service=True) is None
+    assert cache.info()["hits"] == 1
+    assert cache.info()["misses"] == 3
+
+    # Streamed responses are cached once they've been read to the end.
+    params = {"sid1": 2, "dt": "20190101"}
+    chunks = cache.tee("getbatchstatus", params, iter(["20190101;07:35,", "2,24"]))
+    assert next(chunks) == "20190101;07:35,"
+    assert cache.get("getbatchstatus", params) is None
+    assert list(chunks) == ["2,24"]
+    assert cache.get("getbatchstatus", params) == "20190101;07:35,2,24"
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_size_bytes=10000)
+    text = os.urandom(3000).decode("latin1")  # Incompressible.
+    for day in range(1, 4):
+        cache.put("getstatus", {"d": "2019010{:d}".format(day), "h": 1}, text)
+        # Make sure each file has a different modification time.
+        time.sleep(0.01)
+    assert cache.get("getstatus", {"d": "20190101", "h": 1}) == text
+    time.sleep(0.01)
+    cache.put("getstatus", {"d": "20190104", "h": 1}, text)
+
+    assert cache.size_bytes <= 10000
+    assert cache.get("getstatus", {"d": "20190101", "h": 1}) == text
+    assert cache.get("getstatus", {"d": "20190102", "h": 1}) is None
+    assert cache.get("getstatus", {"d": "20190104", "h": 1}) == text
+
+
+def test_pvoutput_uses_cache(tmp_path, make_response):
+    num_requests = []
+
+    def _get_api_response(service, api_params):
+        num_requests.append(1)
+        return make_response("20190101,07:35,2,0.1,24,24,0.2,NaN,NaN,NaN,NaN")
+
+    pv = PVOutput(api_key="key", system_id="1", response_cache=ResponseCache(str(tmp_path)))
+    pv._get_api_response = _get_api_response
+    first = pv.get_status(123, "20190101")
+    second = pv.get_status(123, "20190101")
+    assert first.equals(second)
+    assert len(num_requests) == 1
+    assert pv.response_cache.info()["hits"] == 1
@@ -1,9 +1,16 @@
-from datetime import date
+import itertools
+import random
+from datetime import date, timedelta
 
 import pandas as pd
 
 from pvoutput import daterange
-from pvoutput.daterange import DateRange, merge_date_ranges_to_years
+from pvoutput.daterange import (
+    DateIntervalSet,
+    DateRange,
+    merge_date_ranges_to_minimum_years,
+    merge_date_ranges_to_years,
+)
 
 
 def test_get_date_range_list():
@@ -105,3 +112,103 @@ def test_merge_date_ranges_to_years():
         ),
     ]:
         assert merge_date_ranges_to_years(date_ranges) == merged
+
+
+def test_date_interval_set():
+    intervals = DateIntervalSet.from_date_ranges(
+        [DateRange("2019-01-05", "2019-01-10"), DateRange("2019-01-01", "2019-01-04")]
+    )
+    # Adjacent intervals are merged.
+    assert intervals.to_date_ranges() == [DateRange("2019-01-01", "2019-01-10")]
+    assert intervals.num_days() == 10
+
+    other = DateIntervalSet.from_dates(pd.date_range("2019-01-03", "2019-01-12", freq="12H"))
+    assert (intervals - other).to_date_ranges() == [DateRange("2019-01-01", "2019-01-02")]
+    assert (intervals & other).to_date_ranges() == [DateRange("2019-01-03", "2019-01-10")]
+    assert (intervals | other).to_date_ranges() == [DateRange("2019-01-01", "2019-01-12")]
+    assert (intervals - intervals) == DateIntervalSet()
+    assert (DateIntervalSet() | intervals) == intervals
+
+
+def test_date_interval_set_against_python_sets():
+    rng = random.Random(42)
+    first_date = date(2019, 1, 1)
+
+    def _random_days():
+        return set(rng.sample(range(60), rng.randint(0, 40)))
+
+    def _to_interval_set(days):
+        return DateIntervalSet.from_dates([first_date + timedelta(days=day) for day in days])
+
+    for _ in range(200):
+        a, b = _random_days(), _random_days()
+        interval_a, interval_b = _to_interval_set(a), _to_interval_set(b)
+        assert interval_a | interval_b == _to_interval_set(a | b)
+        assert interval_a & interval_b == _to_interval_set(a & b)
+        assert interval_a - interval_b == _to_interval_set(a - b)
+        assert (interval_a - interval_b).num_days() == len(a - b)
+
+
+def test_merge_date_ranges_to_minimum_years():
+    multiyear = DateRange("2017-01-01", "2018-02-01")
+    assert merge_date_ranges_to_minimum_years([multiyear]) == [
+        DateRange("2017-02-01", "2018-02-01"),
+        DateRange("2016-02-01", "2017-01-31"),
+    ]
+    assert merge_date_ranges_to_minimum_years([]) == []
+
+    # Two short date ranges less than a year apart need only one window.
+    date_ranges = [DateRange("2018-01-01", "2018-01-05"), DateRange("2018-06-01", "2018-06-05")]
+    assert merge_date_ranges_to_minimum_years(date_ranges) == [
+        DateRange("2017-06-05", "2018-06-05")
+    ]
+
+
+def test_merge_date_ranges_to_minimum_years_against_brute_force():
+    rng = random.Random(42)
+    first_date = date(2019, 1, 1)
+    days_per_window = 5
+
+    def _covered_days(windows):
+        return {
+            (window.start_date + timedelta(days=i) - first_date).days
+            for window in windows
+            for i in range(days_per_window)
+        }
+
+    for _ in range(200):
+        wanted_days = set(rng.sample(range(20), rng.randint(1, 10)))
+        date_ranges = DateIntervalSet.from_dates(
+            [first_date + timedelta(days=day) for day in wanted_days]
+        ).to_date_ranges()
+        windows = merge_date_ranges_to_minimum_years(date_ranges, days_per_window=days_per_window)
+        assert wanted_days <= _covered_days(windows)
+        assert [window.end_date for window in windows] == sorted(
+            (window.end_date for window in windows), reverse=True
+        )
+
+        # Find the fewest windows which cover wanted_days, by trying every
+        # combination of window end dates.
+        candidate_ends = range(max(wanted_days) + 1)
+        for num_windows in itertools.count(1):
+            combinations = itertools.combinations(candidate_ends, num_windows)
+            if any(
+                wanted_days <= {end - i for end in ends for i in range(days_per_window)}
+                for ends in combinations
+            ):
+                break
+        assert len(windows) == num_windows
+
+
+def test_merge_date_ranges_to_minimum_years_never_needs_more_windows():
+    rng = random.Random(42)
+    for _ in range(200):
+        date_ranges = []
+        end_date = date(2010, 1, 1)
+        for _ in range(rng.randint(1, 8)):
+            start_date = end_date + timedelta(days=rng.randint(2, 400))
+            end_date = start_date + timedelta(days=rng.randint(0, 600))
+            date_ranges.append(DateRange(start_date, end_date))
+        assert len(merge_date_ranges_to_minimum_years(date_ranges)) <= len(
+            merge_date_ranges_to_years(date_ranges)
+        )
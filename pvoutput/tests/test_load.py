@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pvoutput.load import iter_timeseries, load_timeseries
+from pvoutput.store import StoreWriter
+
+
+@pytest.fixture(
+    params=[
+        ("pv.hdf", None),
+        ("pv.parquet", None),
+        # Written by the downloader with `timezone` set.
+        ("pv.hdf", "Europe/London"),
+        ("pv.parquet", "Europe/London"),
+    ]
+)
+def store_filename(request, tmp_path):
+    filename, tz = request.param
+    if filename.endswith(".parquet"):
+        pytest.importorskip("pyarrow")
+    store_filename = str(tmp_path / filename)
+    with StoreWriter(store_filename) as writer:
+        for pv_system_id in [1, 2, 3]:
+            # Readings a couple of minutes after each slot.
+            index = pd.date_range("2019-08-09 10:02", periods=24, freq="5T", tz=tz, name="datetime")
+            timeseries = pd.DataFrame(
+                {
+                    "instantaneous_power_gen_W": np.arange(24.0) + pv_system_id * 100,
+                    "temperature_C": 5.0,
+                },
+                index=index,
+            )
+            writer.append_timeseries(pv_system_id, timeseries)
+    return store_filename
+
+
+def test_load_timeseries(store_filename):
+    power = load_timeseries(store_filename, start="2019-08-09 09:55", end="2019-08-09 11:00")
+    assert power.columns.tolist() == [1, 2, 3]
+    assert power.index[0] == pd.Timestamp("2019-08-09 09:55")
+    assert len(power) == 14
+    assert np.isnan(power.iloc[0]).all()
+    assert power.loc["2019-08-09 10:00"].tolist() == [100, 200, 300]
+    assert power.loc["2019-08-09 11:00"].tolist() == [112, 212, 312]
+    # Bounds are local time, even if they're tz-aware.
+    pd.testing.assert_frame_equal(
+        load_timeseries(
+            store_filename,
+            start=pd.Timestamp("2019-08-09 09:55", tz="UTC"),
+            end=pd.Timestamp("2019-08-09 11:00", tz="UTC"),
+        ),
+        power,
+    )
+
+    # Chunks of PV systems, read by worker processes, give the same result.
+    chunks = list(
+        iter_timeseries(
+            store_filename,
+            start="2019-08-09 09:55",
+            end="2019-08-09 11:00",
+            systems_per_chunk=2,
+            num_workers=2,
+        )
+    )
+    assert [chunk.columns.tolist() for chunk in chunks] == [[1, 2], [3]]
+    pd.testing.assert_frame_equal(pd.concat(chunks, axis=1), power)
+
+    both = load_timeseries(
+        store_filename,
+        system_ids=[3, 4],
+        start="2019-08-09 10:00",
+        end="2019-08-09 10:30",
+        columns=["instantaneous_power_gen_W", "temperature_C"],
+        dtype=np.float32,
+    )
+    assert both.columns.names == ["variable", "pv_system_id"]
+    assert both["temperature_C"][3].tolist() == [5.0] * 7
+    assert np.isnan(both["temperature_C"][4]).all()
+    assert both.dtypes.unique().tolist() == [np.float32]
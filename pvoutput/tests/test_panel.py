@@ -0,0 +1,58 @@
+import numpy as np
+
+from pvoutput.panel import PanelStore
+from pvoutput.store import StoreWriter
+
+
+def test_panel_store(tmp_path, make_timeseries):
+    store_filename = str(tmp_path / "pv.hdf")
+    panel_path = str(tmp_path / "panel")
+    with StoreWriter(store_filename) as writer:
+        for pv_system_id in [10, 20, 30]:
+            writer.append_timeseries(
+                pv_system_id, make_timeseries("2019-01-01 10:00", 288, pv_system_id)
+            )
+
+    panel = PanelStore(panel_path, origin="2019-01-01", time_chunk_size=288, system_chunk_size=2)
+    assert panel.update(store_filename) == 3
+    # Nothing new to copy.
+    assert panel.update(store_filename) == 0
+
+    # One time slot of every PV system, one chunk per two PV systems.
+    num_chunks_read = panel.num_chunks_read
+    power = panel.read("instantaneous_power_gen_W", "2019-01-01 10:00", "2019-01-01 10:00")
+    assert power.values.tolist() == [[10, 20, 30]]
+    assert panel.num_chunks_read - num_chunks_read == 2
+
+    # Reads span chunks, and PV systems which aren't in the panel are NaN.
+    power = panel.read(
+        "instantaneous_power_gen_W", "2019-01-01 09:55", "2019-01-02 10:00", system_ids=[30, 40]
+    )
+    assert len(power) == 290
+    assert power.columns.tolist() == [30, 40]
+    assert np.isnan(power.iloc[0]).all()
+    assert (power[30].iloc[1:-1] == 30).all()
+    assert np.isnan(power[30].iloc[-1])
+    assert np.isnan(power[40]).all()
+
+    # Only the new days are copied, and the panel can be re-opened.
+    with StoreWriter(store_filename) as writer:
+        writer.append_timeseries(20, make_timeseries("2019-01-03 10:00", 12, 21))
+    panel = PanelStore(panel_path)
+    assert panel.update(store_filename) == 1
+    power = PanelStore(panel_path).read("instantaneous_power_gen_W", "2019-01-03", "2019-01-04")
+    assert power[20].sum() == 12 * 21
+    assert np.isnan(power[10]).all()
+    assert panel.chunk("instantaneous_power_gen_W", 2, 0).shape == (288, 2)
+
+
+def test_panel_store_in_local_time(tmp_path, make_timeseries):
+    store_filename = str(tmp_path / "pv.hdf")
+    with StoreWriter(store_filename) as writer:
+        writer.append_timeseries(10, make_timeseries("2019-08-09", 288, 1, tz="Europe/London"))
+
+    panel = PanelStore(str(tmp_path / "panel"), origin="2019-08-09", time_chunk_size=288)
+    assert panel.update(store_filename) == 1
+    power = panel.read("instantaneous_power_gen_W", "2019-08-09 00:00", "2019-08-09 23:55")
+    assert len(power) == 288
+    assert (power[10] == 1).all()
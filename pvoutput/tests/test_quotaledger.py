@@ -0,0 +1,69 @@
+import os
+
+from pvoutput.pvoutput import PVOutput
+from pvoutput.quotaledger import QuotaLedger
+from pvoutput.ratelimit import API, DATA_SERVICE, RateLimiter
+
+API_KEY = "abc123"
+
+
+def test_processes_share_quota(tmp_path, clock):
+    filename = os.path.join(tmp_path, "quota.sqlite")
+    # Two ledgers on the same file behave like two processes.
+    ledger1 = QuotaLedger(filename, clock=clock)
+    ledger2 = QuotaLedger(filename, clock=clock)
+
+    # Unknown quota: don't wait.
+    assert ledger1.reserve(API_KEY, API) == 0
+
+    ledger1.update(API_KEY, API, remaining=3, total=60, reset_time=clock.now + 100)
+    assert ledger1.reserve(API_KEY, API) == 0
+    assert ledger2.reserve(API_KEY, API) == 0
+    assert ledger2.reserve(API_KEY, API) == 0
+    assert ledger1.reserve(API_KEY, API) == 101
+
+    # The data service quota is separate.
+    assert ledger1.reserve(API_KEY, DATA_SERVICE) == 0
+
+    # After the reset time, the full quota is available again.
+    clock.now += 101
+    assert ledger2.reserve(API_KEY, API) == 0
+    quota = ledger2.to_dataframe()
+    assert len(quota) == 1
+    assert quota.iloc[0]["remaining"] == 59
+
+
+def test_update_keeps_lowest_remaining(tmp_path, clock):
+    filename = os.path.join(tmp_path, "quota.sqlite")
+    ledger = QuotaLedger(filename, clock=clock)
+    reset_time = clock.now + 100
+    ledger.update(API_KEY, API, remaining=10, total=60, reset_time=reset_time)
+    for _ in range(5):
+        ledger.reserve(API_KEY, API)
+
+    # A response which was sent before the last 5 reservations.
+    ledger.update_from_headers(
+        API_KEY,
+        API,
+        {
+            "X-Rate-Limit-Remaining": "9",
+            "X-Rate-Limit-Limit": "60",
+            "X-Rate-Limit-Reset": str(int(reset_time)),
+        },
+    )
+    assert ledger.to_dataframe().iloc[0]["remaining"] == 5
+
+    # A response from the next rate limit period.
+    ledger.update(API_KEY, API, remaining=59, total=60, reset_time=reset_time + 3600)
+    assert ledger.to_dataframe().iloc[0]["remaining"] == 59
+
+
+def test_ledger_refusal_doesnt_spend_rate_limiter_tokens(tmp_path, clock):
+    ledger = QuotaLedger(os.path.join(tmp_path, "quota.sqlite"), clock=clock)
+    ledger.update(API_KEY, API, remaining=0, total=60, reset_time=clock.now + 3600)
+    rate_limiter = RateLimiter(clock=clock)
+    rate_limiter.update(API, remaining=50, total=60, reset_time=clock.now + 3600)
+    pv = PVOutput(api_key=API_KEY, system_id="1", rate_limiter=rate_limiter, quota_ledger=ledger)
+    for _ in range(3):
+        assert pv._reserve_request(API) > 0
+    assert rate_limiter.budget().loc[API, "remaining"] == 50
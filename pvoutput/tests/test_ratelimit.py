@@ -0,0 +1,63 @@
+from pvoutput.ratelimit import API, DATA_SERVICE, RateLimiter
+
+
+def test_unknown_quota_does_not_wait(clock):
+    rate_limiter = RateLimiter(clock=clock, sleep=clock.sleep)
+    assert rate_limiter.acquire(API) == 0
+    assert rate_limiter.budget().empty
+
+
+def test_burst_then_pace(clock):
+    rate_limiter = RateLimiter(headroom=0, burst=2, clock=clock, sleep=clock.sleep)
+    rate_limiter.update(API, remaining=60, total=60, reset_time=clock.now + 3600)
+    assert rate_limiter.acquire(API) == 0
+    assert rate_limiter.acquire(API) == 0
+    # The bucket is empty, so now we pace at one request per ~minute.
+    secs_waited = rate_limiter.acquire(API)
+    assert 55 < secs_waited < 65
+    assert rate_limiter.budget().loc[API, "remaining"] == 57
+
+
+def test_never_exceeds_quota(clock):
+    rate_limiter = RateLimiter(headroom=1, burst=10, clock=clock, sleep=clock.sleep)
+    reset_time = clock.now + 60
+    rate_limiter.update(API, remaining=3, total=60, reset_time=reset_time)
+    for _ in range(2):
+        rate_limiter.acquire(API)
+    assert clock.now < reset_time
+    # Only the headroom is left, so wait for the reset.
+    rate_limiter.acquire(API)
+    assert clock.now >= reset_time
+    assert rate_limiter.budget().loc[API, "remaining"] == 59
+
+
+def test_buckets_are_separate(clock):
+    rate_limiter = RateLimiter(headroom=0, clock=clock, sleep=clock.sleep)
+    rate_limiter.update(API, remaining=0, total=60, reset_time=clock.now + 600)
+    rate_limiter.update_from_headers(
+        DATA_SERVICE,
+        {
+            "X-Rate-Limit-Remaining": "900",
+            "X-Rate-Limit-Limit": "900",
+            "X-Rate-Limit-Reset": str(int(clock.now + 600)),
+        },
+    )
+    assert rate_limiter.reserve(API) > 0
+    assert rate_limiter.reserve(DATA_SERVICE) == 0
+    budget = rate_limiter.budget()
+    assert set(budget.index) == {API, DATA_SERVICE}
+    assert budget.loc[DATA_SERVICE, "remaining"] == 899
+
+
+def test_late_responses_dont_raise_remaining(clock):
+    rate_limiter = RateLimiter(headroom=0, clock=clock, sleep=clock.sleep)
+    reset_time = clock.now + 3600
+    rate_limiter.update(API, remaining=50, total=60, reset_time=reset_time)
+    for _ in range(3):
+        rate_limiter.acquire(API)
+    # The response to the first of the three requests arrives last.
+    rate_limiter.update(API, remaining=49, total=60, reset_time=reset_time)
+    assert rate_limiter.budget().loc[API, "remaining"] == 47
+    # A new quota period replaces the count.
+    rate_limiter.update(API, remaining=59, total=60, reset_time=reset_time + 3600)
+    assert rate_limiter.budget().loc[API, "remaining"] == 59
@@ -0,0 +1,54 @@
+import pandas as pd
+import pytest
+
+from pvoutput.backends import HDFBackend
+from pvoutput.catalog import read_catalog
+from pvoutput.coverage import read_coverage
+from pvoutput.daterange import DateRange
+from pvoutput.repack import repack_store
+from pvoutput.store import StoreWriter
+
+
+@pytest.mark.parametrize("num_workers", [None, 2])
+def test_repack_store(tmp_path, num_workers, make_timeseries):
+    source_filename = str(tmp_path / "pv.hdf")
+    output_filename = str(tmp_path / "repacked.hdf")
+    with pd.HDFStore(source_filename, mode="w") as store:
+        # Written by an old version: unsorted, with a duplicate row.
+        store.append("/timeseries/1", make_timeseries("2019-01-02", 3, 1), data_columns=True)
+        store.append("/timeseries/1", make_timeseries("2019-01-01", 2, 1), data_columns=True)
+        store.append("/timeseries/1", make_timeseries("2019-01-02", 1, 2), data_columns=True)
+    with StoreWriter(source_filename) as writer:
+        writer.append_timeseries(2, make_timeseries("2019-01-01", 10, 3))
+        for _ in range(2):
+            writer.append_missing_dates(
+                pd.DataFrame(
+                    {
+                        "missing_start_date_PV_localtime": [pd.Timestamp("2019-01-03")],
+                        "missing_end_date_PV_localtime": [pd.Timestamp("2019-01-04")],
+                        "datetime_of_API_request": [pd.Timestamp("2019-08-10")],
+                    },
+                    index=pd.Index([2], name="pv_system_id"),
+                )
+            )
+            writer.flush()
+
+    result = repack_store(source_filename, output_filename, num_workers=num_workers)
+    assert result["num_systems"] == 2
+    assert result["num_rows_before"] - result["num_rows_after"] == 1
+    with pytest.raises(FileExistsError):
+        repack_store(source_filename, output_filename)
+
+    with HDFBackend(output_filename, mode="r") as backend:
+        timeseries = backend.read_timeseries(1)
+        assert timeseries.index.is_monotonic_increasing
+        assert len(timeseries) == 5
+        # The first of the duplicate rows is kept.
+        assert timeseries.loc["2019-01-02 00:00", "instantaneous_power_gen_W"] == 1
+        assert backend.store.get_storer("/timeseries/1").table.colindexes["index"].is_csi
+        assert len(backend.read_table("missing_dates")) == 1
+        coverage = read_coverage(backend)
+        assert coverage[2].missing.to_date_ranges() == [DateRange("2019-01-03", "2019-01-04")]
+        catalog = read_catalog(backend)
+        assert catalog["num_rows"].to_dict() == {1: 5, 2: 10}
+        assert backend.system_ids() == [1, 2]
@@ -0,0 +1,53 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from pvoutput.exceptions import RateLimitExceeded
+from pvoutput.simulator import PVOutputSimulator
+from pvoutput.transport import RecordingTransport, ReplayTransport
+
+
+def test_download_from_simulator_then_replay(tmp_path):
+    recordings_dir = str(tmp_path / "recordings")
+    kwargs = dict(
+        system_ids=[1, 2],
+        start_date=date(2016, 1, 1),
+        end_date=date(2016, 3, 31),
+        num_workers=2,
+    )
+
+    with PVOutputSimulator(system_ids=[1, 2], batch_polls_until_ready=0) as simulator:
+        pv = simulator.make_client()
+        pv.transport = RecordingTransport(pv.transport, recordings_dir)
+        pv.download_multiple_systems_to_disk(output_filename=str(tmp_path / "live.hdf"), **kwargs)
+        assert simulator.num_requests["getbatchstatus"] == 2
+        assert pv.rate_limit_remaining == simulator.quotas["data_service"] - 2
+
+    # The simulator has stopped, so every response must come from the recordings.
+    pv.transport = ReplayTransport(recordings_dir)
+    pv.download_multiple_systems_to_disk(output_filename=str(tmp_path / "replay.hdf"), **kwargs)
+
+    with pd.HDFStore(str(tmp_path / "live.hdf"), mode="r") as live, pd.HDFStore(
+        str(tmp_path / "replay.hdf"), mode="r"
+    ) as replay:
+        for pv_system_id in [1, 2]:
+            key = "/timeseries/{:d}".format(pv_system_id)
+            assert len(live[key]) > 0
+            pd.testing.assert_frame_equal(
+                live[key].drop(columns="datetime_of_API_request"),
+                replay[key].drop(columns="datetime_of_API_request"),
+            )
+
+    with pytest.raises(KeyError):
+        pv.get_status(1, date=date(2016, 6, 1))
+
+
+def test_simulator_enforces_quota():
+    with PVOutputSimulator(system_ids=[1], quota=2) as simulator:
+        pv = simulator.make_client(max_retries=0)
+        pv.get_metadata(1)
+        pv.get_metadata(1)
+        assert pv.rate_limit_remaining == 0
+        with pytest.raises(RateLimitExceeded):
+            pv.get_metadata(1)
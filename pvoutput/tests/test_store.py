@@ -0,0 +1,181 @@
+import pandas as pd
+
+from pvoutput.backends import HDFBackend
+from pvoutput.catalog import SYSTEMS_KEY
+from pvoutput.coverage import COVERAGE_KEY, read_coverage
+from pvoutput.daterange import DateRange
+from pvoutput.pvoutput import _process_statistic
+from pvoutput.store import StoreWriter
+from pvoutput.utils import get_system_catalog, get_system_ids_in_store
+
+
+def test_store_writer_batches_appends(tmp_path, clock, make_timeseries):
+    output_filename = str(tmp_path / "pv.hdf")
+    writer = StoreWriter(
+        output_filename, max_buffered_rows=10, max_secs_between_flushes=60, clock=clock
+    )
+
+    # Nothing reaches the disk until the buffer is full...
+    for day in range(1, 4):
+        writer.append_timeseries(1, make_timeseries("2019-01-0{:d}".format(day)))
+    assert writer.num_flushes == 0
+    assert writer.num_buffered_rows == 9
+    writer.append_timeseries(2, make_timeseries("2019-01-01"))
+    assert writer.num_flushes == 1
+    assert writer.num_buffered_rows == 0
+
+    # ...or until max_secs_between_flushes have passed.
+    writer.append_timeseries(2, make_timeseries("2019-01-02"))
+    assert writer.num_flushes == 1
+    clock.now += 60
+    writer.append_timeseries(2, make_timeseries("2019-01-03"))
+    assert writer.num_flushes == 2
+
+    # Other code can read the store while the writer is paused.
+    writer.append_timeseries(1, make_timeseries("2019-01-04"))
+    with writer.paused():
+        assert len(pd.read_hdf(output_filename, "/timeseries/1")) == 9
+    writer.close()
+
+    with pd.HDFStore(output_filename, mode="r") as store:
+        assert len(store["/timeseries/1"]) == 12
+        assert len(store["/timeseries/2"]) == 9
+
+
+def test_store_writer_maintains_coverage(tmp_path, make_timeseries):
+    output_filename = str(tmp_path / "pv.hdf")
+    missing_dates = pd.DataFrame(
+        {
+            "missing_start_date_PV_localtime": [pd.Timestamp("2019-01-05")],
+            "missing_end_date_PV_localtime": [pd.Timestamp("2019-01-06")],
+        },
+        index=pd.Index([1], name="pv_system_id"),
+    )
+    with StoreWriter(output_filename) as writer:
+        writer.append_timeseries(1, make_timeseries("2019-01-02"))
+        writer.append_missing_dates(missing_dates)
+        # Buffered rows count, even before they're flushed.
+        assert writer.get_date_ranges_to_download(1, "2019-01-01", "2019-01-08") == [
+            DateRange("2019-01-01", "2019-01-01"),
+            DateRange("2019-01-03", "2019-01-04"),
+            DateRange("2019-01-07", "2019-01-08"),
+        ]
+        writer.append_timeseries(1, make_timeseries("2019-01-03"))
+
+    with pd.HDFStore(output_filename, mode="r") as store:
+        coverage = read_coverage(HDFBackend(store))
+    assert coverage[1].downloaded.to_date_ranges() == [DateRange("2019-01-02", "2019-01-03")]
+    assert coverage[1].missing.to_date_ranges() == [DateRange("2019-01-05", "2019-01-06")]
+
+
+def test_store_writer_merges_coverage_rows(tmp_path, make_timeseries):
+    output_filename = str(tmp_path / "pv.hdf")
+    for start in ["2019-01-01", "2019-03-01", "2019-05-01"]:
+        with StoreWriter(output_filename) as writer:
+            # One append per day, like getstatus.
+            for date in pd.date_range(start, periods=20, freq="D"):
+                writer.append_timeseries(1, make_timeseries(date))
+            writer.flush()
+            writer.append_timeseries(1, make_timeseries(pd.Timestamp(start) + pd.Timedelta("20D")))
+
+    # One row per interval of days.
+    assert len(pd.read_hdf(output_filename, COVERAGE_KEY)) == 3
+
+
+def test_store_writer_builds_coverage_for_old_stores(tmp_path, make_timeseries):
+    output_filename = str(tmp_path / "pv.hdf")
+    with pd.HDFStore(output_filename, mode="w") as store:
+        store.append("/timeseries/1", make_timeseries("2019-01-02"), data_columns=True)
+        assert COVERAGE_KEY not in store
+
+    with StoreWriter(output_filename) as writer:
+        writer.append_timeseries(2, make_timeseries("2019-01-03"))
+
+    with pd.HDFStore(output_filename, mode="r") as store:
+        coverage = read_coverage(HDFBackend(store))
+    assert coverage[1].downloaded.to_date_ranges() == [DateRange("2019-01-02", "2019-01-02")]
+    assert coverage[2].downloaded.to_date_ranges() == [DateRange("2019-01-03", "2019-01-03")]
+
+
+def test_store_writer_maintains_catalog(tmp_path, make_timeseries):
+    output_filename = str(tmp_path / "pv.hdf")
+    with pd.HDFStore(output_filename, mode="w") as store:
+        store.append("/timeseries/1", make_timeseries("2019-01-02"), data_columns=True)
+
+    # The catalog of an old store is built by scanning it.
+    with StoreWriter(output_filename) as writer:
+        assert writer.catalog["num_rows"].to_dict() == {1: 3}
+        writer.append_timeseries(2, make_timeseries("2019-01-03"))
+        writer.flush()
+        writer.append_timeseries(2, make_timeseries("2019-01-01", periods=2))
+
+    catalog = get_system_catalog(output_filename)
+    assert catalog.index.tolist() == [1, 2]
+    assert catalog.loc[2, "first_datetime"] == pd.Timestamp("2019-01-01 00:00")
+    assert catalog.loc[2, "last_datetime"] == pd.Timestamp("2019-01-03 00:10")
+    assert catalog.loc[2, "num_rows"] == 5
+    assert (catalog["num_bytes"] > 0).all()
+    assert pd.isnull(catalog.loc[1, "last_downloaded"])
+    assert not pd.isnull(catalog.loc[2, "last_downloaded"])
+    # Superseded rows are removed when the writer is closed.
+    assert len(pd.read_hdf(output_filename, SYSTEMS_KEY)) == 2
+
+    # PV systems are listed from the catalog, not from the timeseries tables.
+    with pd.HDFStore(output_filename, mode="a") as store:
+        store.remove("/timeseries/1")
+    assert get_system_ids_in_store(output_filename) == [1, 2]
+
+
+def test_store_writer_skips_known_missing_dates(tmp_path):
+    output_filename = str(tmp_path / "pv.hdf")
+
+    def _make_missing_dates(start, end):
+        return pd.DataFrame(
+            {
+                "missing_start_date_PV_localtime": [pd.Timestamp(start)],
+                "missing_end_date_PV_localtime": [pd.Timestamp(end)],
+            },
+            index=pd.Index([1], name="pv_system_id"),
+        )
+
+    with StoreWriter(output_filename) as writer:
+        writer.get_date_ranges_to_download(1, "2019-01-01", "2019-01-31")
+        writer.append_missing_dates(_make_missing_dates("2019-01-01", "2019-01-10"))
+        writer.append_missing_dates(_make_missing_dates("2019-01-02", "2019-01-03"))
+        writer.append_missing_dates(_make_missing_dates("2019-01-11", "2019-01-12"))
+
+    # The second range was already known.  The third is merged with the first.
+    missing_dates = pd.read_hdf(output_filename, "missing_dates")
+    assert len(missing_dates) == 1
+    assert missing_dates["missing_end_date_PV_localtime"].iloc[0] == pd.Timestamp("2019-01-12")
+
+
+def test_store_writer_caches_statistics(tmp_path):
+    output_filename = str(tmp_path / "pv.hdf")
+
+    def _make_stats(pv_system_id, date_to):
+        return _process_statistic(
+            "100,0,10,1,20,1.0,3,20190101,20190103,1.0,20190102", pv_system_id, None, date_to
+        )
+
+    with StoreWriter(output_filename) as writer:
+        assert writer.get_statistic(1) is None
+        writer.put_statistic(1, _make_stats(1, "2019-06-01"))
+        writer.put_statistic(2, _make_stats(2, "2019-06-01"))
+        assert writer.get_statistic(1, date_to="2019-05-01") is not None
+        # Stats are stale if they were fetched before date_to.
+        assert writer.get_statistic(1, date_to="2019-07-01") is None
+    assert len(pd.read_hdf(output_filename, "statistics")) == 2
+
+    with StoreWriter(output_filename) as writer:
+        assert writer.get_statistic(2, date_to="2019-05-01") is not None
+        writer.put_statistic(2, _make_stats(2, "2019-08-01"))
+        writer.flush()
+        # Refreshed stats are appended, so the table has a superseded row...
+        assert len(writer.store["statistics"]) == 3
+        assert writer.get_statistic(2, date_to="2019-07-01") is not None
+
+    # ...which is removed when the writer is closed.
+    statistics = pd.read_hdf(output_filename, "statistics")
+    assert statistics.index.tolist() == [1, 2]
+    assert statistics.loc[2, "query_date_to"] == pd.Timestamp("2019-08-01")
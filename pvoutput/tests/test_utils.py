@@ -1,12 +1,15 @@
 import inspect
 import os
+import threading
 from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import numpy as np
 import pandas as pd
 
-from pvoutput import utils
+from pvoutput import hdf, utils
 from pvoutput.daterange import DateRange
+from pvoutput.store import StoreWriter
 
 
 def data_dir():
@@ -52,3 +55,157 @@ def test_datetime_list_to_dates():
         utils.datetime_list_to_dates([pd.Timestamp("2019-01-01"), pd.Timestamp("2019-01-02")]),
         [date(2019, 1, 1), date(2019, 1, 2)],
     )
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"OK"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_session_reuses_connections():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = "http://127.0.0.1:{}/service/r2/getstatus.jsp".format(server.server_port)
+        session = utils._get_session_with_retry(pool_maxsize=2)
+        for _ in range(5):
+            utils._get_response(url, {"sid1": 1}, {}, session=session)
+        stats = utils.get_connection_pool_stats(session)
+        session.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert len(stats) == 1
+    assert stats["num_requests"].sum() == 5
+    assert stats["num_reused"].sum() == 4
+
+
+def test_connection_pool_stats_drop_discarded_connections():
+    session = utils._get_session_with_retry(pool_maxsize=1)
+    url = "http://127.0.0.1:1/"
+    pool = session.get_adapter(url).poolmanager.connection_from_url(url)
+    connections = [pool._get_conn(), pool._get_conn()]
+    assert len(utils.get_connection_pool_stats(session)) == 2
+    # The pool only keeps one connection, so it discards the other.
+    for connection in connections:
+        pool._put_conn(connection)
+    del connections, connection
+    stats = utils.get_connection_pool_stats(session)
+    assert stats["connection_number"].tolist() == [0]
+    session.close()
+
+
+def test_append_and_merge_pv_system(tmp_path, make_timeseries):
+    with pd.HDFStore(str(tmp_path / "pv.hdf"), mode="a") as store:
+        assert (
+            hdf.append_and_merge_pv_system(
+                store, 1, make_timeseries("2019-01-01", 6, 1, tz="Europe/London")
+            )
+            == 0
+        )
+        # New data after the existing data is appended without re-writing anything.
+        assert (
+            hdf.append_and_merge_pv_system(
+                store, 1, make_timeseries("2019-01-02", 6, 2, tz="Europe/London")
+            )
+            == 0
+        )
+        # Overlapping data only re-writes the overlap.
+        new = make_timeseries("2019-01-01 00:15", 6, 3, tz="Europe/London")
+        assert hdf.append_and_merge_pv_system(store, 1, new) == 9
+        timeseries = store["/timeseries/1"]
+
+    assert timeseries.index.is_monotonic_increasing
+    assert timeseries.index.is_unique
+    assert len(timeseries) == 15
+    # Existing rows are kept in preference to new rows.
+    assert timeseries["instantaneous_power_gen_W"].tolist() == [1] * 6 + [3] * 3 + [2] * 6
+
+
+def test_get_date_ranges_to_download_from_new_store(tmp_path):
+    output_filename = str(tmp_path / "pv.hdf")
+    index = pd.date_range("2019-01-03 12:00", "2019-01-05 12:00", freq="D", name="datetime")
+    timeseries = pd.DataFrame(
+        {"instantaneous_power_gen_W": 1.0, "query_date": pd.Timestamp("2019-01-08")}, index=index
+    )
+    missing_dates = pd.DataFrame(
+        {
+            "missing_start_date_PV_localtime": [pd.Timestamp("2019-01-10")],
+            "missing_end_date_PV_localtime": [pd.Timestamp("2019-01-11")],
+            "datetime_of_API_request": [pd.Timestamp("2019-02-01")],
+        },
+        index=pd.Index([PV_SYSTEM], name="pv_system_id"),
+    )
+    with StoreWriter(output_filename) as writer:
+        writer.append_timeseries(PV_SYSTEM, timeseries)
+        writer.append_missing_dates(missing_dates)
+
+    date_ranges = utils.get_date_ranges_to_download(
+        output_filename, PV_SYSTEM, "2019-01-01", "2019-01-15"
+    )
+    # 2019-01-03 to 05 have data, 2019-01-08 was requested, and 2019-01-10 to 11 are missing.
+    assert date_ranges == [
+        DateRange("2019-01-01", "2019-01-02"),
+        DateRange("2019-01-06", "2019-01-07"),
+        DateRange("2019-01-09", "2019-01-09"),
+        DateRange("2019-01-12", "2019-01-15"),
+    ]
+
+    # A system which isn't in the store needs the whole range.
+    assert utils.get_date_ranges_to_download(output_filename, 999, "2019-01-01", "2019-01-15") == [
+        DateRange("2019-01-01", "2019-01-15")
+    ]
+
+
+def _make_missing_dates(rows):
+    return pd.DataFrame(
+        {
+            "missing_start_date_PV_localtime": [pd.Timestamp(row[1]) for row in rows],
+            "missing_end_date_PV_localtime": [pd.Timestamp(row[2]) for row in rows],
+            "datetime_of_API_request": [pd.Timestamp(row[3]) for row in rows],
+        },
+        index=pd.Index([row[0] for row in rows], name="pv_system_id"),
+    )
+
+
+def test_compact_missing_dates(tmp_path):
+    missing_dates = _make_missing_dates(
+        [
+            (2, "2019-01-01", "2019-01-03", "2020-01-01"),
+            (1, "2019-01-05", "2019-01-06", "2020-01-02"),
+            (1, "2019-01-01", "2019-01-04", "2020-01-01"),
+            # Duplicate.
+            (1, "2019-01-01", "2019-01-04", "2020-01-03"),
+            # Suspect rows are only merged with each other.
+            (1, "2019-01-10", "2019-01-10", None),
+            (1, "2019-01-09", "2019-01-11", None),
+            (1, "2019-01-20", "2019-01-21", "2020-01-01"),
+        ]
+    )
+    expected = _make_missing_dates(
+        [
+            (1, "2019-01-01", "2019-01-06", "2020-01-03"),
+            (1, "2019-01-09", "2019-01-11", None),
+            (1, "2019-01-20", "2019-01-21", "2020-01-01"),
+            (2, "2019-01-01", "2019-01-03", "2020-01-01"),
+        ]
+    )
+    pd.testing.assert_frame_equal(hdf.merge_missing_date_ranges(missing_dates), expected)
+
+    with pd.HDFStore(str(tmp_path / "pv.hdf"), mode="w") as store:
+        store.append("missing_dates", missing_dates, data_columns=True)
+        assert hdf.compact_missing_dates(store) == (7, 4)
+        pd.testing.assert_frame_equal(store["missing_dates"], expected)
+        assert store.get_storer("missing_dates").table.cols.index.index.is_csi
+        assert store.keys() == ["/missing_dates"]
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from io import BytesIO
+from typing import Dict, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+_LOG = logging.getLogger("pvoutput")
+
+# Query params which identify the account.  They're left out of recordings.
+_SECRET_PARAMS = {"key", "sid"}
+
+
+class Transport(ABC):
+    """Sends HTTP GET requests for PVOutput.
+
+    PVOutput sends every API request through its `transport`, so requests
+    can be recorded, replayed, or sent to a local server instead of to
+    PVOutput.org.
+    """
+
+    @abstractmethod
+    def get(self, url: str, headers: Dict, stream: bool = False) -> requests.Response:
+        pass
+
+
+class RequestsTransport(Transport):
+    """Sends requests using a `requests.Session`.
+
+    Args:
+        session: The session to send requests with.
+        base_url: Optional.  If set, then every request is sent to this
+            scheme and host (e.g. 'http://localhost:8080') instead of to
+            the host in the request's URL.  Used to send requests to
+            `simulator.PVOutputSimulator`.
+    """
+
+    def __init__(self, session: requests.Session, base_url: Optional[str] = None):
+        self.session = session
+        self.base_url = base_url
+
+    def get(self, url: str, headers: Dict, stream: bool = False) -> requests.Response:
+        if self.base_url is not None:
+            base_url = urlsplit(self.base_url)
+            url = urlunsplit(urlsplit(url)._replace(scheme=base_url.scheme, netloc=base_url.netloc))
+        return self.session.get(url, headers=headers, stream=stream)
+
+
+class RecordingTransport(Transport):
+    """Sends requests using another transport, and records each response.
+
+    Each response is saved as a JSON file in `directory`, so the requests
+    can be replayed later by `ReplayTransport`.  API keys and system IDs
+    are not saved.
+    """
+
+    def __init__(self, transport: Transport, directory: str):
+        self.transport = transport
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._num_recorded = defaultdict(int)
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, url: str, headers: Dict, stream: bool = False) -> requests.Response:
+        response = self.transport.get(url, headers=headers, stream=False)
+        key = _recording_key(url)
+        with self._lock:
+            if key not in self._num_recorded:
+                self._num_recorded[key] = _num_recordings(self.directory, key)
+            filename = _recording_filename(self.directory, key, self._num_recorded[key])
+            self._num_recorded[key] += 1
+        recording = {
+            "url": _redact_url(url),
+            "status_code": response.status_code,
+            "headers": dict(response.headers),
+            "content": response.content.decode("latin1"),
+        }
+        with open(filename, "w") as fh:
+            json.dump(recording, fh)
+        return response
+
+
+class ReplayTransport(Transport):
+    """Replays responses recorded by `RecordingTransport`.
+
+    If the same URL was requested several times while recording (e.g. while
+    waiting for getbatchstatus), then the recorded responses are replayed in
+    order, and the last response is repeated once they run out.
+
+    Raises:
+        KeyError: If a request wasn't recorded.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._num_replayed = defaultdict(int)
+
+    def get(self, url: str, headers: Dict, stream: bool = False) -> requests.Response:
+        key = _recording_key(url)
+        with self._lock:
+            num_recordings = _num_recordings(self.directory, key)
+            if num_recordings == 0:
+                raise KeyError("No recording for {}".format(_redact_url(url)))
+            i = min(self._num_replayed[key], num_recordings - 1)
+            self._num_replayed[key] += 1
+        with open(_recording_filename(self.directory, key, i)) as fh:
+            recording = json.load(fh)
+        return _make_response(url, recording)
+
+
+def _make_response(url: str, recording: Dict) -> requests.Response:
+    response = requests.Response()
+    response.url = url
+    response.status_code = recording["status_code"]
+    response.headers = CaseInsensitiveDict(recording["headers"])
+    response.raw = BytesIO(recording["content"].encode("latin1"))
+    return response
+
+
+def _redact_url(url: str) -> str:
+    split_url = urlsplit(url)
+    params = [(k, v) for k, v in parse_qsl(split_url.query) if k not in _SECRET_PARAMS]
+    return urlunsplit(split_url._replace(query=urlencode(sorted(params))))
+
+
+def _recording_key(url: str) -> str:
+    return hashlib.sha256(_redact_url(url).encode("utf-8")).hexdigest()
+
+
+def _recording_filename(directory: str, key: str, i: int) -> str:
+    return os.path.join(directory, "{}_{:d}.json".format(key, i))
+
+
+def _num_recordings(directory: str, key: str) -> int:
+    i = 0
+    while os.path.exists(_recording_filename(directory, key, i)):
+        i += 1
+    return i
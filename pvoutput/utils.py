@@ -1,20 +1,40 @@
 import logging
 import os
 import sys
-import warnings
+import threading
+import weakref
 from datetime import date, datetime
-from typing import Dict, Iterable, List, Union
+from typing import Dict, Iterable, List, Optional, Union
 
 import numpy as np
 import pandas as pd
 import requests
-import tables
 import yaml
 from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 from urllib3.util.retry import Retry
 
+from pvoutput.backends import open_backend
+from pvoutput.catalog import SYSTEMS_KEY, build_catalog, read_catalog
 from pvoutput.consts import CONFIG_FILENAME
-from pvoutput.daterange import DateRange, get_date_range_list
+from pvoutput.coverage import (
+    COVERAGE_KEY,
+    SystemCoverage,
+    missing_dates_coverage,
+    read_coverage,
+    read_timeseries_coverage,
+)
+from pvoutput.daterange import DateIntervalSet, DateRange
+
+# sort_and_de_dupe_pv_system and system_id_to_hdf_key are re-exported, for
+# code written when they lived here.
+from pvoutput.hdf import (
+    MISSING_DATES_KEY,
+    MISSING_END,
+    MISSING_START,
+    sort_and_de_dupe_pv_system,
+    system_id_to_hdf_key,
+)
 
 _LOG = logging.getLogger("pvoutput")
 
@@ -52,7 +72,63 @@ def get_logger(filename=None, mode="a", level=logging.DEBUG, stream_handler=Fals
     return logger
 
 
-def _get_session_with_retry() -> requests.Session:
+class _ConnectionStatsMixin:
+    """Records how many requests each pooled connection has served.
+
+    Every new connection means a new TCP (and TLS) handshake, so comparing
+    the number of connections against the number of requests tells us
+    whether keep-alive is working.  The stats of a connection are dropped
+    when the pool discards it (and it's garbage collected), so
+    `connection_stats` only holds the connections which are still open.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Maps connection number to stats.
+        self.connection_stats = {}
+        self._num_connections = 0
+        self._connection_stats_lock = threading.Lock()
+
+    def _new_conn(self):
+        conn = super()._new_conn()
+        conn._pvoutput_stats = {"num_requests": 0}
+        with self._connection_stats_lock:
+            connection_number = self._num_connections
+            self._num_connections += 1
+            self.connection_stats[connection_number] = conn._pvoutput_stats
+        weakref.finalize(conn, self._drop_connection_stats, connection_number)
+        return conn
+
+    def _drop_connection_stats(self, connection_number: int):
+        with self._connection_stats_lock:
+            self.connection_stats.pop(connection_number, None)
+
+    def _make_request(self, conn, *args, **kwargs):
+        stats = getattr(conn, "_pvoutput_stats", None)
+        if stats is not None:
+            with self._connection_stats_lock:
+                stats["num_requests"] += 1
+        return super()._make_request(conn, *args, **kwargs)
+
+
+class _StatsHTTPConnectionPool(_ConnectionStatsMixin, HTTPConnectionPool):
+    pass
+
+
+class _StatsHTTPSConnectionPool(_ConnectionStatsMixin, HTTPSConnectionPool):
+    pass
+
+
+class _StatsHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _StatsHTTPConnectionPool,
+            "https": _StatsHTTPSConnectionPool,
+        }
+
+
+def _get_retry() -> Retry:
     max_retry_counts = dict(
         connect=720,  # How many connection-related errors to retry on.
         # Set high because sometimes the network goes down for a
@@ -61,23 +137,91 @@ def _get_session_with_retry() -> requests.Session:
         read=20,  # How many times to retry on read errors.
         status=20,  # How many times to retry on bad status codes.
     )
-    retries = Retry(
+    return Retry(
         total=max(max_retry_counts.values()),
         backoff_factor=0.5,
         status_forcelist=[500, 502, 503, 504],
         **max_retry_counts
     )
+
+
+def _get_session_with_retry(
+    pool_maxsize: int = 10, max_retries: Optional[Retry] = None
+) -> requests.Session:
+    """Create a session which keeps connections alive and retries failed requests.
+
+    The session can be shared between threads: each thread checks out its
+    own connection from the pool.
+
+    Args:
+        pool_maxsize: The maximum number of connections to keep open per host.
+        max_retries: The urllib3 retry policy.  Defaults to `_get_retry()`.
+    """
+    if max_retries is None:
+        max_retries = _get_retry()
     session = requests.Session()
-    session.mount("http://", HTTPAdapter(max_retries=retries))
-    session.mount("https://", HTTPAdapter(max_retries=retries))
+    for prefix in ["http://", "https://"]:
+        adapter = _StatsHTTPAdapter(
+            pool_connections=pool_maxsize, pool_maxsize=pool_maxsize, max_retries=max_retries
+        )
+        session.mount(prefix, adapter)
     return session
 
 
-def _get_response(api_url: str, api_params: Dict, headers: Dict) -> requests.Response:
+def get_connection_pool_stats(session: requests.Session) -> pd.DataFrame:
+    """Report how many requests each open connection in `session` has served.
+
+    Returns:
+        pd.DataFrame with one row per connection.  Columns:
+            host, connection_number, num_requests, num_reused
+        `connection_number` counts the connections opened to each host.
+        `num_reused` is the number of requests which did not need a new
+        handshake.
+    """
+    rows = []
+    for adapter in set(session.adapters.values()):
+        poolmanager = getattr(adapter, "poolmanager", None)
+        if poolmanager is None:
+            continue
+        for pool_key in poolmanager.pools.keys():
+            pool = poolmanager.pools.get(pool_key)
+            if not isinstance(pool, _ConnectionStatsMixin):
+                continue
+            with pool._connection_stats_lock:
+                connection_stats = sorted(pool.connection_stats.items())
+            for connection_number, stats in connection_stats:
+                rows.append(
+                    {
+                        "host": pool.host,
+                        "connection_number": connection_number,
+                        "num_requests": stats["num_requests"],
+                        "num_reused": max(stats["num_requests"] - 1, 0),
+                    }
+                )
+    return pd.DataFrame(rows, columns=["host", "connection_number", "num_requests", "num_reused"])
+
+
+def _get_response(
+    api_url: str,
+    api_params: Dict,
+    headers: Dict,
+    session: Optional[requests.Session] = None,
+    stream: bool = False,
+    transport=None,
+) -> requests.Response:
+    """
+    Args:
+        transport: Optional `transport.Transport`.  If set, then the request
+            is sent using `transport` instead of `session`.
+    """
     api_params_str = "&".join(["{}={}".format(key, value) for key, value in api_params.items()])
     full_api_url = "{}?{}".format(api_url, api_params_str)
-    session = _get_session_with_retry()
-    response = session.get(full_api_url, headers=headers)
+    if transport is not None:
+        response = transport.get(full_api_url, headers=headers, stream=stream)
+    else:
+        if session is None:
+            session = _get_session_with_retry()
+        response = session.get(full_api_url, headers=headers, stream=stream)
     _LOG.debug("response: status_code=%d; headers=%s", response.status_code, response.headers)
     return response
 
@@ -88,11 +232,27 @@ def _print_and_log(msg: str, level: int = logging.INFO):
 
 
 def get_system_ids_in_store(store_filename: str) -> List[int]:
+    """Read from the system catalog, if the store has one (see `pvoutput.catalog`)."""
     if not os.path.exists(store_filename):
         return []
-    with pd.HDFStore(store_filename, mode="r") as store:
-        pv_system_ids = list(store.walk("/timeseries"))[0][2]
-    return pd.to_numeric(pv_system_ids)
+    with _open_backend(store_filename) as backend:
+        return backend.system_ids()
+
+
+def get_system_catalog(store_filename: str) -> pd.DataFrame:
+    """Get the first and last timestamps, number of rows, bytes on disk, and
+    last download time of every PV system in the store.
+
+    Stores written before the system catalog existed are scanned, which
+    may take a while.
+
+    Returns:
+        pd.DataFrame indexed by pv_system_id.  See `pvoutput.catalog`.
+    """
+    with _open_backend(store_filename) as backend:
+        if SYSTEMS_KEY in backend:
+            return read_catalog(backend)
+        return build_catalog(backend)
 
 
 def get_date_ranges_to_download(
@@ -108,24 +268,46 @@ def get_date_ranges_to_download(
         For each DateRange we need to download from
         start_date to end_date inclusive.
     """
-    dates_to_download = list(pd.date_range(start_date, end_date, freq="D"))
-    dates_to_download = datetime_list_to_dates(dates_to_download)
-    dates_already_downloaded = get_dates_already_downloaded(store_filename, system_id)
-    dates_to_download = set(dates_to_download) - set(dates_already_downloaded)
-    missing_dates_for_id = get_missing_dates_for_id(store_filename, system_id)
-    dates_to_download -= set(missing_dates_for_id)
-    return get_date_range_list(list(dates_to_download))
+    if not os.path.exists(store_filename):
+        return [DateRange(start_date, end_date)]
+    with _open_backend(store_filename) as backend:
+        if COVERAGE_KEY in backend:
+            system_coverage = read_coverage(backend, system_id).get(system_id, SystemCoverage())
+        else:
+            # Stores written before the coverage catalog existed.
+            system_coverage = SystemCoverage(
+                downloaded=read_timeseries_coverage(backend, system_id),
+                missing=_get_missing_intervals(backend, system_id),
+            )
+    _LOG.info(
+        "system_id %d: %d missing dates already found",
+        system_id,
+        system_coverage.missing.num_days(),
+    )
+    return system_coverage.date_ranges_to_download(start_date, end_date)
+
+
+def _open_backend(store_filename: str):
+    return open_backend(store_filename, mode="r")
+
+
+def _get_missing_intervals(backend, system_id: int) -> DateIntervalSet:
+    try:
+        missing_dates = backend.read_table(
+            MISSING_DATES_KEY, system_id, columns=[MISSING_START, MISSING_END]
+        )
+    except KeyError:
+        return DateIntervalSet()
+    return missing_dates_coverage(missing_dates).get(system_id, DateIntervalSet())
 
 
 def get_missing_dates_for_id(store_filename: str, system_id: int) -> List:
     if not os.path.exists(store_filename):
         return []
 
-    with pd.HDFStore(store_filename, mode="r") as store:
-        missing_dates_for_id = store.select(
-            key="missing_dates",
-            where="index=system_id",
-            columns=["missing_start_date_PV_localtime", "missing_end_date_PV_localtime"],
+    with _open_backend(store_filename) as backend:
+        missing_dates_for_id = backend.read_table(
+            MISSING_DATES_KEY, system_id, columns=[MISSING_START, MISSING_END]
         )
 
     missing_dates = []
@@ -152,27 +334,11 @@ def get_dates_already_downloaded(store_filename, system_id) -> set:
     if not os.path.exists(store_filename):
         return set([])
 
-    with pd.HDFStore(store_filename, mode="r") as store:
-        key = system_id_to_hdf_key(system_id)
+    with _open_backend(store_filename) as backend:
         try:
-            datetimes = store.select(key=key, columns=["datetime", "query_date"])
+            datetimes = backend.read_timeseries(system_id, columns=["query_date"])
         except KeyError:
             return set([])
         else:
             query_dates = datetime_list_to_dates(datetimes["query_date"].dropna())
             return set(datetimes.index.date).union(query_dates)
-
-
-def system_id_to_hdf_key(system_id: int) -> str:
-    return "/timeseries/{:d}".format(system_id)
-
-
-def sort_and_de_dupe_pv_system(store, pv_system_id):
-    key = system_id_to_hdf_key(pv_system_id)
-    timeseries = store[key]
-    timeseries.sort_index(inplace=True)
-    timeseries = timeseries[~timeseries.index.duplicated()]
-    store.remove(key)
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore", tables.NaturalNameWarning)
-        store.append(key, timeseries, data_columns=True)
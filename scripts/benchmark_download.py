@@ -0,0 +1,270 @@
+"""
+Benchmarks `download_multiple_systems_to_disk` end-to-end against
+`pvoutput.simulator.PVOutputSimulator`, for 10, 100 and 1,000 PV systems over
+several years.
+
+For each number of PV systems, reports requests per second, rows written per
+second, the time spent in each stage (HTTP, parsing, date-range planning,
+HDF5 writes and de-duping / merging), and the peak RSS.  The simulator runs
+in its own process, and each run in a fresh process, so the peak RSS of
+one run doesn't hide the next.
+
+Stage times are summed over all worker threads, and are exclusive: e.g. the
+time spent merging rows into the store counts as 'de_dupe', not as
+'hdf5_write' as well.
+
+Results are saved as JSON.  Pass `--baseline` with the JSON from an earlier
+run to compare, and exit with status 1 if throughput has regressed.
+
+Usage:
+    python scripts/benchmark_download.py [--num-systems 10 100 1000]
+        [--start-date 2016-01-01] [--end-date 2018-12-31] [--num-workers 8]
+        [--output benchmark.json] [--baseline previous.json]
+"""
+
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import pandas as pd
+
+import pvoutput
+from pvoutput import backends
+from pvoutput import pvoutput as pvoutput_module
+from pvoutput import simulator, store
+
+STAGES = ["http", "parse", "planning", "hdf5_write", "de_dupe"]
+
+
+class StageTimer:
+    """Accumulates the exclusive time spent in each stage, across threads."""
+
+    def __init__(self):
+        self.secs = defaultdict(float)
+        self.calls = defaultdict(int)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def wrap(self, stage, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stack = self._local.__dict__.setdefault("stack", [])
+            now = time.perf_counter()
+            if stack:
+                self._add(stack[-1][0], now - stack[-1][1])
+            stack.append([stage, now])
+            try:
+                return func(*args, **kwargs)
+            finally:
+                now = time.perf_counter()
+                self._add(stage, now - stack.pop()[1], call=True)
+                if stack:
+                    stack[-1][1] = now
+
+        return wrapper
+
+    def _add(self, stage, secs, call=False):
+        with self._lock:
+            self.secs[stage] += secs
+            self.calls[stage] += call
+
+
+def install_stage_timer() -> StageTimer:
+    """Wrap the functions which make up each stage of the downloader."""
+    timer = StageTimer()
+    patches = {
+        "http": [(pvoutput_module, "_get_response")],
+        "parse": [
+            (pvoutput_module, "_process_status"),
+            (pvoutput_module, "_process_batch_status"),
+            (pvoutput_module, "_process_batch_status_chunks"),
+        ],
+        "planning": [
+            (store.StoreWriter, "get_date_ranges_to_download"),
+            (pvoutput_module, "merge_date_ranges_to_minimum_years"),
+            (store.StoreWriter, "get_statistic"),
+            (pvoutput_module, "_filter_date_ranges_using_statistic"),
+            (pvoutput_module, "_triage_statistics"),
+        ],
+        "hdf5_write": [(store.StoreWriter, "flush")],
+        "de_dupe": [(backends, "append_and_merge_pv_system")],
+    }
+    for stage, targets in patches.items():
+        for obj, name in targets:
+            setattr(obj, name, timer.wrap(stage, getattr(obj, name)))
+    return timer
+
+
+def count_rows(filename):
+    with pd.HDFStore(filename, mode="r") as hdf:
+        return sum(
+            int(hdf.get_storer(key).nrows) for key in hdf.keys() if key.startswith("/timeseries/")
+        )
+
+
+def run_download(url, num_systems, start_date, end_date, num_workers, output_dir):
+    """Run one benchmark.  Runs in its own process."""
+    timer = install_stage_timer()
+    pv = simulator.make_client(url, pool_maxsize=num_workers)
+    output_filename = os.path.join(output_dir, "pv_{:d}_systems.hdf".format(num_systems))
+    start_time = time.perf_counter()
+    pv.download_multiple_systems_to_disk(
+        system_ids=range(1, num_systems + 1),
+        start_date=start_date,
+        end_date=end_date,
+        output_filename=output_filename,
+        num_workers=num_workers,
+    )
+    wall_secs = time.perf_counter() - start_time
+    num_rows = count_rows(output_filename)
+    num_requests = timer.calls["http"]
+    return {
+        "num_systems": num_systems,
+        "start_date": str(start_date),
+        "end_date": str(end_date),
+        "num_workers": num_workers,
+        "wall_secs": wall_secs,
+        "num_requests": num_requests,
+        "requests_per_sec": num_requests / wall_secs,
+        "rows_written": num_rows,
+        "rows_per_sec": num_rows / wall_secs,
+        "stage_secs": {stage: timer.secs[stage] for stage in STAGES},
+        # ru_maxrss is in KB on Linux.
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "output_size_mb": os.path.getsize(output_filename) / 1024**2,
+    }
+
+
+def serve_simulator(conn, simulator_kwargs):
+    with simulator.PVOutputSimulator(**simulator_kwargs) as sim:
+        conn.send(sim.url)
+        conn.recv()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(__file__), text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(result):
+    print(
+        "{num_systems:>6d} systems: {wall_secs:8.1f} s {requests_per_sec:8.1f} requests/s"
+        " {rows_per_sec:11.0f} rows/s {peak_rss_mb:8.0f} MB peak RSS".format(**result)
+    )
+    print(
+        "        stages (s): "
+        + "  ".join("{}={:.1f}".format(stage, secs) for stage, secs in result["stage_secs"].items())
+    )
+
+
+def compare_with_baseline(results, baseline_filename, max_regression):
+    """Returns True if throughput has regressed by more than max_regression."""
+    with open(baseline_filename) as fh:
+        baseline = {r["num_systems"]: r for r in json.load(fh)["results"]}
+    regressed = False
+    print("\nCompared with {}:".format(baseline_filename))
+    for result in results:
+        old = baseline.get(result["num_systems"])
+        if old is None:
+            continue
+        for metric in ["requests_per_sec", "rows_per_sec"]:
+            ratio = result[metric] / old[metric]
+            flag = ""
+            if ratio < 1 - max_regression:
+                flag = "  REGRESSION"
+                regressed = True
+            print(
+                "{:>6d} systems: {:<17} {:6.2f}x{}".format(
+                    result["num_systems"], metric, ratio, flag
+                )
+            )
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--num-systems", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--start-date", default="2016-01-01")
+    parser.add_argument("--end-date", default="2018-12-31")
+    parser.add_argument("--num-workers", type=int, default=8)
+    parser.add_argument("--latency-secs", type=float, default=0)
+    parser.add_argument("--output", default="benchmark_download.json")
+    parser.add_argument(
+        "--output-dir", help="Where to write the HDF5 files.  Defaults to a temp dir."
+    )
+    parser.add_argument("--baseline", help="JSON from an earlier run to compare with.")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    start_date = pd.Timestamp(args.start_date).date()
+    end_date = pd.Timestamp(args.end_date).date()
+    simulator_kwargs = dict(
+        system_ids=range(1, max(args.num_systems) + 1),
+        start_date=start_date - pd.Timedelta(days=365),
+        end_date=end_date,
+        latency_secs=args.latency_secs,
+        quota=10**9,
+        data_service_quota=10**9,
+        batch_polls_until_ready=0,
+    )
+
+    context = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = context.Pipe()
+    server = context.Process(target=serve_simulator, args=(child_conn, simulator_kwargs))
+    server.start()
+    url = parent_conn.recv()
+
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_dir = args.output_dir or tmp_dir
+            os.makedirs(output_dir, exist_ok=True)
+            for num_systems in args.num_systems:
+                with context.Pool(1) as pool:
+                    result = pool.apply(
+                        run_download,
+                        (url, num_systems, start_date, end_date, args.num_workers, output_dir),
+                    )
+                print_result(result)
+                results.append(result)
+    finally:
+        parent_conn.send("stop")
+        server.join()
+
+    with open(args.output, "w") as fh:
+        json.dump(
+            {
+                "pvoutput_version": pvoutput.__version__,
+                "git_commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "datetime": datetime.utcnow().isoformat(),
+                "results": results,
+            },
+            fh,
+            indent=2,
+        )
+    print("Saved results to", args.output)
+
+    if args.baseline and compare_with_baseline(results, args.baseline, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
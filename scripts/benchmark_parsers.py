@@ -0,0 +1,160 @@
+"""
+Benchmarks the getbatchstatus and getstatus parsers against the parsers
+they replaced, using synthetic responses: a full 366-day getbatchstatus
+response, and a day of 5-minutely getstatus data.  Also measures the peak
+memory of parsing the getbatchstatus response from a full buffer, and
+from a stream.
+
+Usage:
+    python scripts/benchmark_parsers.py [--repeats 20]
+"""
+
+import argparse
+import timeit
+import tracemalloc
+from io import BytesIO, StringIO
+
+import numpy as np
+import pandas as pd
+
+from pvoutput import pvoutput
+
+BATCH_COLUMNS = [
+    "cumulative_energy_gen_Wh",
+    "instantaneous_power_gen_W",
+    "temperature_C",
+    "voltage",
+]
+
+STATUS_COLUMNS = [
+    "cumulative_energy_gen_Wh",
+    "energy_efficiency_kWh_per_kW",
+    "instantaneous_power_gen_W",
+    "average_power_gen_W",
+    "power_gen_normalised",
+    "energy_consumption_Wh",
+    "power_demand_W",
+    "temperature_C",
+    "voltage",
+]
+
+
+def legacy_process_batch_status(pv_system_status_text):
+    """The getbatchstatus parser before it was vectorised."""
+    processed_lines = []
+    for line in pv_system_status_text.split("\n"):
+        line_sections = line.split(";")
+        date = line_sections[0]
+        time_and_data = line_sections[1:]
+        processed_line = [
+            "{date},{payload}".format(date=date, payload=payload) for payload in time_and_data
+        ]
+        processed_lines.extend(processed_line)
+
+    processed_text = "\n".join(processed_lines)
+    return pd.read_csv(
+        StringIO(processed_text),
+        names=["date", "time"] + BATCH_COLUMNS,
+        parse_dates={"datetime": ["date", "time"]},
+        index_col=["datetime"],
+        dtype={col: np.float64 for col in BATCH_COLUMNS},
+    ).sort_index()
+
+
+def legacy_process_status(pv_system_status_text):
+    """The (historic) getstatus parser before it was vectorised."""
+    return pd.read_csv(
+        StringIO(pv_system_status_text),
+        lineterminator=";",
+        names=["date", "time"] + STATUS_COLUMNS,
+        parse_dates={"datetime": ["date", "time"]},
+        index_col=["datetime"],
+        dtype={col: np.float64 for col in STATUS_COLUMNS},
+    ).sort_index()
+
+
+def make_batch_status_text(num_days=366, seed=0):
+    """A getbatchstatus response: one line per day, newest day first."""
+    rng = np.random.default_rng(seed)
+    times = pd.date_range("2019-01-01 04:00", "2019-01-01 21:55", freq="5T").strftime("%H:%M")
+    lines = []
+    for date in pd.date_range("2019-01-01", periods=num_days, freq="D")[::-1]:
+        power = rng.integers(0, 4000, size=len(times))
+        energy = np.cumsum(power) // 12
+        records = ["{},{:d},{:d}".format(time, e, p) for time, e, p in zip(times, energy, power)]
+        lines.append(date.strftime("%Y%m%d") + ";" + ";".join(records))
+    return "\n".join(lines)
+
+
+def make_status_text(seed=0):
+    """A historic getstatus response for one day."""
+    rng = np.random.default_rng(seed)
+    times = pd.date_range("2019-01-01 04:00", "2019-01-01 21:55", freq="5T").strftime("%H:%M")
+    records = [
+        "20190101,{},{:d},0.1,{:d},24,0.2,NaN,NaN,12.5,240.1".format(time, i * 10, power)
+        for i, (time, power) in enumerate(zip(times, rng.integers(0, 4000, size=len(times))))
+    ]
+    return ";".join(records[::-1])
+
+
+def benchmark(name, text, legacy_func, new_func, repeats):
+    pd.testing.assert_frame_equal(legacy_func(text), new_func(text))
+    legacy_secs = min(timeit.repeat(lambda: legacy_func(text), number=1, repeat=repeats))
+    new_secs = min(timeit.repeat(lambda: new_func(text), number=1, repeat=repeats))
+    print(
+        "{:<40} {:>8.2f} ms {:>8.2f} ms {:>7.1f}x".format(
+            name, legacy_secs * 1e3, new_secs * 1e3, legacy_secs / new_secs
+        )
+    )
+
+
+def peak_memory_mb(func, *args):
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1e6
+
+
+def parse_full_buffer(content: bytes):
+    return pvoutput._process_batch_status(content.decode("latin1").strip())
+
+
+def parse_stream(content: bytes):
+    raw = BytesIO(content)
+    chunks = iter(lambda: raw.read(pvoutput.STREAM_CHUNK_SIZE).decode("latin1"), "")
+    return pvoutput._process_batch_status_chunks(chunks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    print("{:<40} {:>11} {:>11} {:>8}".format("", "legacy", "vectorised", "speedup"))
+    batch_text = make_batch_status_text()
+    benchmark(
+        "getbatchstatus (366 days, {:d} KB)".format(len(batch_text) // 1024),
+        batch_text,
+        legacy_process_batch_status,
+        pvoutput._process_batch_status,
+        args.repeats,
+    )
+    benchmark(
+        "getstatus (1 day)",
+        make_status_text(),
+        legacy_process_status,
+        pvoutput._process_status,
+        args.repeats,
+    )
+
+    content = batch_text.encode("latin1")
+    pd.testing.assert_frame_equal(parse_full_buffer(content), parse_stream(content))
+    print()
+    print("Peak memory parsing getbatchstatus (excluding the response bytes):")
+    print("  full buffer: {:6.1f} MB".format(peak_memory_mb(parse_full_buffer, content)))
+    print("  streamed:    {:6.1f} MB".format(peak_memory_mb(parse_stream, content)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Builds (or updates) a time-major panel from a download store.
+
+Only the days downloaded since the last run are copied, so this can be
+run after every download.  See `pvoutput.panel.PanelStore`.
+
+Usage:
+    python scripts/build_panel.py --store pv.hdf --panel pv_panel
+        [--variables instantaneous_power_gen_W ...] [--origin 2010-01-01]
+"""
+
+import argparse
+
+from pvoutput.panel import DEFAULT_VARIABLES, PanelStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--store", required=True)
+    parser.add_argument("--panel", required=True)
+    parser.add_argument(
+        "--variables",
+        nargs="+",
+        default=DEFAULT_VARIABLES,
+        help="Only used when creating a new panel.",
+    )
+    parser.add_argument(
+        "--origin", default="2010-01-01", help="Only used when creating a new panel."
+    )
+    args = parser.parse_args()
+
+    panel = PanelStore(args.panel, variables=args.variables, origin=args.origin)
+    num_systems_updated = panel.update(args.store)
+    print("Updated {:d} PV systems.".format(num_systems_updated))
+    print("The panel has {:d} PV systems.".format(len(panel.system_ids)))
+
+
+if __name__ == "__main__":
+    main()
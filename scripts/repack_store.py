@@ -0,0 +1,86 @@
+"""
+Re-writes a store into a new, compact HDF5 file, and reports the gains.
+
+The source is only read, so this is safe to run on a copy of a store while
+downloads carry on writing to the original.  See `pvoutput.repack`.
+
+Usage:
+    python scripts/repack_store.py --source pv_copy.hdf --output pv_repacked.hdf
+        [--complib blosc:zstd] [--complevel 5] [--num-workers 4]
+        [--num-systems-to-time 100]
+"""
+
+import argparse
+import random
+import time
+
+import tables
+
+from pvoutput.backends import open_backend
+from pvoutput.repack import repack_store
+
+
+def time_reads(filename, system_ids):
+    """Returns rows per second, reading the whole timeseries of each PV system."""
+    with open_backend(filename, mode="r") as backend:
+        start_time = time.perf_counter()
+        num_rows = sum(len(backend.read_timeseries(pv_system_id)) for pv_system_id in system_ids)
+        return num_rows / (time.perf_counter() - start_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--source", required=True)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--complib", default="blosc:zstd", choices=tables.filters.all_complibs)
+    parser.add_argument("--complevel", type=int, default=5)
+    parser.add_argument("--num-workers", type=int, default=4)
+    parser.add_argument(
+        "--num-systems-to-time",
+        type=int,
+        default=100,
+        help="Time reading this many randomly chosen PV systems, before and after.",
+    )
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    result = repack_store(
+        args.source,
+        args.output,
+        complib=args.complib,
+        complevel=args.complevel,
+        num_workers=args.num_workers,
+    )
+    print(
+        "Repacked {:d} PV systems in {:.1f} s.  Removed {:d} duplicate rows.".format(
+            result["num_systems"],
+            time.perf_counter() - start_time,
+            result["num_rows_before"] - result["num_rows_after"],
+        )
+    )
+    print(
+        "Size: {:,.1f} MB -> {:,.1f} MB ({:.0%} smaller).".format(
+            result["bytes_before"] / 1024**2,
+            result["bytes_after"] / 1024**2,
+            1 - result["bytes_after"] / max(result["bytes_before"], 1),
+        )
+    )
+
+    with open_backend(args.output, mode="r") as backend:
+        system_ids = backend.system_ids()
+    system_ids = random.sample(system_ids, min(args.num_systems_to_time, len(system_ids)))
+    if system_ids:
+        rows_per_sec_before = time_reads(args.source, system_ids)
+        rows_per_sec_after = time_reads(args.output, system_ids)
+        print(
+            "Reading {:d} PV systems: {:,.0f} rows/s -> {:,.0f} rows/s ({:.1f}x).".format(
+                len(system_ids),
+                rows_per_sec_before,
+                rows_per_sec_after,
+                rows_per_sec_after / rows_per_sec_before,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
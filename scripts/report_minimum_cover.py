@@ -0,0 +1,91 @@
+"""
+Reports how many getbatchstatus requests `merge_date_ranges_to_minimum_years`
+saves compared with `merge_date_ranges_to_years`, for every PV system in an
+existing HDF5 store.
+
+For each PV system, works out which dates still need downloading between
+--start-date and --end-date, and trims them to the dates which the PV
+system's statistics say have data, like `download_multiple_systems_to_disk`.
+Then counts the year-long windows each method needs to cover them.  Unlike
+the downloader, this sends no API requests: it uses the statistics cached in
+the store, even if they're old, and PV systems with no cached statistics
+aren't trimmed.
+
+Usage:
+    python scripts/report_minimum_cover.py --store pv.hdf
+        [--start-date 2010-01-01] [--end-date 2019-12-31] [--output report.csv]
+        [--min-data-availability 0.5]
+"""
+
+import argparse
+
+import pandas as pd
+
+from pvoutput.backends import open_backend
+from pvoutput.daterange import merge_date_ranges_to_minimum_years, merge_date_ranges_to_years
+from pvoutput.pvoutput import _filter_date_ranges_using_statistic
+from pvoutput.statistics import StatisticsCache
+from pvoutput.utils import get_date_ranges_to_download, get_system_ids_in_store
+
+# Each getbatchstatus request is polled once a minute until it's ready.
+SECS_PER_REQUEST = 60
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--store", required=True)
+    parser.add_argument("--start-date", default="2010-01-01")
+    parser.add_argument("--end-date", default=pd.Timestamp.now().strftime("%Y-%m-%d"))
+    parser.add_argument("--output", help="Optional CSV filename for the per-system report.")
+    parser.add_argument(
+        "--min-data-availability",
+        type=float,
+        default=0.5,
+        help="As for download_multiple_systems_to_disk.",
+    )
+    args = parser.parse_args()
+
+    statistics = StatisticsCache()
+    with open_backend(args.store, mode="r") as backend:
+        statistics.load(backend)
+
+    rows = []
+    for pv_system_id in get_system_ids_in_store(args.store):
+        date_ranges = get_date_ranges_to_download(
+            args.store, pv_system_id, args.start_date, args.end_date
+        )
+        stats = statistics.get(pv_system_id)
+        if date_ranges and stats is not None:
+            date_ranges = _filter_date_ranges_using_statistic(
+                pv_system_id, date_ranges, stats, args.min_data_availability
+            )
+        rows.append(
+            {
+                "pv_system_id": pv_system_id,
+                "num_date_ranges": len(date_ranges),
+                "greedy_requests": len(merge_date_ranges_to_years(date_ranges)),
+                "minimum_requests": len(merge_date_ranges_to_minimum_years(date_ranges)),
+            }
+        )
+    report = pd.DataFrame(rows).set_index("pv_system_id")
+    report["requests_saved"] = report["greedy_requests"] - report["minimum_requests"]
+
+    total = report.sum()
+    print("PV systems:                {:d}".format(len(report)))
+    print("Systems with savings:      {:d}".format((report["requests_saved"] > 0).sum()))
+    print("Requests (greedy):         {:d}".format(total["greedy_requests"]))
+    print("Requests (minimum cover):  {:d}".format(total["minimum_requests"]))
+    if total["greedy_requests"]:
+        print(
+            "Requests saved:            {:d} ({:.1%}), about {:.1f} hours of polling".format(
+                total["requests_saved"],
+                total["requests_saved"] / total["greedy_requests"],
+                total["requests_saved"] * SECS_PER_REQUEST / 3600,
+            )
+        )
+    if args.output:
+        report.to_csv(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,4 +15,5 @@ setup(
         "requests",
         "beautifulsoup4",
     ],
+    extras_require={"parquet": ["pyarrow"]},
 )